@@ -0,0 +1,100 @@
+"""Microbenchmarks for blackjack hand evaluation and whole rounds: the legacy
+string cards + bj_total() against integer cards, incremental Hand and Shoe.
+
+    python benchmarks/bench_blackjack.py --rounds 200000
+"""
+import argparse, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from blackjack import RANKS, BlackjackGame, Hand, Shoe
+
+deck = [str(x) for x in range(2, 11)] + ["J", "Q", "K", "A"]
+
+
+def bj_total(cards):
+    # The evaluator BlackjackView used before blackjack.Hand
+    total, aces = 0, 0
+    for c in cards:
+        if c in ["J", "Q", "K"]:
+            total += 10
+        elif c == "A":
+            total += 11
+            aces += 1
+        else:
+            total += int(c)
+    while total > 21 and aces:
+        total -= 10
+        aces -= 1
+    return total
+
+
+def legacy_round(rng):
+    player = [rng.choice(deck), rng.choice(deck)]
+    dealer = [rng.choice(deck), rng.choice(deck)]
+    while bj_total(player) < 17:
+        player.append(rng.choice(deck))
+    pt = bj_total(player)
+    if pt > 21:
+        return 0
+    dt = bj_total(dealer)
+    while dt < 17:
+        dealer.append(rng.choice(deck))
+        dt = bj_total(dealer)
+    return 2 if dt > 21 or pt > dt else 1 if pt == dt else 0
+
+
+def shoe_round(shoe):
+    game = BlackjackGame(1, shoe)
+    while game.player.total < 17:
+        game.hit()
+    if game.player.total > 21:
+        return 0
+    return game.stand().payout
+
+
+def rate(fn, n):
+    started = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return n / (time.perf_counter() - started)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rounds", type=int, default=200000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    # Hit sequences of 2-6 cards, evaluated after every card as the bot does.
+    hands = [[rng.randrange(13) for _ in range(rng.randint(2, 6))] for _ in range(args.rounds)]
+    string_hands = [[RANKS[c] for c in h] for h in hands]
+    for h, sh in zip(hands[:10000], string_hands):
+        assert Hand(h).total == bj_total(sh)
+
+    def legacy_eval():
+        for sh in string_hands:
+            cards = []
+            for c in sh:
+                cards.append(c)
+                bj_total(cards)
+
+    def hand_eval():
+        for h in hands:
+            hand = Hand()
+            for c in h:
+                hand.add(c)
+                hand.total
+
+    started = time.perf_counter(); legacy_eval(); legacy = time.perf_counter() - started
+    started = time.perf_counter(); hand_eval(); new = time.perf_counter() - started
+    print(f"hit sequences: bj_total {args.rounds / legacy:12,.0f}/s | Hand {args.rounds / new:12,.0f}/s | {legacy / new:4.1f}x")
+
+    shoe = Shoe(decks=6, penetration=0.75, rng=rng)
+    legacy = rate(lambda: legacy_round(rng), args.rounds)
+    new = rate(lambda: shoe_round(shoe), args.rounds)
+    print(f"whole rounds:  bj_total {legacy:12,.0f}/s | Shoe {new:12,.0f}/s | {new / legacy:4.1f}x ({shoe.shuffles} reshuffles)")
+
+
+if __name__ == "__main__":
+    main()
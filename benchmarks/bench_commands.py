@@ -0,0 +1,183 @@
+"""Command benchmark suite: drives bot.py's slash commands and buttons through
+the offline harness with many concurrent simulated users and reports
+throughput, p50/p99 latency and bytes written per command.
+
+    python benchmarks/bench_commands.py --backend sqlite --users 2000 --concurrency 500
+    python benchmarks/bench_commands.py --save base.json
+    python benchmarks/bench_commands.py --compare base.json   # exit 1 on a regression
+
+Bytes written are what the process passed to write() (storage, journal,
+snapshots) divided by the command count, after buffered XP, write-behind
+saves and the journal were flushed.
+
+load_bot lifts the casino and /daily rate limits so the game scenarios
+measure the games. "limited" is /slots with the default casino limits put
+back, measuring the rejection path on purpose; it is left out of "mixed".
+"""
+import argparse, asyncio, json, os, random, sys, tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+import harness
+from metrics import Histogram
+from ratelimit import parse_rate
+
+DEFAULT_LIMITS = {"casino": ("5/10", "user"), "casino_guild": ("200/10", "guild")}
+
+
+def build_scenarios(h, bot, users):
+    def member(uid):
+        return h.member(uid)
+
+    async def balance(uid):
+        await h.command("balance", member(uid))
+
+    async def daily(uid):
+        await h.command("daily", member(uid))
+
+    async def send(uid):
+        await h.command("send", member(uid), member=member(uid % users + 1), amount=1)
+
+    async def leaderboard(uid):
+        await h.command("leaderboard", member(uid), page=uid % 5 + 1, board=random.choice(("money", "level")))
+
+    async def limited(uid):
+        await h.command("slots", member(uid), bet=5)
+
+    async def roulette(uid):
+        await h.command("roulette", member(uid), color=random.choice(("red", "black")), bet=5)
+
+    async def slots(uid):
+        await h.command("slots", member(uid), bet=5)
+
+    async def coinflip(uid):
+        await h.command("coinflip", member(uid), choice=random.choice(("heads", "tails")), bet=5)
+
+    async def dice(uid):
+        await h.command("dice", member(uid), guess=random.randint(1, 6), bet=5)
+
+    async def highlow(uid):
+        await h.command("highlow", member(uid), guess=random.choice(("high", "low")), bet=5)
+
+    async def blackjack(uid):
+        await h.command("blackjack", member(uid), bet=5)
+        session = bot.sessions.get(uid)
+        if session is not None and session.view is not None:
+            view = session.view
+            if random.random() < 0.5:
+                await h.press(view, "hit", member(uid))
+            if bot.sessions.get(uid) is not None:
+                await h.press(view, "stand", member(uid))
+
+    panel = bot.TicketView()
+    staff = h.member(users + 1, admin=True)
+
+    async def ticket(uid):
+        await h.press(panel, "open_ticket", member(uid))
+        channel_id = bot.ticket_service.channel_of(uid)
+        channel = h.guild.get_channel(channel_id) if channel_id else None
+        if channel is not None:
+            await h.command("close", staff, channel=channel)
+
+    return {f.__name__: f for f in (balance, daily, send, leaderboard, roulette, slots, coinflip, dice, highlow, blackjack, ticket, limited)}
+
+
+async def run_suite(args):
+    bot = harness.load_bot(args.workdir, backend=args.backend)
+    h = harness.Harness(bot, latency=args.latency)
+    await h.start()
+    for uid in range(1, args.users + 1):
+        await bot.ensure_user(uid)
+    await h.settle()
+    scenarios = build_scenarios(h, bot, args.users)
+    names = args.only.split(",") if args.only else list(scenarios)
+    mixed = [scenarios[n] for n in names if n != "limited"]
+
+    async def mix(uid):
+        await random.choice(mixed)(uid)
+
+    results = []
+    for name in names + (["mixed"] if len(mixed) > 1 else []):
+        scenario = mix if name == "mixed" else scenarios[name]
+        if name == "limited":
+            lifted = dict(bot.limits.limiters)
+            for limiter, (rate, scope) in DEFAULT_LIMITS.items():
+                bot.limits.add(limiter, *parse_rate(rate), scope=scope)
+        written = harness.write_bytes()
+        elapsed, latencies = await harness.drive(scenario, args.users, args.ops, args.concurrency)
+        await h.settle()
+        if name == "limited":
+            bot.limits.limiters.update(lifted)
+        written = harness.write_bytes() - written if written is not None else None
+        hist = Histogram()
+        for seconds in latencies:
+            hist.observe(seconds)
+        results.append({
+            "name": name, "ops": len(latencies), "ops_per_s": len(latencies) / elapsed,
+            "p50_ms": hist.quantile(0.5) * 1000, "p99_ms": hist.quantile(0.99) * 1000,
+            "bytes_per_op": written / len(latencies) if written is not None else None,
+        })
+    await h.close()
+    return results
+
+
+def report(results, baseline=None, tolerance=0.25):
+    """Print the table; returns the names that regressed against `baseline`."""
+    base = {r["name"]: r for r in baseline or []}
+    regressed = []
+    print(f"{'command':<12}{'ops/s':>10}{'p50 ms':>9}{'p99 ms':>9}{'B/op':>9}")
+    for r in results:
+        line = f"{r['name']:<12}{r['ops_per_s']:>10,.0f}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}"
+        line += f"{r['bytes_per_op']:>9,.0f}" if r["bytes_per_op"] is not None else f"{'-':>9}"
+        b = base.get(r["name"])
+        if b:
+            worse = []
+            if r["ops_per_s"] < b["ops_per_s"] * (1 - tolerance):
+                worse.append(f"ops/s {b['ops_per_s']:,.0f}")
+            if r["p99_ms"] > b["p99_ms"] * (1 + tolerance):
+                worse.append(f"p99 {b['p99_ms']:.2f}")
+            if r["bytes_per_op"] and b["bytes_per_op"] and r["bytes_per_op"] > b["bytes_per_op"] * (1 + tolerance):
+                worse.append(f"B/op {b['bytes_per_op']:,.0f}")
+            if worse:
+                regressed.append(r["name"])
+                line += "  REGRESSED (was " + ", ".join(worse) + ")"
+        print(line)
+    return regressed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--backend", choices=("sqlite", "json"), default="sqlite")
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--ops", type=int, default=5000, help="commands per scenario")
+    ap.add_argument("--concurrency", type=int, default=500, help="simulated users in flight at once")
+    ap.add_argument("--latency", type=float, default=0.0, help="fake Discord HTTP latency for channel calls (s)")
+    ap.add_argument("--only", default="", help="comma-separated scenarios (default: all)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--workdir", default=None, help="keep data files here instead of a temp dir")
+    ap.add_argument("--save", default=None, help="write results to this JSON file")
+    ap.add_argument("--compare", default=None, help="baseline JSON from --save")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before flagging")
+    args = ap.parse_args()
+    random.seed(args.seed)
+    paths = [os.path.abspath(p) if p else None for p in (args.save, args.compare)]
+    with tempfile.TemporaryDirectory() as tmp:
+        args.workdir = os.path.abspath(args.workdir or tmp)
+        results = asyncio.run(run_suite(args))
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    save, compare = paths
+    baseline = None
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)["results"]
+    regressed = report(results, baseline, args.tolerance)
+    if save:
+        with open(save, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("save", "compare", "workdir")},
+                       "results": results}, f, indent=2)
+    if regressed:
+        print(f"Regressed: {', '.join(regressed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compare the legacy full sort in /leaderboard with the incremental RankIndex.
+
+    python benchmarks/bench_leaderboard.py --sizes 10000 100000 1000000
+"""
+import argparse, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from leaderboard import RankIndex
+
+
+def timeit(fn, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def legacy_top(balances, levels):
+    top = sorted(
+        balances.items(),
+        key=lambda kv: kv[1].get("wallet", 0) + kv[1].get("bank", 0),
+        reverse=True
+    )[:10]
+    return [(uid, vals["wallet"] + vals["bank"], levels.get(uid, 1)) for uid, vals in top]
+
+
+def bench(n, rng):
+    balances = {str(i): {"wallet": rng.randint(0, 10**6), "bank": rng.randint(0, 10**6)} for i in range(n)}
+    levels = {str(i): rng.randint(1, 50) for i in range(n)}
+    uids = list(range(n))
+
+    index = RankIndex()
+    started = time.perf_counter()
+    index.load((uid, b["wallet"] + b["bank"]) for uid, b in balances.items())
+    build = time.perf_counter() - started
+
+    repeat = max(1, 200000 // n)
+    legacy = timeit(lambda: legacy_top(balances, levels), repeat)
+    top = timeit(lambda: index.top(10, offset=rng.randrange(n)), 2000)
+    rank = timeit(lambda: index.rank(rng.choice(uids)), 2000)
+    update = timeit(lambda: index.adjust(rng.choice(uids), rng.randint(-1000, 1000)), 2000)
+
+    print(f"{n:>9,} users | sorted(): {legacy * 1e3:9.2f} ms | index top10: {top * 1e6:6.1f} µs"
+          f" | rank: {rank * 1e6:6.1f} µs | update: {update * 1e6:6.1f} µs | build: {build:6.2f} s")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 1000000])
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    for n in args.sizes:
+        bench(n, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Join raid against one welcome channel: inline channel.send per member
+against outbox.Outbox, with a fake channel that enforces Discord's 5 messages
+per 5 seconds (time scaled down by --scale).
+
+    python benchmarks/bench_outbox.py --joins 500
+"""
+import argparse, asyncio, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from metrics import Metrics
+from outbox import Outbox
+
+
+class FakeChannel:
+    """Sends take `latency`; past `rate` per `per` seconds a send waits for
+    the bucket to reset, like discord.py does after a 429."""
+
+    def __init__(self, rate, per, latency):
+        self.id = 1
+        self.rate, self.per, self.latency = rate, per, latency
+        self.window_start = 0.0
+        self.used = 0
+        self.messages = []
+        self.limited = 0
+        self.lock = asyncio.Lock()  # discord.py holds the route's bucket while it is exhausted
+
+    async def send(self, content=None, **kwargs):
+        async with self.lock:
+            await self._send(content)
+
+    async def _send(self, content):
+        now = time.perf_counter()
+        if now - self.window_start >= self.per:
+            self.window_start, self.used = now, 0
+        if self.used >= self.rate:
+            self.limited += 1
+            await asyncio.sleep(self.window_start + self.per - now)
+            self.window_start, self.used = time.perf_counter(), 0
+        self.used += 1
+        await asyncio.sleep(self.latency)
+        self.messages.append(content)
+
+
+async def raid(joins, spread, handler):
+    # Member events arrive over `spread` seconds; each runs as its own task like discord.py dispatch
+    started = time.perf_counter()
+    waits = []
+
+    async def one(i):
+        t = time.perf_counter()
+        await handler(f"<@{i}>")
+        waits.append(time.perf_counter() - t)
+
+    tasks = []
+    for i in range(joins):
+        tasks.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(random.random() * 2 * spread / joins)
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - started, sorted(waits)
+
+
+def welcome_text(mentions, more):
+    return f"Welcome {', '.join(mentions)}{f' (+{more} more)' if more else ''}!"
+
+
+async def main_async(args):
+    per = 5.0 / args.scale
+    latency = 0.08 / args.scale
+
+    inline = FakeChannel(5, per, latency)
+    elapsed, waits = await raid(args.joins, args.spread / args.scale, lambda m: inline.send(welcome_text([m], 0)))
+    print(f"inline  {len(inline.messages):5} messages | handler p50 {waits[len(waits) // 2] * args.scale:7.2f}s "
+          f"max {waits[-1] * args.scale:7.2f}s | rate-limited sends {inline.limited} | {elapsed * args.scale:.1f}s")
+
+    channel = FakeChannel(5, per, latency)
+    outbox = Outbox(Metrics(), window=1.0 / args.scale, per=per)
+    elapsed, waits = await raid(args.joins, args.spread / args.scale,
+                                lambda m: outbox.announce(channel, "welcome", m, welcome_text))
+    await outbox.close(timeout=60)
+    delay = outbox.metrics.histograms[("outbox", "welcome")]
+    print(f"outbox  {len(channel.messages):5} messages | handler p50 {waits[len(waits) // 2] * args.scale:7.2f}s "
+          f"max {waits[-1] * args.scale:7.2f}s | rate-limited sends {channel.limited} | "
+          f"delivery p95 {delay.quantile(0.95) * args.scale:.1f}s, merged {outbox.coalesced}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--joins", type=int, default=500)
+    ap.add_argument("--spread", type=float, default=30.0, help="seconds the raid is spread over")
+    ap.add_argument("--scale", type=float, default=20.0, help="run this many times faster than real time")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    random.seed(args.seed)
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
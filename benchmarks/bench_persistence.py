@@ -0,0 +1,80 @@
+"""Compare the legacy save-on-every-mutation path with the write-behind store.
+
+Simulates `/send` (three saves per command in the legacy path) against a
+data file holding `--users` members and reports commands per second.
+
+    python benchmarks/bench_persistence.py --users 20000 --seconds 5
+"""
+import argparse, asyncio, json, os, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from persistence import WriteBehindStore
+
+
+def make_data(users):
+    return {
+        "balances": {str(i): {"wallet": 500, "bank": 0} for i in range(users)},
+        "xp": {str(i): 0 for i in range(users)},
+        "levels": {str(i): 1 for i in range(users)},
+        "config": {},
+        "tickets": {},
+        "ticket_counts": {},
+    }
+
+
+def send(data, src, dst, save):
+    bal = data["balances"]
+    bal[src]["wallet"] -= 1; save()
+    bal[dst]["wallet"] += 1; save()
+    data["xp"][src] += 5; save()
+
+
+def bench_legacy(path, users, seconds):
+    data = make_data(users)
+
+    def save_data():
+        with open(path, "w") as f:
+            json.dump(data, f, indent=4)
+
+    n, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        send(data, str(n % users), str((n + 1) % users), save_data)
+        n += 1
+    return n / seconds
+
+
+async def bench_write_behind(path, users, seconds, interval, max_dirty):
+    data = make_data(users)
+    store = WriteBehindStore(path, data, interval=interval, max_dirty=max_dirty)
+    store.start()
+    n, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        send(data, str(n % users), str((n + 1) % users), store.mark_dirty)
+        n += 1
+        if n % 256 == 0:
+            await asyncio.sleep(0)  # let the flusher run, as other interactions would
+    await store.close()
+    return n / seconds, store.flushes
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=20000)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--interval", type=float, default=2.0)
+    ap.add_argument("--max-dirty", type=int, default=1000)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "data.json")
+        legacy = bench_legacy(path, args.users, args.seconds)
+        new, flushes = asyncio.run(bench_write_behind(path, args.users, args.seconds, args.interval, args.max_dirty))
+
+    print(f"users={args.users} seconds={args.seconds}")
+    print(f"legacy save_data():  {legacy:12.1f} /send per second")
+    print(f"write-behind store:  {new:12.1f} /send per second ({flushes} flushes)")
+    print(f"speedup:             {new / legacy:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Sqlite storage with and without the user cache, for a database of
+`--users` users of which `--active` are active.
+
+Reports the time to open storage (which doesn't depend on the user count),
+economy calls per second over the active users, and how many users end up
+resident in memory.
+
+    python benchmarks/bench_usercache.py --users 200000 --active 2000 --cache-size 5000
+"""
+import argparse, asyncio, os, random, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from storage import create_storage
+from usercache import CachedStorage
+
+
+async def fill(path, users, chunk=10000):
+    storage = create_storage("sqlite", db_path=path)
+    await storage.open()
+    for start in range(0, users, chunk):
+        await storage.update_users({uid: {"wallet": 500, "xp": uid % 1000} for uid in range(start, min(start + chunk, users))})
+    await storage.close()
+
+
+async def run(path, active, ops, seed, cache_size):
+    storage = create_storage("sqlite", db_path=path)
+    if cache_size:
+        storage = CachedStorage(storage, max_users=cache_size)
+    started = time.perf_counter()
+    await storage.open()
+    opened = time.perf_counter() - started
+    rng = random.Random(seed)
+    hot = rng.sample(range(active * 10), active)
+    started = time.perf_counter()
+    for _ in range(ops):
+        uid, other = rng.choice(hot), rng.choice(hot)
+        op = rng.randrange(3)
+        if op == 0:
+            await storage.get_user(uid)
+        elif op == 1:
+            await storage.adjust_wallets({uid: -1, other: 1}, require={uid: 1})
+        else:
+            await storage.add_xp(uid, 5)
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    await storage.close()
+    closed = time.perf_counter() - started
+    return opened, ops / elapsed, closed, storage
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=200_000)
+    ap.add_argument("--active", type=int, default=2000)
+    ap.add_argument("--ops", type=int, default=20000)
+    ap.add_argument("--cache-size", type=int, default=5000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        asyncio.run(fill(path, args.users))
+        for label, size in (("no cache", 0), (f"cache {args.cache_size:,}", args.cache_size)):
+            opened, rate, closed, storage = asyncio.run(run(path, args.active, args.ops, args.seed, size))
+            line = f"{label:<14} open {opened * 1000:7.1f} ms  {rate:10,.0f} ops/s  close {closed * 1000:7.1f} ms"
+            if size:
+                line += f"  resident {len(storage):,} users, hit rate {storage.hit_ratio():.1%}"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
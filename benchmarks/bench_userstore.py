@@ -0,0 +1,66 @@
+"""Memory per user: the data.json dict layout against userstore.UserTable.
+
+    python benchmarks/bench_userstore.py --users 1000000
+"""
+import argparse, gc, os, random, sys, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from storage import new_user
+from userstore import UserTable
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    obj = build()
+    elapsed = time.perf_counter() - started
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return obj, size, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=1_000_000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    # Snowflake-sized IDs and realistic values, generated outside the traced region
+    uids = [rng.getrandbits(60) for _ in range(args.users)]
+    values = [(rng.randrange(10**7), rng.randrange(10**6), rng.randrange(2 * 10**9), rng.randrange(2000), rng.randrange(1, 60))
+              for _ in range(args.users)]
+
+    def build_dicts():
+        balances, xp, levels = {}, {}, {}
+        for uid, (w, b, d, x, l) in zip(uids, values):
+            key = str(uid)
+            balances[key] = {"wallet": w, "bank": b, "last_daily": d}
+            xp[key] = x
+            levels[key] = l
+        return balances, xp, levels
+
+    def build_table():
+        table = UserTable(new_user())
+        for uid, (w, b, d, x, l) in zip(uids, values):
+            table.insert(uid, wallet=w, bank=b, last_daily=d, xp=x, level=l)
+        return table
+
+    legacy, legacy_bytes, legacy_time = measure(build_dicts)
+    del legacy
+    table, table_bytes, table_time = measure(build_table)
+    n = args.users
+    print(f"dict layout  {legacy_bytes / 2**20:8.1f} MiB  {legacy_bytes / n:6.0f} B/user  built in {legacy_time:.2f}s")
+    print(f"UserTable    {table_bytes / 2**20:8.1f} MiB  {table_bytes / n:6.0f} B/user  built in {table_time:.2f}s"
+          f"  (columns {table.nbytes() / 2**20:.1f} MiB)")
+    print(f"saving       {1 - table_bytes / legacy_bytes:.0%}")
+
+    probe = uids[: 100000]
+    started = time.perf_counter()
+    for uid in probe:
+        table.get(uid)
+    print(f"get()        {len(probe) / (time.perf_counter() - started):12,.0f} lookups/s")
+
+
+if __name__ == "__main__":
+    main()
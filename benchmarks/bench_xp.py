@@ -0,0 +1,76 @@
+"""XP curve and accrual benchmarks: the legacy one-level-at-a-time level_up
+against the closed form, and per-grant storage writes against XpAccrual
+batches on the sqlite backend.
+
+    python benchmarks/bench_xp.py --grants 20000
+"""
+import argparse, asyncio, os, random, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from storage import SqliteStorage
+from xp import XpAccrual, level_up, split_total_xp, total_xp
+
+
+def legacy_level_up(xp, level):
+    # storage.level_up before xp.py
+    required = 50 * level
+    while xp >= required:
+        xp -= required
+        level += 1
+        required = 50 * level
+    return xp, level
+
+
+def bench_curve(rng):
+    totals = [rng.randrange(10**k) for k in range(1, 10) for _ in range(2000)]
+    for t in totals:
+        assert legacy_level_up(t, 1) == level_up(t, 1)
+        level, xp = split_total_xp(t)
+        assert total_xp(xp, level) == t
+    for label, fn in (("legacy loop", legacy_level_up), ("closed form", level_up)):
+        started = time.perf_counter()
+        for t in totals:
+            fn(t, 1)
+        print(f"{label:12} {len(totals) / (time.perf_counter() - started):12,.0f} level lookups/s (totals up to 1e9)")
+
+
+async def bench_accrual(grants, users, rng):
+    plan = [(rng.randrange(users), rng.randint(1, 30)) for _ in range(grants)]
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = SqliteStorage(os.path.join(tmp, "direct.db"))
+        await storage.open()
+        started = time.perf_counter()
+        for uid, amount in plan:
+            await storage.add_xp(uid, amount)
+        direct = time.perf_counter() - started
+        await storage.close()
+
+        storage = SqliteStorage(os.path.join(tmp, "batched.db"))
+        await storage.open()
+        buffer = XpAccrual(storage.add_xp_many, interval=0.05)
+        buffer.start()
+        started = time.perf_counter()
+        for i, (uid, amount) in enumerate(plan):
+            buffer.grant(uid, amount)
+            if i % 100 == 0:
+                await asyncio.sleep(0)  # commands interleave with the flusher
+        await buffer.close()
+        batched = time.perf_counter() - started
+        await storage.close()
+    print(f"per-grant   {grants / direct:12,.0f} grants/s ({grants} transactions)")
+    print(f"accrual     {grants / batched:12,.0f} grants/s ({buffer.batches} transactions)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--grants", type=int, default=20000)
+    ap.add_argument("--users", type=int, default=2000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+    bench_curve(rng)
+    asyncio.run(bench_accrual(args.grants, args.users, rng))
+
+
+if __name__ == "__main__":
+    main()
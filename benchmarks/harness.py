@@ -0,0 +1,267 @@
+"""Offline driver for bot.py: fake Interaction, Member, Guild and Channel
+objects that are enough to call the slash-command callbacks and view buttons
+directly, without a Discord connection.
+
+    import harness
+    bot = harness.load_bot(workdir, backend="sqlite")
+    h = harness.Harness(bot)
+    await h.start()
+    await h.command("balance", h.member(1))
+    await h.close()
+
+load_bot() has to run before anything else imports bot, since bot.py reads
+its settings from the environment and opens files relative to the working
+directory. See bench_commands.py for the benchmark suite built on this.
+"""
+import asyncio, importlib, itertools, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+_ids = itertools.count(10**15)
+
+
+def load_bot(workdir, backend="sqlite", **env):
+    """Import bot.py with its data files in `workdir` and the given settings
+    (rate limits lifted unless `env` or the environment sets them)."""
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    os.environ["STORAGE_BACKEND"] = backend
+    os.environ.setdefault("XP_FLUSH_INTERVAL", "0.2")
+    # Rate limits lifted, so commands measure their own work rather than "slow down" replies
+    os.environ.setdefault("CASINO_RATE", "1000000/1")
+    os.environ.setdefault("CASINO_GUILD_RATE", "1000000/1")
+    os.environ.setdefault("DAILY_COOLDOWN", "0")
+    os.environ.update({k: str(v) for k, v in env.items()})
+    return importlib.import_module("bot")
+
+
+# ----------------- Fakes -----------------
+class FakePermissions:
+    def __init__(self, administrator=False):
+        self.administrator = administrator
+
+
+class FakeRole:
+    def __init__(self, id, guild, name="role"):
+        self.id, self.guild, self.name = id, guild, name
+        self.mention = f"<@&{id}>"
+
+
+class FakeMember:
+    def __init__(self, id, guild=None, name=None, admin=False):
+        self.id = id
+        self.guild = guild
+        self.name = name or f"user{id}"
+        self.display_name = self.name
+        self.bot = False
+        self.mention = f"<@{id}>"
+        self.guild_permissions = FakePermissions(admin)
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return getattr(other, "id", None) == self.id
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMessage:
+    def __init__(self, channel, content=None, **kwargs):
+        self.id = next(_ids)
+        self.channel = channel
+        self.content = content
+        self.kwargs = kwargs
+
+    async def edit(self, content=None, **kwargs):
+        self.content, self.kwargs = content, kwargs
+        return self
+
+
+class FakeChannel:
+    def __init__(self, guild, id=None, name="general", category=None, latency=0.0):
+        self.id = id or next(_ids)
+        self.guild = guild
+        self.name = name
+        self.category = category
+        self.latency = latency
+        self.mention = f"<#{self.id}>"
+        self.messages = []
+
+    async def send(self, content=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        message = FakeMessage(self, content, **kwargs)
+        self.messages.append(message)
+        return message
+
+    async def delete(self):
+        self.guild.channels.pop(self.id, None)
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(self)
+
+
+class FakeGuild:
+    """A guild whose create_text_channel registers a FakeChannel (with
+    `latency` standing in for the HTTP round trip)."""
+
+    def __init__(self, id=None, latency=0.0):
+        self.id = id or next(_ids)
+        self.latency = latency
+        self.channels = {}
+        self.roles = {}
+        self.default_role = self.add_role("@everyone")
+
+    def add_role(self, name):
+        role = FakeRole(next(_ids), self, name)
+        self.roles[role.id] = role
+        return role
+
+    def add_channel(self, name="general"):
+        channel = FakeChannel(self, name=name, latency=self.latency)
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_channel(self, id):
+        return self.channels.get(id)
+
+    def get_role(self, id):
+        return self.roles.get(id)
+
+    async def create_text_channel(self, name, category=None, overwrites=None, topic=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        channel = self.add_channel(name)
+        channel.category, channel.overwrites, channel.topic = category, overwrites, topic
+        return channel
+
+
+class InteractionResponded(Exception):
+    pass
+
+
+class FakeResponse:
+    """Records what the command answered. Responding twice raises, like
+    discord.py's InteractionResponded."""
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self.kind = None
+        self.content = None
+        self.kwargs = {}
+
+    def is_done(self):
+        return self.kind is not None
+
+    def _respond(self, kind, content=None, **kwargs):
+        if self.kind is not None:
+            raise InteractionResponded(f"already answered with {self.kind}")
+        self.kind, self.content, self.kwargs = kind, content, kwargs
+
+    async def send_message(self, content=None, **kwargs):
+        self._respond("message", content, **kwargs)
+        self.interaction.message = FakeMessage(self.interaction.channel, content, **kwargs)
+
+    async def edit_message(self, content=None, **kwargs):
+        self._respond("edit", content, **kwargs)
+
+    async def send_modal(self, modal):
+        self._respond("modal", modal=modal)
+
+    async def defer(self, **kwargs):
+        self._respond("defer", **kwargs)
+
+
+class FakeInteraction:
+    def __init__(self, user, channel):
+        self.user = user
+        self.guild = channel.guild
+        self.channel = channel
+        self.message = None
+        self.response = FakeResponse(self)
+
+    async def original_response(self):
+        return self.message
+
+    async def edit_original_response(self, content=None, **kwargs):
+        self.message = FakeMessage(self.channel, content, **kwargs)
+        return self.message
+
+
+# ----------------- Harness -----------------
+class Harness:
+    """Runs bot.py's startup and shutdown without logging in, and calls
+    commands and buttons with fake interactions."""
+
+    def __init__(self, bot, latency=0.0):
+        self.bot = bot
+        self.guild = FakeGuild(latency=latency)
+        self.channel = self.guild.add_channel("general")
+        self.members = {}
+
+    def member(self, uid, admin=False):
+        m = self.members.get(uid)
+        if m is None:
+            m = self.members[uid] = FakeMember(uid, self.guild, admin=admin)
+        return m
+
+    def interaction(self, user, channel=None):
+        return FakeInteraction(user, channel or self.channel)
+
+    async def start(self):
+        await self.bot.bot.setup_hook()
+
+    async def close(self):
+        await self.bot.bot.close()
+
+    async def command(self, name, user, channel=None, **options):
+        """Call slash command `name` as `user`; returns the interaction."""
+        i = self.interaction(user, channel)
+        await self.bot.bot.tree.get_command(name).callback(i, **options)
+        return i
+
+    async def press(self, view, button, user, channel=None):
+        """Press `button` (the attribute name) on `view` the way discord.py dispatches it."""
+        i = self.interaction(user, channel)
+        if await view.interaction_check(i):
+            await getattr(view, button).callback(i)
+        return i
+
+    async def settle(self):
+        # Push buffered XP, write-behind saves and the journal to disk
+        bot = self.bot
+        await bot.xp_buffer.flush()
+        await bot.storage.flush()
+        if hasattr(bot.journal, "sync"):
+            await bot.journal.sync()
+
+
+def write_bytes():
+    """Bytes this process has passed to write() so far (Linux), or None."""
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+async def drive(scenario, users, ops, concurrency):
+    """Run `ops` calls of `scenario(uid)` spread over `concurrency` tasks
+    with uids drawn from range(users). Returns (elapsed, latencies)."""
+    latencies = []
+    counter = itertools.count()
+
+    async def worker(w):
+        rng = random.Random(w)
+        while next(counter) < ops:
+            started = time.perf_counter()
+            await scenario(rng.randrange(users) + 1)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    return time.perf_counter() - started, latencies
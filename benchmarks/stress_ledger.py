@@ -0,0 +1,70 @@
+"""Fire thousands of concurrent transfers and bets at the ledger and check that
+money is conserved, no wallet goes negative and the journal matches.
+
+    python benchmarks/stress_ledger.py --backend sqlite --users 200 --ops 20000
+"""
+import argparse, asyncio, os, random, sys, tempfile, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from journal import Journal, read_journal
+from ledger import Ledger
+from storage import START_BALANCE, create_storage
+
+
+async def run(backend, users, ops, seed):
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        storage = create_storage(backend, json_path=os.path.join(tmp, "data.json"), db_path=os.path.join(tmp, "data.db"))
+        await storage.open()
+        journal = Journal(os.path.join(tmp, "ledger.jsonl"))
+        ledger = Ledger(storage, journal)
+        for uid in range(1, users + 1):
+            await storage.ensure_user(uid)
+
+        minted = 0
+        applied = 0
+
+        async def transfer():
+            nonlocal applied
+            src, dst = rng.sample(range(1, users + 1), 2)
+            if await ledger.transfer(src, dst, rng.randint(1, START_BALANCE)) is not None:
+                applied += 1
+
+        async def bet():
+            nonlocal minted, applied
+            uid, stake = rng.randint(1, users), rng.randint(1, START_BALANCE)
+            payout = rng.choice((0, 0, stake * 2, stake * 5))
+            if await ledger.settle_bet(uid, stake, payout, "stress") is not None:
+                minted += payout - stake
+                applied += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(transfer() if rng.random() < 0.5 else bet() for _ in range(ops)))
+        elapsed = time.perf_counter() - started
+
+        wallets = [(await storage.get_user(uid))["wallet"] for uid in range(1, users + 1)]
+        await storage.close()
+        journal.close()
+        logged = sum(1 for _ in read_journal(journal.path))
+
+    expected = users * START_BALANCE + minted
+    assert min(wallets) >= 0, f"negative wallet: {min(wallets)}"
+    assert sum(wallets) == expected, f"money not conserved: {sum(wallets)} != {expected}"
+    assert logged == applied, f"journal has {logged} entries for {applied} applied operations"
+    print(f"{backend:>6}: {ops} ops ({applied} applied) in {elapsed:.2f}s = {ops / elapsed:,.0f} ops/s — "
+          f"total {sum(wallets)} conserved, min wallet {min(wallets)}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--backend", choices=["json", "sqlite", "both"], default="both")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--ops", type=int, default=20000)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    for backend in (["json", "sqlite"] if args.backend == "both" else [args.backend]):
+        asyncio.run(run(backend, args.users, args.ops, args.seed))
+
+
+if __name__ == "__main__":
+    main()
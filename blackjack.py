@@ -0,0 +1,142 @@
+"""Blackjack cards, hands and shoe.
+
+Cards are rank indices 0-12 (2..10, J, Q, K, A) stored in bytearrays. A hand
+keeps its hard total (aces counted as 1), ace count and best total up to
+date as cards arrive, so its value is never recomputed from the card list.
+"""
+import random
+from games import DEALER_STANDS, Outcome
+
+RANKS = [str(x) for x in range(2, 11)] + ["J", "Q", "K", "A"]
+HARD_VALUES = bytes([2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 1])
+ACE = 12
+
+
+# ----------------- Hand -----------------
+class Hand:
+    __slots__ = ("cards", "hard", "aces", "total")
+
+    def __init__(self, cards=()):
+        self.cards = bytearray()
+        self.hard = 0
+        self.aces = 0
+        self.total = 0
+        for card in cards:
+            self.add(card)
+
+    def add(self, card):
+        self.cards.append(card)
+        hard = self.hard = self.hard + HARD_VALUES[card]
+        if card == ACE:
+            self.aces += 1
+        # One ace can count as 11 without busting
+        self.total = hard + 10 if self.aces and hard <= 11 else hard
+
+    @property
+    def soft(self):
+        return self.total != self.hard
+
+    def labels(self):
+        return [RANKS[c] for c in self.cards]
+
+    def __len__(self):
+        return len(self.cards)
+
+
+# ----------------- Shoe -----------------
+class Shoe:
+    """`decks` shuffled decks, reshuffled once `penetration` of them is dealt.
+
+    The shuffle is an incremental Fisher-Yates: each draw swaps a random
+    undealt card into the next position, so a reshuffle only resets `pos`
+    instead of permuting the whole shoe up front.
+    """
+
+    __slots__ = ("decks", "penetration", "cards", "pos", "cut", "rng", "shuffles")
+
+    def __init__(self, decks=6, penetration=0.75, rng=None):
+        if decks < 1 or not 0 < penetration <= 1:
+            raise ValueError("need at least one deck and 0 < penetration <= 1")
+        self.decks = decks
+        self.penetration = penetration
+        self.rng = rng or random.Random()
+        self.cards = bytearray(range(13)) * (4 * decks)
+        self.cut = int(len(self.cards) * penetration)
+        self.shuffles = 0
+        self.shuffle()
+
+    def shuffle(self):
+        self.pos = 0
+        self.shuffles += 1
+
+    def draw(self):
+        pos = self.pos
+        if pos >= self.cut:
+            self.shuffle()
+            pos = 0
+        cards = self.cards
+        j = pos + int(self.rng.random() * (len(cards) - pos))
+        card = cards[j]
+        cards[j] = cards[pos]
+        cards[pos] = card
+        self.pos = pos + 1
+        return card
+
+
+# ----------------- Game -----------------
+def settle(pt, dt, bet):
+    """Payout once the player stands on `pt` and the dealer finished on `dt`."""
+    if pt > 21:
+        return Outcome("bust", 0, 0)
+    if dt > 21 or pt > dt:
+        return Outcome("win", bet*2, 10)
+    if pt == dt:
+        return Outcome("push", bet, 0)
+    return Outcome("lose", 0, 0)
+
+
+class BlackjackGame:
+    __slots__ = ("bet", "shoe", "player", "dealer")
+
+    def __init__(self, bet, shoe):
+        self.bet = bet
+        self.shoe = shoe
+        self.player = Hand((shoe.draw(), shoe.draw()))
+        self.dealer = Hand((shoe.draw(), shoe.draw()))
+
+    def encode(self):
+        # [len(player)] + player cards + dealer cards, a few bytes per game
+        return bytes([len(self.player.cards)]) + self.player.cards + self.dealer.cards
+
+    @classmethod
+    def decode(cls, bet, state, shoe):
+        game = cls.__new__(cls)
+        game.bet = bet
+        game.shoe = shoe
+        n = state[0]
+        game.player = Hand(state[1:1 + n])
+        game.dealer = Hand(state[1 + n:])
+        return game
+
+    def hit(self):
+        self.player.add(self.shoe.draw())
+        return self.player.total
+
+    def dealer_play(self):
+        dealer = self.dealer
+        while dealer.total < DEALER_STANDS:
+            dealer.add(self.shoe.draw())
+        return dealer.total
+
+    def stand(self):
+        return settle(self.player.total, self.dealer_play(), self.bet)
+
+
+def play_round(bet, shoe, stand_on=DEALER_STANDS):
+    """A whole round with the player hitting below `stand_on`, for simulation."""
+    game = BlackjackGame(bet, shoe)
+    while game.player.total < stand_on:
+        game.hit()
+    if game.player.total > 21:
+        return Outcome("bust", 0, 0)
+    return game.stand()
@@ -2,411 +2,722 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 from discord.ui import View, Button, Modal, TextInput
-import random, time, json, os
+import asyncio, random, time, os, json, hashlib
 from datetime import timedelta
+from typing import Literal
+from storage import create_storage, new_user
+from xp import XpAccrual, split_total_xp, total_xp
+from ratelimit import Limits, RateLimiter, parse_rate
+from leaderboard import RankIndex
+import games
+from blackjack import BlackjackGame, Shoe
+from sessions import SessionRegistry
+from tickets import TicketService
+from ledger import Ledger
+from journal import Checkpointer, Journal, RemoteJournal, checkpoint, recover, write_ahead
+from state import RemoteLedger, RemoteStorage
+from usercache import CachedStorage
+from metrics import Metrics
+from outbox import Outbox
+from settings import SETTINGS, SettingsCache, config_key
+import bulk
 
 
 TOKEN = os.environ.get("DISCORD_TOKEN")
 DATA_FILE = "data.json"
-START_BALANCE = 500
-START_XP = 0
-START_LEVEL = 1
-
-# ----------------- Load or create data -----------------
-if not os.path.exists(DATA_FILE):
-    with open(DATA_FILE, "w") as f:
-        json.dump({
-            "balances": {},
-            "xp": {},
-            "levels": {},
-            "config": {},
-            "tickets": {},       # ticket_channel_id -> { opener_id, opened_at }
-            "ticket_counts": {}  # staff_id -> count
-        }, f, indent=4)
-
-with open(DATA_FILE, "r") as f:
-    data = json.load(f)
-
-balances = data.setdefault("balances", {})
-xp_data = data.setdefault("xp", {})
-levels = data.setdefault("levels", {})
-config = data.setdefault("config", {})
-tickets = data.setdefault("tickets", {})
-ticket_counts = data.setdefault("ticket_counts", {})
-
-# ----------------- Save Data -----------------
-def save_data():
-    with open(DATA_FILE, "w") as f:
-        json.dump(data, f, indent=4)
+DB_FILE = os.environ.get("DB_FILE", "data.db")
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite")  # "sqlite" or "json"
+BJ_DECKS = int(os.environ.get("BJ_DECKS", 6))                   # decks in the blackjack shoe
+BJ_PENETRATION = float(os.environ.get("BJ_PENETRATION", 0.75))  # share of the shoe dealt before a reshuffle
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 300))             # idle seconds before an open game is refunded
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 10000))         # open games kept before the oldest is refunded
+JOURNAL_FILE = os.environ.get("JOURNAL_FILE", "ledger.jsonl")
+JOURNAL_SYNC_INTERVAL = float(os.environ.get("JOURNAL_SYNC_INTERVAL", 0.1))  # seconds between journal fsyncs (group commit)
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", 300))     # seconds between checkpoints (journal rotation)
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "snapshots")                 # point-in-time snapshots for journal.py rebuild; "" = off
+SNAPSHOT_INTERVAL = float(os.environ.get("SNAPSHOT_INTERVAL", 3600))       # seconds between snapshots
+FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", 2.0))   # seconds between background saves (json backend)
+FLUSH_MAX_DIRTY = int(os.environ.get("FLUSH_MAX_DIRTY", 1000))  # pending changes that force an early save (json backend)
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 50000))     # users kept in memory (sqlite backend)
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 3600))       # idle seconds before a cached user is dropped
+XP_FLUSH_INTERVAL = float(os.environ.get("XP_FLUSH_INTERVAL", 1.0))  # seconds XP grants are buffered before a batch write
+XP_MAX_PENDING = int(os.environ.get("XP_MAX_PENDING", 5000))          # users with buffered XP that force an early write
+MESSAGE_XP = int(os.environ.get("MESSAGE_XP", 0))                     # XP per chat message; 0 = off
+MESSAGE_XP_COOLDOWN = float(os.environ.get("MESSAGE_XP_COOLDOWN", 60))  # seconds between XP-earning messages per user
+DAILY_COOLDOWN = int(os.environ.get("DAILY_COOLDOWN", 86400))              # seconds between /daily claims
+CASINO_RATE = parse_rate(os.environ.get("CASINO_RATE", "5/10"))            # casino games per user: calls/seconds
+CASINO_GUILD_RATE = parse_rate(os.environ.get("CASINO_GUILD_RATE", "200/10"))  # casino games per guild: calls/seconds
+STATE_ADDRESS = os.environ.get("STATE_ADDRESS", "")  # cluster worker: "unix:/path" or "host:port" of state.py
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", 0))   # total gateway shards; 0 = one unsharded process
+SHARD_IDS = [int(s) for s in os.environ.get("SHARD_IDS", "").split(",") if s]  # shards run here (default: all)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))             # serve Prometheus text on 127.0.0.1:<port>/metrics; 0 = off
+METRICS_FILE = os.environ.get("METRICS_FILE", "")                 # or dump it to this file every 15s
+OUTBOX_WINDOW = float(os.environ.get("OUTBOX_WINDOW", 1.0))        # seconds a welcome/goodbye waits for more joins to merge with
+OUTBOX_MAX_QUEUE = int(os.environ.get("OUTBOX_MAX_QUEUE", 100))     # queued messages per channel before senders wait
+EXPORT_DIR = os.environ.get("EXPORT_DIR", "exports")              # where /economy export and import keep their files
+FORCE_COMMAND_SYNC = os.environ.get("FORCE_COMMAND_SYNC", "") == "1"  # sync slash commands even if they look unchanged
+
+# ----------------- Storage -----------------
+# Nothing is loaded at import time; the backend is opened in setup_hook. The
+# sqlite backend imports an existing data.json the first time it creates its
+# database (see migrate.py to do that by hand). With sqlite, users are read
+# on first use and the active ones kept in a write-back cache (usercache.py).
+#
+# Leaderboard indexes are filled in the background after setup_hook and then
+# kept current by the ledger (wallet+bank) and by add_xp (total XP earned).
+wealth_board = RankIndex()
+level_board = RankIndex()
+
+if STATE_ADDRESS:
+    # Cluster worker (see cluster.py): storage, journal, ledger and the
+    # authoritative leaderboards live in the state service; the local boards
+    # are copies it keeps current.
+    storage = RemoteStorage(STATE_ADDRESS, boards={"wealth": wealth_board, "level": level_board},
+                            on_config=lambda key: guild_settings.config_changed(key))
+    journal = RemoteJournal(storage.client)
+    ledger = RemoteLedger(storage)
+    checkpointer = None
+else:
+    storage_options = {"interval": FLUSH_INTERVAL, "max_dirty": FLUSH_MAX_DIRTY} if STORAGE_BACKEND == "json" else {}
+    storage = create_storage(STORAGE_BACKEND, json_path=DATA_FILE, db_path=DB_FILE, **storage_options)
+    if STORAGE_BACKEND == "sqlite":
+        storage = CachedStorage(storage, max_users=max(1, USER_CACHE_SIZE), ttl=USER_CACHE_TTL)
+    # Every wallet change goes through the ledger so balance checks and writes
+    # are atomic per user; see ledger.py. The journal is the record of every
+    # economy change: storage is checkpointed against it and it is replayed
+    # on startup (see journal.py).
+    journal = Journal(JOURNAL_FILE, sync_interval=JOURNAL_SYNC_INTERVAL)
+    write_ahead(storage, journal)  # storage only writes what the journal already holds
+    ledger = Ledger(storage, journal, index=wealth_board)
+    checkpointer = Checkpointer(storage, journal, CHECKPOINT_INTERVAL, SNAPSHOT_DIR or None, SNAPSHOT_INTERVAL)
+
+# Latency histograms and error counts for commands, events and storage; see
+# the Metrics section at the bottom and /stats.
+metrics = Metrics()
+
+# Channel messages that aren't interaction responses go through the outbox:
+# one rate-limited worker per channel, with welcome/goodbye bursts merged.
+outbox = Outbox(metrics, max_queue=OUTBOX_MAX_QUEUE, window=OUTBOX_WINDOW)
+metrics.gauge("outbox_depth", outbox.depth)
+if isinstance(storage, CachedStorage):
+    metrics.gauge("user_cache_size", lambda: len(storage))
+    metrics.gauge("user_cache_hit_ratio", storage.hit_ratio)
 
 # ----------------- Economy Helpers -----------------
-def ensure_user(uid):
-    uid = str(uid)
-    balances.setdefault(uid, {"wallet": START_BALANCE, "bank": 0})
-    xp_data.setdefault(uid, START_XP)
-    levels.setdefault(uid, START_LEVEL)
-    return balances[uid]
-
-def get_wallet(uid): return ensure_user(uid)["wallet"]
-def get_bank(uid): return ensure_user(uid)["bank"]
-def set_wallet(uid, amt): ensure_user(uid)["wallet"] = int(amt); save_data()
-def set_bank(uid, amt): ensure_user(uid)["bank"] = int(amt); save_data()
-def add_wallet(uid, amt): ensure_user(uid)["wallet"] += int(amt); save_data()
+def track_user(uid, u):
+    wealth_board.update(uid, u["wallet"] + u["bank"])
+    level_board.update(uid, total_xp(u["xp"], u["level"]))
+
+async def ensure_user(uid):
+    u = await storage.ensure_user(uid)
+    if uid not in wealth_board:
+        track_user(uid, u)
+    return u
+
+async def get_user(uid):
+    # Read-only: unknown users get the starting record without a row being created
+    return await storage.get_user(uid) or new_user()
+
+async def get_wallet(uid): return await storage.get_wallet(uid)
+async def get_bank(uid): return (await get_user(uid))["bank"]
+async def set_wallet(uid, amt): await set_fields(uid, wallet=int(amt))
+async def set_bank(uid, amt): await set_fields(uid, bank=int(amt))
+
+async def set_fields(uid, **fields):
+    # Direct edits go through the ledger too: locked, journaled, and a replay ends at the same balances
+    result = await ledger.set_many({uid: fields}, "edit")
+    track_user(uid, result[str(uid)])
+
+# Built in the background so startup doesn't wait on a scan of every user.
+# Users changed meanwhile are already on a board (tracked from a partial
+# score), so they are read again once the scan is in.
+boards_ready = asyncio.Event()
+
+async def build_leaderboards():
+    wealth, levels = [], []
+    async for uid, u in storage.iter_users():
+        wealth.append((uid, u["wallet"] + u["bank"]))
+        levels.append((uid, total_xp(u["xp"], u["level"])))
+    changed = set(wealth_board.uids()) | set(level_board.uids())
+    wealth_board.load(wealth)
+    level_board.load(levels)
+    for uid in changed:
+        u = await storage.get_user(uid)
+        if u is not None:
+            track_user(uid, u)
+    boards_ready.set()
+    print(f"✅ Leaderboards built ({len(wealth)} users)")
+
+async def load_leaderboards():
+    # Cluster worker: copy the state service's boards once it has built them
+    await storage.load_boards()
+    boards_ready.set()
+    print(f"✅ Leaderboards loaded ({len(wealth_board)} users)")
 
 # ----------------- XP & Leveling -----------------
+# Grants are buffered per user and written in one batch every
+# XP_FLUSH_INTERVAL seconds (see xp.py); user_level() includes unsaved XP.
+async def apply_xp(grants):
+    for uid, (xp, level) in (await ledger.grant_xp(grants)).items():
+        level_board.update(uid, total_xp(xp, level))
+
+xp_buffer = XpAccrual(apply_xp, interval=XP_FLUSH_INTERVAL, max_pending=XP_MAX_PENDING)
+message_cooldowns = RateLimiter(1, MESSAGE_XP_COOLDOWN)
+
 def add_xp(uid, amount):
-    uid = str(uid)
-    xp_data[uid] = xp_data.get(uid, START_XP) + amount
-    level_up(uid)
-
-def level_up(uid):
-    uid = str(uid)
-    current_level = levels.get(uid, START_LEVEL)
-    required_xp = 50 * current_level
-    while xp_data.get(uid, 0) >= required_xp:
-        levels[uid] = current_level + 1
-        xp_data[uid] -= required_xp
-        current_level += 1
-        required_xp = 50 * current_level
+    xp_buffer.grant(uid, amount)
+
+def user_level(uid, u):
+    return split_total_xp(total_xp(u["xp"], u["level"]) + xp_buffer.pending(uid))  # (level, xp)
 
 # ----------------- Config Helpers -----------------
-def set_config(key, value):
-    config[key] = value
-    save_data()
+# Channels and roles named in config are resolved once per guild and cached
+# (see settings.py); event handlers read them from guild_settings.get(guild).
+async def set_config(key, value):
+    await storage.set_config(key, value)
+    guild_settings.config_changed(key)
 
 def get_config(key):
-    return config.get(key)
+    return storage.get_config(key)
+
+guild_settings = SettingsCache(get_config)
 
 # ----------------- Bot Setup -----------------
 intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True  # Needed for prefix commands like !cmds
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+# Startup phases are measured between marks: login ends where discord.py
+# calls setup_hook, connect ends at the first on_ready.
+startup_marks = [("start", time.perf_counter())]
+
+def mark_startup(phase):
+    startup_marks.append((phase, time.perf_counter()))
+    metrics.observe("startup", phase, startup_marks[-1][1] - startup_marks[-2][1])
+
+def startup_phases():
+    return [(phase, t - startup_marks[i][1]) for i, (phase, t) in enumerate(startup_marks[1:])]
+
+class EconomyBot(commands.AutoShardedBot if SHARD_COUNT else commands.Bot):
+    recovered = False  # storage is open and holds the whole journal
+
+    async def setup_hook(self):
+        mark_startup("login")
+        await storage.open()
+        instrument_storage()
+        journal.open()
+        if not STATE_ADDRESS:
+            # Storage may lag the journal by up to one checkpoint after a crash
+            await recover(storage, journal)
+        self.recovered = True
+        mark_startup("data load")
+        journal.start()
+        self.boards_task = asyncio.create_task(load_leaderboards() if STATE_ADDRESS else build_leaderboards())
+        await restore_sessions()
+        await ticket_service.load()
+        self.add_view(TicketView())
+        sessions.start()
+        xp_buffer.start()
+        if checkpointer is not None:
+            checkpointer.start()
+        await metrics.start(dump_path=METRICS_FILE or None, http_port=METRICS_PORT or None)
+        mark_startup("setup")
+
+    async def close(self):
+        task = getattr(self, "boards_task", None)
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await outbox.close()
+        await metrics.close()
+        await sessions.close()
+        await xp_buffer.close()
+        await journal.stop()
+        if checkpointer is not None:
+            await checkpointer.close()
+        # A checkpoint after a failed or cut-short startup would mark the
+        # unreplayed journal tail as applied, so storage is left as it is
+        if self.recovered:
+            if checkpointer is not None:
+                await checkpoint(storage, journal)
+            await storage.close()
+        journal.close()
+        await super().close()
+
+shard_options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS or None} if SHARD_COUNT else {}
+bot = EconomyBot(command_prefix="!", intents=intents, **shard_options)
 
 def emb(title, desc, color=discord.Color.blurple()):
     return discord.Embed(title=title, description=desc, color=color)
 
 # ----------------- Bot Ready -----------------
+# on_ready fires again after every reconnect, so the command tree is only
+# uploaded when its fingerprint differs from the one stored in config for the
+# same application and target (or FORCE_COMMAND_SYNC=1 on this run).
+def tree_fingerprint(guild=None):
+    payload = sorted((c.to_dict() for c in bot.tree.get_commands(guild=guild)), key=lambda d: (d.get("type", 1), d["name"]))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+async def sync_commands(force=False):
+    guild_id = get_config("test_guild")  # Optional: set a test guild ID for fast slash commands
+    guild = discord.Object(id=guild_id) if guild_id else None
+    target = f"guild {guild_id}" if guild_id else "global"
+    stamp = f"{bot.application_id}:{target}:{tree_fingerprint(guild)}"
+    if not force and get_config("command_tree_hash") == stamp:
+        print(f"✅ Commands unchanged ({target}), sync skipped")
+        return False
+    await bot.tree.sync(guild=guild)
+    await set_config("command_tree_hash", stamp)
+    print(f"✅ Commands synced ({target})")
+    return True
+
 @bot.event
 async def on_ready():
-    guild_id = config.get("test_guild")  # Optional: set a test guild ID for fast slash commands
-    if guild_id:
-        guild = discord.Object(id=guild_id)
-        await bot.tree.sync(guild=guild)
-        print(f"✅ Commands synced to guild {guild_id}")
-    else:
-        await bot.tree.sync()
-        print("✅ Global commands synced")
+    first = startup_marks[-1][0] != "connect"
+    if first:
+        mark_startup("connect")
+        print("⏱ Startup: " + " | ".join(f"{phase} {secs:.2f}s" for phase, secs in startup_phases()))
+    if SHARD_IDS and 0 not in SHARD_IDS:
+        # In a cluster only the worker running shard 0 syncs the command tree
+        print(f"✅ Logged in as {bot.user} | Shards {SHARD_IDS} ready")
+        return
+    await sync_commands(force=FORCE_COMMAND_SYNC and first)
 
     print(f"✅ Logged in as {bot.user} | Ready")
 
+# ----------------- Guild Settings -----------------
+@bot.event
+async def on_guild_channel_delete(channel):
+    guild_settings.invalidate(channel.guild.id)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    guild_settings.invalidate(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    guild_settings.invalidate(role.guild.id)
+
+@bot.event
+async def on_guild_remove(guild):
+    guild_settings.invalidate(guild.id)
+
+@bot.tree.command(description="Set the channel or role this server uses for a feature (leave both empty to reset)")
+@app_commands.default_permissions(administrator=True)
+@app_commands.guild_only()
+async def setting(
+    interaction: discord.Interaction,
+    name: Literal["welcome_channel", "goodbye_channel", "update_channel", "ticket_log_channel", "ticket_category", "ticket_staff_role"],
+    channel: discord.abc.GuildChannel | None = None,
+    role: discord.Role | None = None,
+):
+    target, other = (role, channel) if SETTINGS[name] == "role" else (channel, role)
+    if other is not None:
+        await interaction.response.send_message(f"❌ `{name}` takes a {SETTINGS[name]}.", ephemeral=True)
+        return
+    if name == "ticket_category" and channel is not None and not isinstance(channel, discord.CategoryChannel):
+        await interaction.response.send_message("❌ `ticket_category` must be a category.", ephemeral=True)
+        return
+    await set_config(config_key(name, interaction.guild.id), target.id if target else None)
+    shown = target.mention if target else "the global default"
+    await interaction.response.send_message(f"✅ `{name}` set to {shown}.", ephemeral=True)
+
 # ----------------- Welcome & Goodbye -----------------
+def more_suffix(more):
+    return f" (+{more} more)" if more else ""
+
+def welcome_text(mentions, more):
+    return f"🎉 Welcome {', '.join(mentions)}{more_suffix(more)} to the server!"
+
+def goodbye_text(mentions, more):
+    verb = "has" if len(mentions) == 1 and not more else "have"
+    return f"👋 {', '.join(mentions)}{more_suffix(more)} {verb} left the server."
+
 @bot.event
 async def on_member_join(member: discord.Member):
-    ch_id = config.get("welcome_channel")
-    if ch_id:
-        ch = bot.get_channel(ch_id)
-        if ch:
-            await ch.send(f"🎉 Welcome {member.mention} to the server!")
-    # Give XP for joining
-    add_xp(member.id, 10)
+    ch = guild_settings.get(member.guild).welcome_channel
+    if ch:
+        await outbox.announce(ch, "welcome", member.mention, welcome_text)
 
 @bot.event
 async def on_member_remove(member: discord.Member):
-    ch_id = config.get("goodbye_channel")
-    if ch_id:
-        ch = bot.get_channel(ch_id)
-        if ch:
-            await ch.send(f"👋 {member.mention} has left the server.")
+    ch = guild_settings.get(member.guild).goodbye_channel
+    if ch:
+        await outbox.announce(ch, "goodbye", member.mention, goodbye_text)
+
+@bot.listen("on_message")
+async def message_xp(message: discord.Message):
+    # listen() rather than event() so prefix commands still get processed
+    if MESSAGE_XP and message.guild and not message.author.bot and not message_cooldowns.hit(message.author.id):
+        add_xp(message.author.id, MESSAGE_XP)
 
 # ----------------- Ticket System -----------------
+# Open tickets are indexed by channel and by opener in the ticket service, so
+# duplicate checks, closes and staff stats never scan the ticket list.
+ticket_service = TicketService(storage, journal)
+
 class TicketView(View):
     def __init__(self):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="Open Ticket", style=discord.ButtonStyle.green, custom_id="open_ticket")
-    async def open_ticket(self, button: Button, interaction: discord.Interaction):
-        # Check if user already has a ticket
-        for tid, tdata in tickets.items():
-            if tdata["opener_id"] == str(interaction.user.id):
-                await interaction.response.send_message("❌ You already have an open ticket.", ephemeral=True)
-                return
-
-        # Create ticket channel
-        guild = interaction.guild
-        category_id = config.get("ticket_category")
-        category = guild.get_channel(category_id) if category_id else None
-        channel = await guild.create_text_channel(
-            name=f"ticket-{interaction.user.name}",
-            category=category,
-            topic=f"Ticket opened by {interaction.user} ({interaction.user.id})"
-        )
+    async def open_ticket(self, interaction: discord.Interaction, button: Button):
+        # Reserve the opener's slot first so a double click can't open two tickets
+        if not ticket_service.reserve(interaction.user.id):
+            await interaction.response.send_message("❌ You already have an open ticket.", ephemeral=True)
+            return
 
-        tickets[str(channel.id)] = {
-            "opener_id": str(interaction.user.id),
-            "opened_at": int(time.time())
+        # Create a private ticket channel
+        guild = interaction.guild
+        overwrites = {
+            guild.default_role: discord.PermissionOverwrite(read_messages=False),
+            interaction.user: discord.PermissionOverwrite(read_messages=True, send_messages=True)
         }
-        save_data()
+        settings = guild_settings.get(guild)
+        if settings.ticket_staff_role:
+            overwrites[settings.ticket_staff_role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+        try:
+            channel = await guild.create_text_channel(
+                name=f"ticket-{interaction.user.name}",
+                category=settings.ticket_category,
+                overwrites=overwrites,
+                topic=f"Ticket opened by {interaction.user} ({interaction.user.id})"
+            )
+        except BaseException:
+            ticket_service.release(interaction.user.id)
+            raise
+
+        await ticket_service.open(channel.id, interaction.user.id)
 
         await interaction.response.send_message(f"✅ Ticket created: {channel.mention}", ephemeral=True)
         await channel.send(f"Hello {interaction.user.mention}, our staff will be with you shortly. Use `/close` to close the ticket.")
 
+@bot.tree.command(description="Post the ticket panel in this channel")
+@app_commands.default_permissions(administrator=True)
+async def ticketpanel(interaction: discord.Interaction):
+    await interaction.response.send_message("Need help? Open a ticket below.", view=TicketView())
+
 # ----------------- Close Ticket Command -----------------
 @bot.tree.command(description="Close a ticket (staff only)")
 @app_commands.default_permissions(administrator=True)
 async def close(interaction: discord.Interaction):
-    channel_id = str(interaction.channel.id)
-    if channel_id not in tickets:
+    ticket = await ticket_service.close(interaction.channel.id, staff_id=interaction.user.id)
+    if ticket is None:
         await interaction.response.send_message("❌ This is not a ticket channel.", ephemeral=True)
         return
 
-    opener_id = tickets[channel_id]["opener_id"]
-    del tickets[channel_id]
-    save_data()
+    opener_id = ticket["opener_id"]
     await interaction.channel.delete()
-    log_channel_id = config.get("ticket_log_channel")
-    if log_channel_id:
-        log_channel = bot.get_channel(log_channel_id)
-        if log_channel:
-            await log_channel.send(f"Ticket closed by {interaction.user.mention}, opener: <@{opener_id}>")
+    log_channel = guild_settings.get(interaction.guild).ticket_log_channel
+    if log_channel:
+        await outbox.send(log_channel, f"Ticket closed by {interaction.user.mention}, opener: <@{opener_id}>")
+
+@bot.tree.command(description="Show how many tickets a staff member has closed")
+@app_commands.default_permissions(administrator=True)
+async def ticketstats(interaction: discord.Interaction, member: discord.Member | None = None):
+    member = member or interaction.user
+    await interaction.response.send_message(
+        f"🎫 {member.mention} has closed {ticket_service.count(member.id)} tickets. Open tickets: {len(ticket_service)}.",
+        ephemeral=True
+    )
+
+# ----------------- Rate Limits -----------------
+# Checked before a command body runs (see ratelimit.py), so spam is answered
+# from memory without touching the ledger or storage. A call the command
+# turns down (see refuse) or that fails is given back. The daily limiter
+# mirrors last_daily, which stays the persisted source of truth.
+def fmt_wait(seconds):
+    seconds = int(seconds) + 1
+    return f"{seconds//3600}h {(seconds%3600)//60}m" if seconds >= 3600 else f"{seconds}s"
+
+async def slow_down(interaction, name, retry_after):
+    metrics.incr(f"limited_{name}")
+    if name == "daily":
+        return await interaction.response.send_message(f"⏳ You must wait {fmt_wait(retry_after)}.", ephemeral=True)
+    await interaction.response.send_message(f"⏳ Slow down! Try again in {fmt_wait(retry_after)}.", ephemeral=True)
+
+async def refuse(interaction, text):
+    # Bad arguments or no funds: nothing was played, so it doesn't count against the limits
+    limits.cancel()
+    await interaction.response.send_message(text, ephemeral=True)
+
+limits = Limits(on_limited=slow_down)
+limits.add("casino", *CASINO_RATE, scope="user")
+limits.add("casino_guild", *CASINO_GUILD_RATE, scope="guild")
+limits.add("daily", 1, DAILY_COOLDOWN, scope="user")
 
 # ----------------- Economy Commands -----------------
 @bot.tree.command(description="Check balance")
 async def balance(interaction: discord.Interaction, member: discord.Member | None = None):
     member = member or interaction.user
-    u = ensure_user(member.id)
-    lvl = levels.get(str(member.id), START_LEVEL)
-    xp = xp_data.get(str(member.id), START_XP)
+    u = await get_user(member.id)
+    level, xp = user_level(member.id, u)
     await interaction.response.send_message(
-        f"{member.mention}\nWallet: ${u['wallet']}\nBank: ${u['bank']}\nLevel: {lvl} | XP: {xp}"
+        f"{member.mention}\nWallet: ${u['wallet']}\nBank: ${u['bank']}\nLevel: {level} | XP: {xp}"
     )
 
 @bot.tree.command(description="Claim daily reward (24h)")
+@limits("daily")
 async def daily(interaction: discord.Interaction):
-    u = ensure_user(interaction.user.id)
-    now = int(time.time())
-    last = u.get("last_daily", 0)
-    if now - last < 86400:
-        remaining = 86400 - (now - last)
-        return await interaction.response.send_message(
-            f"⏳ You must wait {remaining//3600}h {(remaining%3600)//60}m.", ephemeral=True
-        )
-    reward = random.randint(2500, 50000)
-    add_wallet(interaction.user.id, reward)
-    u["last_daily"] = now
+    reward = games.daily_reward()
+    wallet, remaining = await ledger.claim(interaction.user.id, reward, "daily", cooldown=DAILY_COOLDOWN)
+    if wallet is None:
+        # Claimed before a restart or on another worker; remember it locally
+        limits.block("daily", interaction, remaining)
+        return await interaction.response.send_message(f"⏳ You must wait {fmt_wait(remaining)}.", ephemeral=True)
     add_xp(interaction.user.id, 20)  # XP gain for claiming daily
-    save_data()
     await interaction.response.send_message(f"🎁 You received **${reward}**!")
 
 @bot.tree.command(description="Send money to another user")
 async def send(interaction: discord.Interaction, member: discord.Member, amount: int):
     if amount <= 0:
         return await interaction.response.send_message("❌ Amount must be > 0.", ephemeral=True)
-    if get_wallet(interaction.user.id) < amount:
+    if member.id == interaction.user.id:
+        return await interaction.response.send_message("❌ You can't send money to yourself.", ephemeral=True)
+    if await ledger.transfer(interaction.user.id, member.id, amount) is None:
         return await interaction.response.send_message("❌ Not enough funds.", ephemeral=True)
-    add_wallet(interaction.user.id, -amount)
-    add_wallet(member.id, amount)
     add_xp(interaction.user.id, 5)  # XP for sending money
-    save_data()
     await interaction.response.send_message(f"💸 Sent ${amount} to {member.mention}!")
 
 # ----------------- Leaderboard -----------------
-@bot.tree.command(description="Show top balances")
-async def leaderboard(interaction: discord.Interaction):
-    top = sorted(
-        balances.items(),
-        key=lambda kv: kv[1].get("wallet", 0) + kv[1].get("bank", 0),
-        reverse=True
-    )[:10]
+LEADERBOARD_PAGE = 10
+
+@bot.tree.command(description="Show top balances or levels")
+async def leaderboard(interaction: discord.Interaction, page: int = 1, board: Literal["money", "level"] = "money"):
+    index = wealth_board if board == "money" else level_board
+    pages = max(1, -(-len(index) // LEADERBOARD_PAGE))
+    page = min(max(page, 1), pages)
+    start = (page - 1) * LEADERBOARD_PAGE
+    top = index.top(LEADERBOARD_PAGE, offset=start)
 
     lines = []
-    for i, (uid, vals) in enumerate(top, start=1):
-        total = vals.get("wallet", 0) + vals.get("bank", 0)
-        lvl = levels.get(uid, START_LEVEL)
-        lines.append(f"{i}. <@{uid}> — ${total} | Level {lvl}")
-
-    await interaction.response.send_message(f"🏆 Leaderboard:\n" + "\n".join(lines))
-
-# ----------------- Casino Helper -----------------
-deck = [str(x) for x in range(2, 11)] + ["J", "Q", "K", "A"]
-
-def bj_total(cards):
-    total, aces = 0, 0
-    for c in cards:
-        if c in ["J", "Q", "K"]:
-            total += 10
-        elif c == "A":
-            total += 11
-            aces += 1
+    for i, (uid, score) in enumerate(top, start=start + 1):
+        lvl, xp = split_total_xp(level_board.score(uid) or 0)
+        if board == "money":
+            lines.append(f"{i}. <@{uid}> — ${score} | Level {lvl}")
         else:
-            total += int(c)
-    while total > 21 and aces:
-        total -= 10
-        aces -= 1
-    return total
+            lines.append(f"{i}. <@{uid}> — Level {lvl} | XP: {xp}")
+
+    rank = index.rank(interaction.user.id)
+    footer = f"Page {page}/{pages}" + (f" | Your rank: #{rank}" if rank else "")
+    if not boards_ready.is_set():
+        footer += " | still loading, ranks may be incomplete"
+    await interaction.response.send_message(f"🏆 Leaderboard:\n" + "\n".join(lines) + f"\n{footer}")
+
+# Game rules live in games.py and blackjack.py; the commands below only handle
+# bets and messages. All blackjack games deal from one shared shoe.
+shoe = Shoe(decks=BJ_DECKS, penetration=BJ_PENETRATION)
 
 # ----------------- Blackjack -----------------
+# Open games are tracked in the session registry: one per user, persisted so
+# a restart re-attaches the buttons, and refunded if left idle for SESSION_TTL.
+async def expire_game(session):
+    if session.view is not None:
+        session.view.stop()
+    channel = bot.get_channel(session.channel_id) if session.channel_id else None
+    if channel and session.message_id:
+        try:
+            await channel.get_partial_message(session.message_id).edit(
+                content=None, embed=emb("🃏 Blackjack - Expired", f"⌛ Game expired. Your ${session.stake} bet was refunded."), view=None
+            )
+        except discord.HTTPException:
+            pass
+
+# In a cluster the state service journals sessions as it stores them
+sessions = SessionRegistry(storage, ledger, None if STATE_ADDRESS else journal, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, on_expire=expire_game)
+
 class BlackjackView(View):
-    def __init__(self, user, bet, player_cards, dealer_cards):
-        super().__init__(timeout=90)
-        self.user = user
-        self.bet = bet
-        self.player = player_cards
-        self.dealer = dealer_cards
+    def __init__(self, user_id, game):
+        super().__init__(timeout=None)
+        self.user_id = user_id
+        self.game = game
+        # Unique per user so the view can be re-attached after a restart
+        self.hit.custom_id = f"bj:hit:{user_id}"
+        self.stand.custom_id = f"bj:stand:{user_id}"
 
     async def interaction_check(self, i: discord.Interaction) -> bool:
-        if i.user.id != self.user.id:
+        if i.user.id != self.user_id:
             await i.response.send_message("🚫 Not your game.", ephemeral=True)
             return False
+        session = sessions.get(self.user_id)
+        if session is None or session.view is not self:
+            await i.response.send_message("⌛ This game has ended.", ephemeral=True)
+            return False
         return True
 
     @discord.ui.button(label="Hit", style=discord.ButtonStyle.green)
     async def hit(self, i: discord.Interaction, b: Button):
-        self.player.append(random.choice(deck))
-        pt = bj_total(self.player)
+        session = sessions.get(self.user_id)
+        if session is None or session.view is not self:
+            return await i.response.send_message("⌛ This game has ended.", ephemeral=True)
+        g = self.game
+        pt = g.hit()
         if pt > 21:
+            sessions.claim(self.user_id)
+            await sessions.finish(session)
             await i.response.edit_message(
                 embed=emb("🃏 Blackjack - Busted",
-                          f"Your: {self.player} ({pt})\nDealer: {self.dealer} ({bj_total(self.dealer)})\n❌ You lost ${self.bet}."),
+                          f"Your: {g.player.labels()} ({pt})\nDealer: {g.dealer.labels()} ({g.dealer.total})\n❌ You lost ${g.bet}."),
                 view=None
             )
             self.stop()
             return
-        await i.response.edit_message(embed=emb("🃏 Blackjack", f"Your: {self.player} ({pt})\nDealer shows: {self.dealer[0]}"), view=self)
+        session.state = g.encode()
+        await sessions.save(session)
+        await i.response.edit_message(embed=emb("🃏 Blackjack", f"Your: {g.player.labels()} ({pt})\nDealer shows: {g.dealer.labels()[0]}"), view=self)
 
     @discord.ui.button(label="Stand", style=discord.ButtonStyle.red)
     async def stand(self, i: discord.Interaction, b: Button):
-        pt = bj_total(self.player)
-        dt = bj_total(self.dealer)
-        while dt < 17:
-            self.dealer.append(random.choice(deck))
-            dt = bj_total(self.dealer)
-        if dt > 21 or pt > dt:
-            add_wallet(self.user.id, self.bet*2)
-            add_xp(self.user.id, 10)
-            result = f"✅ You win ${self.bet*2}!"
-        elif pt == dt:
-            add_wallet(self.user.id, self.bet)
+        session = sessions.claim(self.user_id)
+        if session is None:
+            return await i.response.send_message("⌛ This game has ended.", ephemeral=True)
+        g = self.game
+        outcome = g.stand()
+        if outcome.payout:
+            await ledger.credit(self.user_id, outcome.payout, "blackjack")
+        await sessions.finish(session)
+        if outcome.xp:
+            add_xp(self.user_id, outcome.xp)
+        if outcome.result == "win":
+            result = f"✅ You win ${outcome.payout}!"
+        elif outcome.result == "push":
             result = "🤝 Tie. Bet returned."
         else:
-            result = f"❌ You lost ${self.bet}."
+            result = f"❌ You lost ${g.bet}."
         await i.response.edit_message(
-            embed=emb("🃏 Blackjack - Result", f"Your: {self.player} ({pt})\nDealer: {self.dealer} ({dt})\n{result}"),
+            embed=emb("🃏 Blackjack - Result", f"Your: {g.player.labels()} ({g.player.total})\nDealer: {g.dealer.labels()} ({g.dealer.total})\n{result}"),
             view=None
         )
         self.stop()
 
+async def restore_sessions():
+    for session in await sessions.load():
+        if session.game != "blackjack" or session.message_id is None:
+            # Never reached the player; give the stake back
+            await sessions.refund(sessions.claim(session.user_id), "restart")
+            continue
+        game = BlackjackGame.decode(session.stake, session.state, shoe)
+        session.view = BlackjackView(session.user_id, game)
+        bot.add_view(session.view, message_id=session.message_id)
+
 @bot.tree.command(description="Play Blackjack")
+@limits("casino", "casino_guild")
 async def blackjack(interaction: discord.Interaction, bet: int):
-    if bet <= 0 or bet > get_wallet(interaction.user.id):
-        return await interaction.response.send_message("❌ Invalid bet.", ephemeral=True)
-    add_wallet(interaction.user.id, -bet)
-    player = [random.choice(deck), random.choice(deck)]
-    dealer = [random.choice(deck), random.choice(deck)]
-    view = BlackjackView(interaction.user, bet, player, dealer)
-    await interaction.response.send_message(f"Your: {player} ({bj_total(player)})\nDealer shows: {dealer[0]}", view=view)
+    if bet <= 0:
+        return await refuse(interaction, "❌ Invalid bet.")
+    session = sessions.begin(interaction.user.id, "blackjack", bet)
+    if session is None:
+        return await refuse(interaction, "❌ You already have a game in progress.")
+    if await ledger.debit_if_sufficient(interaction.user.id, bet, "blackjack") is None:
+        sessions.discard(interaction.user.id)
+        return await refuse(interaction, "❌ Invalid bet.")
+    game = BlackjackGame(bet, shoe)
+    session.state = game.encode()
+    session.view = BlackjackView(interaction.user.id, game)
+    await sessions.save(session)
+    await interaction.response.send_message(f"Your: {game.player.labels()} ({game.player.total})\nDealer shows: {game.dealer.labels()[0]}", view=session.view)
+    message = await interaction.original_response()
+    session.channel_id, session.message_id = message.channel.id, message.id
+    await sessions.save(session)
 
 # ----------------- Roulette -----------------
 @bot.tree.command(description="Roulette (red/black)")
+@limits("casino", "casino_guild")
 async def roulette(interaction: discord.Interaction, color: str, bet: int):
     color = color.lower()
     if color not in ["red", "black"]:
-        return await interaction.response.send_message("❌ Pick red or black.", ephemeral=True)
-    if bet <= 0 or bet > get_wallet(interaction.user.id):
-        return await interaction.response.send_message("❌ Invalid bet.", ephemeral=True)
-    add_wallet(interaction.user.id, -bet)
-    result = random.choices(["red","black","green"], weights=[45,45,10])[0]
+        return await refuse(interaction, "❌ Pick red or black.")
+    if bet <= 0:
+        return await refuse(interaction, "❌ Invalid bet.")
+    result, win, xp = games.roulette(color, bet)
     if result == color:
-        win = bet*2
-        add_wallet(interaction.user.id, win)
-        add_xp(interaction.user.id, 5)
         msg = f"Ball landed {result} — you won ${win}!"
     elif result == "green":
-        win = bet*5
-        add_wallet(interaction.user.id, win)
-        add_xp(interaction.user.id, 10)
         msg = f"Ball landed green — mega win ${win}!"
     else:
         msg = f"Ball landed {result} — you lost ${bet}."
+    if await ledger.settle_bet(interaction.user.id, bet, win, "roulette") is None:
+        return await refuse(interaction, "❌ Invalid bet.")
+    if xp:
+        add_xp(interaction.user.id, xp)
     await interaction.response.send_message(msg)
 
 # ----------------- Slots -----------------
 @bot.tree.command(description="Slots")
+@limits("casino", "casino_guild")
 async def slots(interaction: discord.Interaction, bet: int):
-    if bet <= 0 or bet > get_wallet(interaction.user.id):
-        return await interaction.response.send_message("❌ Invalid bet.", ephemeral=True)
-    add_wallet(interaction.user.id, -bet)
-    symbols = ["🍒","🍋","🍉","⭐","7️⃣"]
-    roll = [random.choice(symbols) for _ in range(3)]
+    if bet <= 0:
+        return await refuse(interaction, "❌ Invalid bet.")
+    roll, win, xp = games.slots(bet)
     if len(set(roll)) == 1:
-        win = bet*5
-        add_wallet(interaction.user.id, win)
-        add_xp(interaction.user.id, 10)
         msg = f"{' '.join(roll)} — Jackpot! You won ${win}!"
     elif len(set(roll)) == 2:
-        win = bet*2
-        add_wallet(interaction.user.id, win)
-        add_xp(interaction.user.id, 5)
         msg = f"{' '.join(roll)} — Nice! You won ${win}."
     else:
         msg = f"{' '.join(roll)} — Unlucky! You lost ${bet}."
+    if await ledger.settle_bet(interaction.user.id, bet, win, "slots") is None:
+        return await refuse(interaction, "❌ Invalid bet.")
+    if xp:
+        add_xp(interaction.user.id, xp)
     await interaction.response.send_message(msg)
 
 # ----------------- Coinflip -----------------
 @bot.tree.command(description="Coinflip (heads/tails)")
+@limits("casino", "casino_guild")
 async def coinflip(interaction: discord.Interaction, choice: str, bet: int):
     choice = choice.lower()
     if choice not in ["heads","tails"]:
-        return await interaction.response.send_message("❌ Pick heads or tails.", ephemeral=True)
-    if bet <= 0 or bet > get_wallet(interaction.user.id):
-        return await interaction.response.send_message("❌ Invalid bet.", ephemeral=True)
-    add_wallet(interaction.user.id, -bet)
-    res = random.choice(["heads","tails"])
-    if res == choice:
-        add_wallet(interaction.user.id, bet*2)
-        add_xp(interaction.user.id, 5)
-        msg = f"Coin landed {res} — you won ${bet*2}!"
+        return await refuse(interaction, "❌ Pick heads or tails.")
+    if bet <= 0:
+        return await refuse(interaction, "❌ Invalid bet.")
+    res, win, xp = games.coinflip(choice, bet)
+    if win:
+        msg = f"Coin landed {res} — you won ${win}!"
     else:
         msg = f"Coin landed {res} — you lost ${bet}."
+    if await ledger.settle_bet(interaction.user.id, bet, win, "coinflip") is None:
+        return await refuse(interaction, "❌ Invalid bet.")
+    if xp:
+        add_xp(interaction.user.id, xp)
     await interaction.response.send_message(msg)
 
 # ----------------- Dice -----------------
 @bot.tree.command(description="Dice (guess 1-6)")
+@limits("casino", "casino_guild")
 async def dice(interaction: discord.Interaction, guess: int, bet: int):
     if guess < 1 or guess > 6:
-        return await interaction.response.send_message("❌ Guess must be 1–6.", ephemeral=True)
-    if bet <= 0 or bet > get_wallet(interaction.user.id):
-        return await interaction.response.send_message("❌ Invalid bet.", ephemeral=True)
-    add_wallet(interaction.user.id, -bet)
-    roll = random.randint(1, 6)
-    if roll == guess:
-        win = bet*6
-        add_wallet(interaction.user.id, win)
-        add_xp(interaction.user.id, 10)
+        return await refuse(interaction, "❌ Guess must be 1–6.")
+    if bet <= 0:
+        return await refuse(interaction, "❌ Invalid bet.")
+    roll, win, xp = games.dice(guess, bet)
+    if win:
         msg = f"Rolled {roll} — correct! You won ${win}!"
     else:
         msg = f"Rolled {roll} — you lost ${bet}."
+    if await ledger.settle_bet(interaction.user.id, bet, win, "dice") is None:
+        return await refuse(interaction, "❌ Invalid bet.")
+    if xp:
+        add_xp(interaction.user.id, xp)
     await interaction.response.send_message(msg)
 
 # ----------------- HighLow -----------------
 @bot.tree.command(description="HighLow (guess high/low 1–100)")
+@limits("casino", "casino_guild")
 async def highlow(interaction: discord.Interaction, guess: str, bet: int):
     guess = guess.lower()
     if guess not in ["high","low"]:
-        return await interaction.response.send_message("❌ Guess high or low.", ephemeral=True)
-    if bet <= 0 or bet > get_wallet(interaction.user.id):
-        return await interaction.response.send_message("❌ Invalid bet.", ephemeral=True)
-    add_wallet(interaction.user.id, -bet)
-    roll = random.randint(1, 100)
-    result = "high" if roll > 50 else "low"
-    if guess == result:
-        win = bet*2
-        add_wallet(interaction.user.id, win)
-        add_xp(interaction.user.id, 5)
+        return await refuse(interaction, "❌ Guess high or low.")
+    if bet <= 0:
+        return await refuse(interaction, "❌ Invalid bet.")
+    (roll, result), win, xp = games.highlow(guess, bet)
+    if win:
         msg = f"Number {roll} ({result}) — you won ${win}!"
     else:
         msg = f"Number {roll} ({result}) — you lost ${bet}."
+    if await ledger.settle_bet(interaction.user.id, bet, win, "highlow") is None:
+        return await refuse(interaction, "❌ Invalid bet.")
+    if xp:
+        add_xp(interaction.user.id, xp)
     await interaction.response.send_message(msg)
 
 # ----------------- PP Check -----------------
@@ -417,48 +728,13 @@ async def ppcheck(interaction: discord.Interaction):
     add_xp(interaction.user.id, 1)
     await interaction.response.send_message(f"Your pp size is {pp_size} inches {emoji}")
 
-# ----------------- Tickets -----------------
-class TicketView(View):
-    def __init__(self):
-        super().__init__(timeout=None)
-
-    @discord.ui.button(label="Open Ticket", style=discord.ButtonStyle.green, custom_id="open_ticket")
-    async def open_ticket(self, button: Button, interaction: discord.Interaction):
-        guild = interaction.guild
-        overwrites = {
-            guild.default_role: discord.PermissionOverwrite(read_messages=False),
-            interaction.user: discord.PermissionOverwrite(read_messages=True, send_messages=True)
-        }
-        channel_name = f"ticket-{interaction.user.name}-{interaction.user.discriminator}"
-        channel = await guild.create_text_channel(channel_name, overwrites=overwrites)
-        tickets[channel.id] = {"opener_id": interaction.user.id, "opened_at": int(time.time())}
-        save_data()
-        await interaction.response.send_message(f"✅ Ticket created: {channel.mention}", ephemeral=True)
-
-# ----------------- Welcome & Goodbye -----------------
-@bot.event
-async def on_member_join(member: discord.Member):
-    ch_id = config.get("welcome_channel")
-    if ch_id:
-        ch = bot.get_channel(ch_id)
-        if ch:
-            await ch.send(f"🎉 Welcome {member.mention} to the server!")
-
-@bot.event
-async def on_member_remove(member: discord.Member):
-    ch_id = config.get("goodbye_channel")
-    if ch_id:
-        ch = bot.get_channel(ch_id)
-        if ch:
-            await ch.send(f"👋 {member.mention} has left the server.")
-
 # ----------------- Update Panel -----------------
 class UpdateView(View):
     def __init__(self):
         super().__init__(timeout=None)
 
     @discord.ui.button(label="Post Update", style=discord.ButtonStyle.primary, custom_id="post_update")
-    async def post_update(self, button: Button, interaction: discord.Interaction):
+    async def post_update(self, interaction: discord.Interaction, button: Button):
         if not interaction.user.guild_permissions.administrator:
             await interaction.response.send_message("❌ You must be an admin.", ephemeral=True)
             return
@@ -478,16 +754,12 @@ class UpdateModal(Modal):
         self.add_item(self.update_input)
 
     async def on_submit(self, interaction: discord.Interaction):
-        channel_id = config.get("update_channel")
-        if not channel_id:
-            await interaction.response.send_message("❌ Update channel not set.", ephemeral=True)
-            return
-        channel = bot.get_channel(channel_id)
+        channel = guild_settings.get(interaction.guild).update_channel
         if not channel:
-            await interaction.response.send_message("❌ Invalid update channel.", ephemeral=True)
+            await interaction.response.send_message("❌ Update channel not set or no longer exists.", ephemeral=True)
             return
         embed = discord.Embed(title="📢 Update", description=self.update_input.value, color=discord.Color.green())
-        await channel.send(embed=embed)
+        await outbox.send(channel, embed=embed)
         await interaction.response.send_message("✅ Update posted.", ephemeral=True)
 
 # Command to show Update Panel
@@ -496,6 +768,159 @@ class UpdateModal(Modal):
 async def updatepanel(interaction: discord.Interaction):
     await interaction.response.send_message("Update Panel:", view=UpdateView(), ephemeral=True)
 
+# ----------------- Bulk Admin -----------------
+# Export/import and season-wide changes run chunk by chunk against the live
+# store through the ledger (see bulk.py); one at a time, with progress shown
+# in the ephemeral reply. Changes default to a dry run.
+economy_admin = app_commands.Group(
+    name="economy", description="Export, import and bulk-edit economy data",
+    default_permissions=discord.Permissions(administrator=True), guild_only=True,
+)
+bulk_lock = asyncio.Lock()
+UPLOAD_LIMIT = 8 * 1024 * 1024
+
+async def run_bulk(interaction, title, job):
+    # Returns the job's stats, or None if it didn't run
+    if bulk_lock.locked():
+        await interaction.response.send_message("❌ Another bulk operation is still running.", ephemeral=True)
+        return None
+    async with bulk_lock:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        shown = [0.0]
+
+        async def progress(stats):
+            if time.monotonic() - shown[0] >= 2:
+                shown[0] = time.monotonic()
+                try:
+                    await interaction.edit_original_response(content=f"⏳ {title}: {bulk.describe(stats)}")
+                except discord.HTTPException as e:
+                    # Expired token or a Discord hiccup: the job itself keeps going
+                    print(f"⚠️ {title} progress not shown: {e}")
+
+        try:
+            return await job(progress)
+        except ValueError as e:
+            await bulk_reply(interaction, f"❌ {title} failed: {e}")
+            return None
+
+async def bulk_reply(interaction, content, path=None):
+    # The reply can only be edited for 15 minutes, which a large job may
+    # outlast. A File is used up by one request, so each attempt opens its own.
+    try:
+        await interaction.edit_original_response(content=content, attachments=[discord.File(path)] if path else discord.utils.MISSING)
+    except discord.HTTPException:
+        try:
+            await interaction.followup.send(content, ephemeral=True, file=discord.File(path) if path else discord.utils.MISSING)
+        except discord.HTTPException as e:
+            print(f"⚠️ Bulk result not delivered ({e}): {content}")
+
+def export_path(name):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    return os.path.join(EXPORT_DIR, f"{int(time.time() * 1000)}-{name}")
+
+def bulk_done(title, stats, dry_run=False):
+    return f"✅ {title}: {bulk.describe(stats)}" + (" — dry run, nothing was changed." if dry_run else ".")
+
+@economy_admin.command(name="export", description="Export users to a JSONL or CSV file")
+async def economy_export(interaction: discord.Interaction, format: Literal["csv", "jsonl"] = "csv", where: str = ""):
+    path = export_path(f"users.{format}")
+    stats = await run_bulk(interaction, "Export", lambda progress: bulk.export_users(
+        storage, path, format, bulk.parse_where(where), progress=progress))
+    if stats is None:
+        return
+    if os.path.getsize(path) <= UPLOAD_LIMIT:
+        await bulk_reply(interaction, bulk_done("Export", stats), path)
+    else:
+        await bulk_reply(interaction, bulk_done("Export", stats) + f" Too large to upload; saved as `{path}`.")
+
+@economy_admin.command(name="import", description="Set user fields from an exported JSONL or CSV file")
+async def economy_import(interaction: discord.Interaction, file: discord.Attachment, dry_run: bool = True):
+    path = export_path("import-" + os.path.basename(file.filename))
+
+    async def job(progress):
+        await file.save(path)
+        return await bulk.import_users(storage, ledger, path, dry_run=dry_run, progress=progress, track=track_user)
+
+    stats = await run_bulk(interaction, "Import", job)
+    if stats is not None:
+        await bulk_reply(interaction, bulk_done("Import", stats, dry_run))
+
+@economy_admin.command(name="adjust", description="Add money to (or take it from) every matching wallet")
+async def economy_adjust(interaction: discord.Interaction, amount: int, where: str = "", dry_run: bool = True):
+    stats = await run_bulk(interaction, "Adjust", lambda progress: bulk.adjust_users(
+        storage, ledger, amount, bulk.parse_where(where), dry_run=dry_run, progress=progress))
+    if stats is not None:
+        await bulk_reply(interaction, bulk_done("Adjust", stats, dry_run))
+
+@economy_admin.command(name="reset", description="Reset money and levels of matching users for a new season")
+async def economy_reset(interaction: discord.Interaction, where: str = "", dry_run: bool = True):
+    stats = await run_bulk(interaction, "Reset", lambda progress: bulk.reset_users(
+        storage, ledger, where=bulk.parse_where(where), dry_run=dry_run, progress=progress, track=track_user))
+    if stats is not None:
+        await bulk_reply(interaction, bulk_done("Reset", stats, dry_run))
+
+bot.tree.add_command(economy_admin)
+
+# ----------------- Metrics -----------------
+STORAGE_CALLS = (
+    "get_user", "ensure_user", "update_user", "add_wallet", "adjust_wallets", "add_xp", "add_xp_many", "top_users",
+    "get_wallet", "set_wallet", "put_ticket", "delete_ticket", "add_ticket_count",
+    "put_session", "delete_session", "set_config", "update_users",
+)
+
+def instrument_storage():
+    metrics.instrument(storage, "storage", STORAGE_CALLS)
+    if getattr(storage, "store", None) is not None:
+        # json backend: _snapshot is the part of a save that blocks the event loop
+        metrics.instrument(storage.store, "persistence", ("_snapshot", "flush_async"))
+    if isinstance(storage, CachedStorage):
+        # Cache misses and write-backs are what reaches the database
+        metrics.instrument(storage.backend, "persistence", ("get_user", "update_users"))
+    if isinstance(journal, Journal):
+        metrics.instrument(journal, "persistence", ("sync",))
+
+def instrument_bot():
+    # Wrapping the callback times the command body only, after discord.py has
+    # parsed the options, so the numbers are what our code costs per call.
+    for command in bot.tree.walk_commands():
+        if isinstance(command, app_commands.Command):
+            command._callback = metrics.wrap("command", command.name, command._callback)
+    for event in ("on_member_join", "on_member_remove"):
+        setattr(bot, event, metrics.wrap("event", event, getattr(bot, event)))
+
+def fmt_rows(rows, limit=15):
+    lines = [f"{'name':<18}{'calls':>7}{'err':>5}{'p50':>8}{'p95':>8}{'p99':>8}"]
+    for r in rows[:limit]:
+        lines.append(f"{r['name'][:18]:<18}{r['calls']:>7}{r['errors']:>5}"
+                     f"{r['p50']*1000:>8.1f}{r['p95']*1000:>8.1f}{r['p99']*1000:>8.1f}")
+    return "```\n" + "\n".join(lines) + "\n```"
+
+@bot.tree.command(description="Show command latency and error stats")
+@app_commands.default_permissions(administrator=True)
+async def stats(interaction: discord.Interaction):
+    e = emb("📈 Bot Stats", f"Uptime {timedelta(seconds=int(time.time() - metrics.started))} | latencies in ms")
+    for kind, title in (("command", "Commands"), ("event", "Events"), ("storage", "Storage"), ("persistence", "Saves"), ("outbox", "Outbox delay")):
+        rows = metrics.summary(kind)
+        if rows:
+            e.add_field(name=title, value=fmt_rows(rows), inline=False)
+    lag = metrics.histograms.get(("loop", "lag"))
+    if lag:
+        e.add_field(name="Event loop lag", value=f"p99 {lag.quantile(0.99)*1000:.1f} ms | max {lag.max*1000:.1f} ms", inline=False)
+    if outbox.sent or outbox.depth():
+        e.add_field(name="Outbox", value=f"queued {outbox.depth()} | sent {outbox.sent} | merged {outbox.coalesced} | failed {outbox.failed}", inline=False)
+    if isinstance(storage, CachedStorage):
+        e.add_field(name="User cache", value=f"{len(storage):,}/{storage.max_users:,} users | hit rate {storage.hit_ratio():.1%} | "
+                    f"misses {storage.misses:,} | evicted {storage.evictions:,} | written {storage.written:,}", inline=False)
+    phases = startup_phases()
+    if phases:
+        e.add_field(name="Startup", value=" | ".join(f"{phase} {secs:.2f}s" for phase, secs in phases), inline=False)
+    errors = {k: n for k, n in metrics.counters.items() if k.startswith("error_")}
+    if errors:
+        e.add_field(name="Errors", value=", ".join(f"{k[6:]}: {n}" for k, n in sorted(errors.items())), inline=False)
+    await interaction.response.send_message(embed=e, ephemeral=True)
+
+instrument_bot()
+
 
 if __name__ == "__main__":
     token = os.getenv("DISCORD_TOKEN")
@@ -0,0 +1,300 @@
+"""Streaming export/import and bulk changes to user records.
+
+Everything works chunk by chunk against a live Storage and Ledger: users are
+read with iter_users and written back through the ledger (locked, journaled,
+leaderboards kept current) `chunk` users at a time, with file I/O in an
+executor, so the bot keeps answering while an operation runs. The bot's
+/economy commands call these; the CLI below runs them against the data
+files of a stopped bot, or against a running cluster's state service.
+
+    python bulk.py export users.csv
+    python bulk.py import users.jsonl --dry-run
+    python bulk.py adjust 1000 --where "level>=10"
+    python bulk.py reset --state unix:/tmp/state.sock
+"""
+import argparse, asyncio, csv, io, json, operator, os, sys
+from storage import USER_FIELDS, create_storage, new_user
+from usercache import CachedStorage
+
+FORMATS = ("jsonl", "csv")
+COLUMNS = ("user_id",) + USER_FIELDS
+RESET_FIELDS = ("wallet", "bank", "xp", "level")  # what a season reset puts back to new_user()
+MINIMUMS = {"level": 1}  # smallest value an import may set; every other field is at least 0
+OPERATORS = {">=": operator.ge, "<=": operator.le, "!=": operator.ne, "==": operator.eq, "=": operator.eq,
+             ">": operator.gt, "<": operator.lt}
+
+
+def format_of(path, fmt=None):
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown format {fmt!r} (use {' or '.join(FORMATS)})")
+    return fmt
+
+
+def parse_where(text):
+    """"level>=10,wallet<100" -> predicate(record); None for an empty filter.
+    `money` is wallet + bank."""
+    tests = []
+    for clause in filter(None, (c.strip() for c in (text or "").split(","))):
+        for symbol, op in OPERATORS.items():
+            field, found, value = clause.partition(symbol)
+            if found:
+                field = field.strip()
+                if field not in USER_FIELDS and field != "money":
+                    raise ValueError(f"unknown field {field!r} in filter")
+                tests.append((field, op, int(value)))
+                break
+        else:
+            raise ValueError(f"can't parse filter {clause!r}")
+    if not tests:
+        return None
+
+    def match(u):
+        return all(op(u["wallet"] + u["bank"] if field == "money" else u[field], value) for field, op, value in tests)
+    return match
+
+
+async def _report(progress, stats):
+    if progress is not None:
+        await progress(stats)
+
+
+def _track(track, records):
+    if track is not None:
+        for uid, u in records.items():
+            track(uid, u)
+
+
+async def _chunks(storage, where, chunk):
+    # Lists of (uid, record) matching `where`, `chunk` users scanned at a time
+    batch, scanned = [], 0
+    async for uid, u in storage.iter_users(chunk):
+        scanned += 1
+        if where is None or where(u):
+            batch.append((uid, u))
+        if scanned % chunk == 0:
+            yield batch, scanned
+            batch = []
+    if batch or scanned % chunk:
+        yield batch, scanned
+
+
+# ----------------- Export -----------------
+def _encode(fmt, rows):
+    if fmt == "jsonl":
+        return "".join(json.dumps({"user_id": uid, **u}) + "\n" for uid, u in rows)
+    buf = io.StringIO()
+    csv.writer(buf, lineterminator="\n").writerows([uid, *(u[f] for f in USER_FIELDS)] for uid, u in rows)
+    return buf.getvalue()
+
+
+async def export_users(storage, path, fmt=None, where=None, chunk=1000, progress=None):
+    """Write every user (or those matching `where`) to `path`, replaced atomically."""
+    fmt = format_of(path, fmt)
+    loop = asyncio.get_running_loop()
+    tmp = f"{path}.tmp"
+    f = await loop.run_in_executor(None, lambda: open(tmp, "w", newline=""))
+    stats = {"scanned": 0, "exported": 0}
+    try:
+        if fmt == "csv":
+            await loop.run_in_executor(None, f.write, ",".join(COLUMNS) + "\n")
+        async for rows, stats["scanned"] in _chunks(storage, where, chunk):
+            await loop.run_in_executor(None, f.write, _encode(fmt, rows))
+            stats["exported"] += len(rows)
+            await _report(progress, stats)
+        await loop.run_in_executor(None, lambda: (f.flush(), os.fsync(f.fileno())))
+    finally:
+        await loop.run_in_executor(None, f.close)
+    await loop.run_in_executor(None, os.replace, tmp, path)
+    return stats
+
+
+# ----------------- Import -----------------
+def _records(f, fmt):
+    # (line number, {"user_id": ..., field: value}) with values still unparsed
+    if fmt == "csv":
+        for n, row in enumerate(csv.DictReader(f), start=2):
+            yield n, {k: v for k, v in row.items() if v not in (None, "")}
+    else:
+        for n, line in enumerate(f, start=1):
+            if line.strip():
+                yield n, json.loads(line)
+
+
+def _read_chunk(records, chunk):
+    out = []
+    for item in records:
+        out.append(item)
+        if len(out) == chunk:
+            break
+    return out
+
+
+def _parse(n, record):
+    try:
+        uid = str(int(record.pop("user_id")))
+        fields = {k: int(v) for k, v in record.items() if k in USER_FIELDS}
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"line {n}: {e!r}") from None
+    unknown = set(record) - set(USER_FIELDS)
+    if unknown:
+        raise ValueError(f"line {n}: unknown fields {sorted(unknown)}")
+    for name, value in fields.items():
+        if value < MINIMUMS.get(name, 0):
+            raise ValueError(f"line {n}: {name} must be at least {MINIMUMS.get(name, 0)}, got {value}")
+    return uid, fields
+
+
+async def import_users(storage, ledger, path, fmt=None, chunk=1000, dry_run=False, progress=None, track=None):
+    """Set the fields given for each user in `path` (an export, or any subset
+    of its columns). Users not in storage yet are created. With `dry_run`
+    nothing is written; the stats say what would change. `track(uid, record)`
+    is called for every record written (e.g. to move leaderboards)."""
+    fmt = format_of(path, fmt)
+    loop = asyncio.get_running_loop()
+    f = await loop.run_in_executor(None, lambda: open(path, newline=""))
+    stats = {"rows": 0, "new_users": 0, "money_change": 0}
+    try:
+        records = _records(f, fmt)
+        while True:
+            batch = await loop.run_in_executor(None, _read_chunk, records, chunk)
+            if not batch:
+                break
+            updates = dict(_parse(n, r) for n, r in batch)
+            for uid, fields in updates.items():
+                old = await storage.get_user(uid)
+                if old is None:
+                    stats["new_users"] += 1
+                    old = new_user()
+                new = {**old, **fields}
+                stats["money_change"] += new["wallet"] + new["bank"] - old["wallet"] - old["bank"]
+            if not dry_run:
+                _track(track, await ledger.set_many(updates, "import"))
+            stats["rows"] += len(batch)
+            await _report(progress, stats)
+    finally:
+        await loop.run_in_executor(None, f.close)
+    return stats
+
+
+# ----------------- Bulk Changes -----------------
+async def adjust_users(storage, ledger, amount, where=None, chunk=1000, dry_run=False, progress=None):
+    """Add `amount` to the wallet of every user matching `where` (a fine when
+    negative; wallets stop at 0)."""
+    if not amount:
+        raise ValueError("amount must not be 0")
+    stats = {"scanned": 0, "matched": 0, "money_change": 0}
+    async for rows, stats["scanned"] in _chunks(storage, where, chunk):
+        if rows:
+            if dry_run:
+                stats["money_change"] += sum(max(amount, -u["wallet"]) for _, u in rows)
+            else:
+                wallets = await ledger.adjust_many({uid: amount for uid, _ in rows}, "bulk_adjust")
+                stats["money_change"] += sum(wallets[uid] - u["wallet"] for uid, u in rows)
+            stats["matched"] += len(rows)
+        await _report(progress, stats)
+    return stats
+
+
+async def reset_users(storage, ledger, fields=RESET_FIELDS, where=None, chunk=1000, dry_run=False, progress=None, track=None):
+    """Put `fields` of every user matching `where` back to new_user() values."""
+    unknown = set(fields) - set(USER_FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields {sorted(unknown)}")
+    start = {name: new_user()[name] for name in fields}
+    stats = {"scanned": 0, "matched": 0, "money_change": 0}
+    async for rows, stats["scanned"] in _chunks(storage, where, chunk):
+        if rows:
+            if not dry_run:
+                _track(track, await ledger.set_many({uid: start for uid, _ in rows}, "reset"))
+            for _, u in rows:
+                new = {**u, **start}
+                stats["money_change"] += new["wallet"] + new["bank"] - u["wallet"] - u["bank"]
+            stats["matched"] += len(rows)
+        await _report(progress, stats)
+    return stats
+
+
+def describe(stats):
+    return ", ".join(f"{k.replace('_', ' ')} {v:,}" for k, v in stats.items())
+
+
+# ----------------- CLI -----------------
+async def run(args):
+    from journal import Journal, checkpoint, recover, write_ahead
+    from ledger import Ledger
+    from state import RemoteLedger, RemoteStorage
+
+    if args.state:
+        storage = RemoteStorage(args.state)
+        await storage.open()
+        ledger, journal = RemoteLedger(storage), None
+    else:
+        # The bot must be stopped: it holds the same files
+        storage = create_storage(args.backend, json_path=args.data, db_path=args.db)
+        if args.backend == "sqlite":
+            storage = CachedStorage(storage)
+        journal = Journal(args.journal)
+        write_ahead(storage, journal)
+        await storage.open()
+        journal.open()
+        await recover(storage, journal)
+        journal.start()
+        ledger = Ledger(storage, journal)
+
+    async def progress(stats):
+        print(f"\r{describe(stats)}", end="", file=sys.stderr, flush=True)
+
+    where = parse_where(args.where) if "where" in args else None
+    try:
+        if args.command == "export":
+            stats = await export_users(storage, args.path, args.format, where, args.chunk, progress)
+        elif args.command == "import":
+            stats = await import_users(storage, ledger, args.path, args.format, args.chunk, args.dry_run, progress)
+        elif args.command == "adjust":
+            stats = await adjust_users(storage, ledger, args.amount, where, args.chunk, args.dry_run, progress)
+        else:
+            fields = tuple(args.fields.split(","))
+            stats = await reset_users(storage, ledger, fields, where, args.chunk, args.dry_run, progress)
+    finally:
+        if journal is not None:
+            await journal.stop()
+            await checkpoint(storage, journal)
+        await storage.close()
+        if journal is not None:
+            journal.close()
+    print(file=sys.stderr)
+    dry = " (dry run, nothing written)" if getattr(args, "dry_run", False) else ""
+    print(f"✅ {args.command}: {describe(stats)}{dry}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--state", default=os.environ.get("STATE_ADDRESS", ""), help="state service of a running cluster")
+    ap.add_argument("--backend", choices=("sqlite", "json"), default=os.environ.get("STORAGE_BACKEND", "sqlite"))
+    ap.add_argument("--data", default="data.json")
+    ap.add_argument("--db", default=os.environ.get("DB_FILE", "data.db"))
+    ap.add_argument("--journal", default=os.environ.get("JOURNAL_FILE", "ledger.jsonl"))
+    ap.add_argument("--chunk", type=int, default=1000)
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("export", help="write users to a .jsonl or .csv file")
+    p.add_argument("path")
+    p.add_argument("--format", choices=FORMATS)
+    p.add_argument("--where", default="", help='e.g. "level>=10,money<1000"')
+    p = sub.add_parser("import", help="set user fields from a .jsonl or .csv file")
+    p.add_argument("path")
+    p.add_argument("--format", choices=FORMATS)
+    p.add_argument("--dry-run", action="store_true")
+    p = sub.add_parser("adjust", help="add an amount to matching wallets")
+    p.add_argument("amount", type=int)
+    p.add_argument("--where", default="")
+    p.add_argument("--dry-run", action="store_true")
+    p = sub.add_parser("reset", help="reset matching users for a new season")
+    p.add_argument("--fields", default=",".join(RESET_FIELDS))
+    p.add_argument("--where", default="")
+    p.add_argument("--dry-run", action="store_true")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Run the bot as several shard-worker processes around one state service.
+
+    python cluster.py --shards 8 --workers 4
+    python cluster.py --shards 8 --layout 0-2,3-5,6-7
+    python cluster.py --shards 4 --workers 2 --fake-gateway --events 20000
+
+The launcher starts state.py, then one `bot.py` per worker with SHARD_COUNT,
+SHARD_IDS and STATE_ADDRESS set, and restarts any worker that dies.
+
+--fake-gateway runs the workers without Discord: every worker sees the same
+seeded stream of guild events and handles only those whose guild maps to one
+of its shards (Discord's (guild_id >> 22) % shard_count rule), driving the
+same ledger, XP and storage calls the slash commands make. The launcher then
+checks that no wallet or XP change was lost or applied twice across
+processes and that the pushed leaderboards match storage.
+"""
+import argparse, asyncio, json, os, random, signal, subprocess, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RESTART_DELAY = 5  # seconds before a crashed worker is started again
+
+
+def shard_ranges(shards, workers):
+    """Split shard ids 0..shards-1 into `workers` contiguous runs."""
+    if not 1 <= workers <= shards:
+        raise ValueError("need 1 <= workers <= shards")
+    size, extra = divmod(shards, workers)
+    ranges, start = [], 0
+    for w in range(workers):
+        stop = start + size + (w < extra)
+        ranges.append(list(range(start, stop)))
+        start = stop
+    return ranges
+
+
+def parse_layout(layout, shards):
+    ranges = []
+    for part in layout.split(","):
+        lo, _, hi = part.partition("-")
+        ranges.append(list(range(int(lo), int(hi or lo) + 1)))
+    assigned = sorted(s for r in ranges for s in r)
+    if assigned != list(range(shards)):
+        raise ValueError(f"layout {layout!r} must cover shards 0-{shards - 1} exactly once")
+    return ranges
+
+
+def shard_of(guild_id, shard_count):
+    return (guild_id >> 22) % shard_count
+
+
+# ----------------- Fake Gateway -----------------
+def fake_events(n, seed, users=500, guilds=64):
+    """The seeded event stream every fake worker replays: (guild_id, kind, uid, other, amount)."""
+    rng = random.Random(seed)
+    guild_ids = [rng.getrandbits(40) << 22 | rng.getrandbits(22) for _ in range(guilds)]
+    uids = [10**17 + i for i in range(users)]
+    for _ in range(n):
+        kind = rng.choice(("daily", "send", "bet", "bet", "xp"))
+        yield rng.choice(guild_ids), kind, rng.choice(uids), rng.choice(uids), rng.randint(1, 500)
+
+
+async def fake_worker(events, seed):
+    # Imported here: bot.py reads SHARD_* and STATE_ADDRESS from the environment.
+    import bot, games
+
+    await bot.storage.open()
+    bot.xp_buffer.start()
+    rng = random.Random(f"{seed}:{bot.SHARD_IDS}")
+    shards = set(bot.SHARD_IDS)
+    handled, issued, xp = 0, 0, 0
+
+    async def handle(guild_id, kind, uid, other, amount):
+        nonlocal handled, issued, xp
+        if kind == "daily":
+            wallet, _ = await bot.ledger.claim(uid, amount, now=rng.randint(0, 10**9))
+            if wallet is not None:
+                issued += amount
+            bot.add_xp(uid, 20)
+            xp += 20
+        elif kind == "send" and uid != other:
+            await bot.ledger.transfer(uid, other, amount)
+        elif kind == "bet":
+            _, win, gained = games.coinflip(rng.choice(("heads", "tails")), amount, rng)
+            if await bot.ledger.settle_bet(uid, amount, win, "coinflip") is not None:
+                issued += win - amount
+        else:
+            bot.add_xp(uid, amount % 25)
+            xp += amount % 25
+        handled += 1
+
+    pending = set()
+    for event in fake_events(events, seed):
+        if shard_of(event[0], bot.SHARD_COUNT) not in shards:
+            continue  # the gateway delivers this guild to another worker
+        pending.add(asyncio.ensure_future(handle(*event)))
+        if len(pending) >= 64:
+            _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    if pending:
+        await asyncio.gather(*pending)
+    await bot.xp_buffer.close()
+    await bot.storage.close()
+    print(json.dumps({"shards": bot.SHARD_IDS, "handled": handled, "issued": issued, "xp": xp}), flush=True)
+
+
+async def totals(storage):
+    from xp import total_xp
+    money, xp, wealth, levels = 0, 0, {}, {}
+    async for uid, u in storage.iter_users():
+        money += u["wallet"] + u["bank"]
+        xp += total_xp(u["xp"], u["level"])
+        wealth[int(uid)] = u["wallet"] + u["bank"]
+        levels[int(uid)] = total_xp(u["xp"], u["level"])
+    return money, xp, wealth, levels
+
+
+async def fake_cluster(args, address, ranges, env):
+    from state import RemoteStorage
+    from leaderboard import RankIndex
+    from storage import START_BALANCE
+
+    boards = {"wealth": RankIndex(), "level": RankIndex()}
+    observer = RemoteStorage(address, boards=boards)
+    await observer.open()
+    await observer.load_boards()
+    money0, xp0, wealth0, _ = await totals(observer)
+
+    started = time.perf_counter()
+    procs = [
+        await asyncio.create_subprocess_exec(
+            sys.executable, __file__, "worker", "--events", str(args.events), "--seed", str(args.seed),
+            env=dict(env, SHARD_IDS=",".join(map(str, r))), stdout=subprocess.PIPE,
+        )
+        for r in ranges
+    ]
+    reports = []
+    for proc in procs:
+        out, _ = await proc.communicate()
+        if proc.returncode:
+            raise SystemExit(f"fake worker exited with {proc.returncode}")
+        reports.append(json.loads(out.decode().strip().splitlines()[-1]))
+    elapsed = time.perf_counter() - started
+
+    # Pushes to the observer are written before any later reply on its
+    # connection, so once this read returns its boards are up to date.
+    money1, xp1, wealth, levels = await totals(observer)
+    await observer.close()
+    new_users = len(set(wealth) - set(wealth0))
+    expected = money0 + new_users * START_BALANCE + sum(r["issued"] for r in reports)
+    handled = sum(r["handled"] for r in reports)
+    for r in reports:
+        print(f"shards {r['shards']}: {r['handled']} events")
+    print(f"{handled} events in {elapsed:.2f}s ({handled / elapsed:,.0f}/s) across {len(ranges)} workers")
+    print(f"money {money1} expected {expected} | xp {xp1 - xp0} expected {sum(r['xp'] for r in reports)}")
+    boards_ok = all(boards["wealth"].score(u) == s for u, s in wealth.items()) and \
+        all((boards["level"].score(u) or 0) == s for u, s in levels.items())  # users without XP may be unlisted
+    print(f"pushed leaderboards match storage: {boards_ok}")
+    assert handled == args.events, "every event must be handled by exactly one worker"
+    assert money1 == expected and xp1 - xp0 == sum(r["xp"] for r in reports)
+    assert boards_ok
+
+
+# ----------------- Launcher -----------------
+async def wait_for_state(address, proc, timeout=30):
+    from state import StateClient
+    deadline = time.monotonic() + timeout
+    while True:
+        if proc.returncode is not None:
+            raise SystemExit(f"state service exited with {proc.returncode}")
+        client = StateClient(address)
+        try:
+            await client.connect()
+            await client.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def supervise(ranges, env):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    procs = {}
+
+    async def spawn(i):
+        procs[i] = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(HERE, "bot.py"), env=dict(env, SHARD_IDS=",".join(map(str, ranges[i]))),
+        )
+        print(f"worker {i} (shards {ranges[i]}) started as pid {procs[i].pid}")
+
+    async def keep_alive(i):
+        while not stop.is_set():
+            await spawn(i)
+            code = await procs[i].wait()
+            if stop.is_set():
+                return
+            print(f"worker {i} exited with {code}; restarting in {RESTART_DELAY}s")
+            try:
+                await asyncio.wait_for(stop.wait(), RESTART_DELAY)
+            except asyncio.TimeoutError:
+                pass
+
+    watchers = [loop.create_task(keep_alive(i)) for i in range(len(ranges))]
+    await stop.wait()
+    for proc in procs.values():
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)  # discord.py closes cleanly on KeyboardInterrupt
+    await asyncio.gather(*watchers)
+
+
+async def launch(args):
+    ranges = parse_layout(args.layout, args.shards) if args.layout else shard_ranges(args.shards, args.workers)
+    state = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(HERE, "state.py"), "--address", args.state,
+        "--backend", args.backend, "--db", args.db, "--data", args.data, "--journal", args.journal,
+    )
+    env = dict(os.environ, STATE_ADDRESS=args.state, SHARD_COUNT=str(args.shards))
+    try:
+        await wait_for_state(args.state, state)
+        if args.fake_gateway:
+            await fake_cluster(args, args.state, ranges, env)
+        else:
+            await supervise(ranges, env)
+    finally:
+        if state.returncode is None:
+            state.terminate()
+        await state.wait()
+
+
+def main():
+    if sys.argv[1:2] == ["worker"]:
+        ap = argparse.ArgumentParser(prog="cluster.py worker")
+        ap.add_argument("--events", type=int, default=10000)
+        ap.add_argument("--seed", type=int, default=1)
+        args = ap.parse_args(sys.argv[2:])
+        return asyncio.run(fake_worker(args.events, args.seed))
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--shards", type=int, default=int(os.environ.get("SHARD_COUNT", 2)))
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("CLUSTER_WORKERS", 1)))
+    ap.add_argument("--layout", default=os.environ.get("CLUSTER_LAYOUT", ""), help="explicit shard ranges, e.g. 0-3,4-7")
+    ap.add_argument("--state", default=os.environ.get("STATE_ADDRESS", "unix:/tmp/jhub-state.sock"))
+    ap.add_argument("--backend", default=os.environ.get("STORAGE_BACKEND", "sqlite"), choices=("sqlite", "json"))
+    ap.add_argument("--data", default="data.json")
+    ap.add_argument("--db", default=os.environ.get("DB_FILE", "data.db"))
+    ap.add_argument("--journal", default=os.environ.get("JOURNAL_FILE", "ledger.jsonl"))
+    ap.add_argument("--fake-gateway", action="store_true", help="drive the workers with synthetic events instead of Discord")
+    ap.add_argument("--events", type=int, default=10000)
+    ap.add_argument("--seed", type=int, default=1)
+    asyncio.run(launch(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
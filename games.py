@@ -0,0 +1,154 @@
+"""Game rules, separate from the slash commands that present them.
+
+Each game has a scalar function used by the bot (blackjack's live in
+blackjack.py), which takes any object with the `random` module's interface
+(pass `random.Random(seed)` for reproducible rounds), and a NumPy-batched `*_batch` twin used by simulate.py. The batch
+functions return per-round payout multipliers (payout / stake) and XP, and
+need NumPy; the scalar ones do not.
+"""
+import random
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # only the batched simulators need it
+    np = None
+
+# `result` is what the player sees, `payout` the amount credited back
+# (stake included, 0 on a loss) and `xp` the XP awarded.
+Outcome = namedtuple("Outcome", "result payout xp")
+
+ROULETTE_COLORS = ["red", "black", "green"]
+ROULETTE_WEIGHTS = [45, 45, 10]
+SLOT_SYMBOLS = ["🍒", "🍋", "🍉", "⭐", "7️⃣"]
+CARD_VALUES = [2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10, 11]
+DEALER_STANDS = 17
+DAILY_REWARD = (2500, 50000)
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("NumPy is required for batched simulation (pip install numpy)")
+
+
+def _gen(gen):
+    _require_numpy()
+    return gen if gen is not None else np.random.default_rng()
+
+
+# ----------------- Daily -----------------
+def daily_reward(rng=random):
+    return rng.randint(*DAILY_REWARD)
+
+
+# ----------------- Roulette -----------------
+def roulette(color, bet, rng=random):
+    result = rng.choices(ROULETTE_COLORS, weights=ROULETTE_WEIGHTS)[0]
+    if result == color:
+        return Outcome(result, bet*2, 5)
+    if result == "green":
+        return Outcome(result, bet*5, 10)
+    return Outcome(result, 0, 0)
+
+
+def roulette_batch(n, color="red", gen=None):
+    gen = _gen(gen)
+    p = np.array(ROULETTE_WEIGHTS) / sum(ROULETTE_WEIGHTS)
+    landed = gen.choice(len(ROULETTE_COLORS), size=n, p=p)
+    picked = landed == ROULETTE_COLORS.index(color)
+    green = landed == ROULETTE_COLORS.index("green")
+    return np.where(picked, 2, np.where(green, 5, 0)), np.where(picked, 5, np.where(green, 10, 0))
+
+
+# ----------------- Slots -----------------
+def slots(bet, rng=random):
+    roll = [rng.choice(SLOT_SYMBOLS) for _ in range(3)]
+    distinct = len(set(roll))
+    if distinct == 1:
+        return Outcome(roll, bet*5, 10)
+    if distinct == 2:
+        return Outcome(roll, bet*2, 5)
+    return Outcome(roll, 0, 0)
+
+
+def slots_batch(n, gen=None):
+    gen = _gen(gen)
+    a, b, c = gen.integers(0, len(SLOT_SYMBOLS), size=(3, n))
+    matches = (a == b).astype(np.int8) + (b == c) + (a == c)  # 3 = jackpot, 1 = pair
+    return np.where(matches == 3, 5, np.where(matches == 1, 2, 0)), np.where(matches == 3, 10, np.where(matches == 1, 5, 0))
+
+
+# ----------------- Coinflip -----------------
+def coinflip(choice, bet, rng=random):
+    res = rng.choice(["heads", "tails"])
+    return Outcome(res, bet*2, 5) if res == choice else Outcome(res, 0, 0)
+
+
+def coinflip_batch(n, gen=None):
+    win = _gen(gen).integers(0, 2, size=n) == 0
+    return np.where(win, 2, 0), np.where(win, 5, 0)
+
+
+# ----------------- Dice -----------------
+def dice(guess, bet, rng=random):
+    roll = rng.randint(1, 6)
+    return Outcome(roll, bet*6, 10) if roll == guess else Outcome(roll, 0, 0)
+
+
+def dice_batch(n, guess=1, gen=None):
+    win = _gen(gen).integers(1, 7, size=n) == guess
+    return np.where(win, 6, 0), np.where(win, 10, 0)
+
+
+# ----------------- HighLow -----------------
+def highlow(guess, bet, rng=random):
+    roll = rng.randint(1, 100)
+    result = "high" if roll > 50 else "low"
+    return Outcome((roll, result), bet*2, 5) if guess == result else Outcome((roll, result), 0, 0)
+
+
+def highlow_batch(n, guess="high", gen=None):
+    high = _gen(gen).integers(1, 101, size=n) > 50
+    win = high if guess == "high" else ~high
+    return np.where(win, 2, 0), np.where(win, 5, 0)
+
+
+# ----------------- Blackjack -----------------
+# Hands, the shoe and the scalar rules live in blackjack.py. The batched
+# version draws from an infinite deck, which is close enough for RTP estimates.
+
+def _bj_add(total, soft, cards):
+    # Add one card to every hand, demoting soft aces (counted as 11) while bust.
+    total = total + cards
+    soft = soft + (cards == 11)
+    while True:
+        demote = (total > 21) & (soft > 0)
+        if not demote.any():
+            return total, soft
+        total = total - 10 * demote
+        soft = soft - demote
+
+
+def _bj_draw_until(total, soft, limit, active, gen, values):
+    while True:
+        drawing = active & (total < limit)
+        if not drawing.any():
+            return total, soft
+        cards = values[gen.integers(0, len(values), size=total.shape)]
+        t, s = _bj_add(total, soft, cards)
+        total, soft = np.where(drawing, t, total), np.where(drawing, s, soft)
+
+
+def blackjack_batch(n, stand_on=DEALER_STANDS, gen=None):
+    gen = _gen(gen)
+    values = np.array(CARD_VALUES)
+    zeros = np.zeros(n, dtype=np.int64)
+    player, psoft = _bj_add(*_bj_add(zeros, zeros, values[gen.integers(0, 13, size=n)]), values[gen.integers(0, 13, size=n)])
+    dealer, dsoft = _bj_add(*_bj_add(zeros, zeros, values[gen.integers(0, 13, size=n)]), values[gen.integers(0, 13, size=n)])
+    everyone = np.ones(n, dtype=bool)
+    player, psoft = _bj_draw_until(player, psoft, stand_on, everyone, gen, values)
+    alive = player <= 21
+    dealer, dsoft = _bj_draw_until(dealer, dsoft, DEALER_STANDS, alive, gen, values)
+    win = alive & ((dealer > 21) | (player > dealer))
+    push = alive & (player == dealer)
+    return np.where(win, 2, np.where(push, 1, 0)), np.where(win, 10, 0)
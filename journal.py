@@ -0,0 +1,521 @@
+"""Append-only journal of economy events, with snapshots and replay.
+
+Every event carries a sequence number, a timestamp and the values it left
+behind (e.g. the new wallet after a bet), so replaying an event that storage
+already contains changes nothing. That makes recovery simple: storage
+remembers the last sequence number it is known to contain
+(`journal_seq` in its config), and on startup everything after it is applied
+again. A checkpoint advances that marker and rotates the active file into a
+numbered segment, so the tail to replay stays bounded however long the bot
+has been running. Segments are kept for audits; `snapshots/` holds periodic
+full dumps so a rebuild never has to start from the very first event.
+
+The journal is written ahead of storage: a change and its entry are made
+without an await in between, and storage syncs the journal before buffered
+writes reach disk (see write_ahead), so storage never holds a change the
+journal lost in a crash, and replaying the tail can only move storage forward.
+
+    python journal.py rebuild --until "2026-10-01 12:00" --out state.json
+    python journal.py history 123456789012345678
+"""
+import argparse, asyncio, glob, json, logging, os, sys, time
+from datetime import datetime
+from persistence import write_atomic
+from storage import USER_FIELDS, new_user
+
+log = logging.getLogger(__name__)
+
+
+# ----------------- Segments -----------------
+def segment_paths(path):
+    """Archived segments of `path` in order, then the active file if it exists."""
+    root, ext = os.path.splitext(path)
+    segments = sorted(glob.glob(f"{glob.escape(root)}.[0-9]*{ext}"))
+    return segments + ([path] if os.path.exists(path) else [])
+
+
+def _first_seq(path, segment):
+    # Archived segments are named after their first seq; the active file is peeked
+    if segment != path:
+        return int(os.path.splitext(segment)[0].rsplit(".", 1)[1])
+    with open(segment, "r", encoding="utf-8") as f:
+        try:
+            return json.loads(f.readline()).get("seq")
+        except ValueError:
+            return None
+
+
+def read_journal(path, after=0):
+    """Entries with seq > `after` from every segment of `path`. Entries written
+    before sequence numbers existed (no "seq") are yielded only when after=0.
+    A segment whose successor starts at or below after+1 holds nothing newer
+    and isn't opened, so reading the tail costs the same however long the
+    history is."""
+    segments = segment_paths(path)
+    start = 0
+    if after:
+        for i in range(len(segments) - 1, 0, -1):
+            first = _first_seq(path, segments[i])
+            if first is not None and first <= after + 1:
+                start = i
+                break
+    for segment in segments[start:]:
+        with open(segment, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # torn final line from a crash
+                if entry.get("seq", 0) > after or (after == 0 and "seq" not in entry):
+                    yield entry
+
+
+def _scan(path):
+    """(end offset of the last complete entry, first seq, last seq) of one file."""
+    offset, first, last = 0, None, 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line) if line.strip() else {}
+            except ValueError:
+                break
+            offset += len(line)
+            if "seq" in entry:
+                first = entry["seq"] if first is None else first
+                last = entry["seq"]
+    return offset, first, last
+
+
+# ----------------- Transaction Journal -----------------
+class Journal:
+    """Append-only JSON-lines log of economy events.
+
+    `append` only buffers the line. A background task (started with `start`)
+    group-commits: it writes and fsyncs whatever accumulated every
+    `sync_interval` seconds, or as soon as `max_pending` entries wait.
+    `close` commits the rest. A torn last line left by a crash is cut off on
+    `open`.
+    """
+
+    def __init__(self, path, sync_interval=0.1, max_pending=1000):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.max_pending = max_pending
+        self._file = None
+        self.entries = 0
+        self.seq = 0
+        self.synced_seq = 0
+        self.syncs = 0
+        self._first_seq = None  # first seq in the active file
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._sync_lock = asyncio.Lock()
+        self._task = None
+
+    def open(self):
+        if self._file is not None:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Only the newest segment and the active file are read, so opening
+        # costs the same however many segments have piled up.
+        segments = segment_paths(self.path)
+        archived = segments[:-1] if os.path.exists(self.path) else segments
+        if archived:
+            self.seq = _scan(archived[-1])[2]
+        if os.path.exists(self.path):
+            offset, self._first_seq, last = _scan(self.path)
+            self.seq = max(self.seq, last)
+            if offset < os.path.getsize(self.path):
+                log.warning("Cutting a torn entry off the end of %s", self.path)
+                with open(self.path, "r+b") as f:
+                    f.truncate(offset)
+        self.synced_seq = self.seq
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def append(self, op, **fields):
+        if self._file is None:
+            self.open()
+        self.seq += 1
+        if self._first_seq is None:
+            self._first_seq = self.seq
+        fields["op"] = op
+        fields["seq"] = self.seq
+        fields["ts"] = time.time()
+        self._file.write(json.dumps(fields, separators=(",", ":")) + "\n")
+        self.entries += 1
+        if self.seq - self.synced_seq >= self.max_pending:
+            self._wake.set()
+        return self.seq
+
+    def flush(self):
+        # Hand buffered lines to the OS (not yet durable; see sync)
+        if self._file is not None:
+            self._file.flush()
+
+    def _commit(self):
+        self._file.flush()
+        seq = self.seq
+        return seq, self._file.fileno()
+
+    async def commit(self, op, **fields):
+        """Append and wait until the entry is durable, for a change written to
+        storage right after (see TicketService)."""
+        seq = self.append(op, **fields)
+        await self.sync()
+        return seq
+
+    async def sync(self):
+        """Make everything appended so far durable."""
+        if self._file is None or self.synced_seq == self.seq:
+            return
+        async with self._sync_lock:
+            seq, fd = self._commit()
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+            self.synced_seq = max(self.synced_seq, seq)
+            self.syncs += 1
+
+    def sync_now(self):
+        if self._file is not None and self.synced_seq != self.seq:
+            seq, fd = self._commit()
+            os.fsync(fd)
+            self.synced_seq = seq
+            self.syncs += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.sync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.sync()
+            except Exception:
+                log.exception("Syncing %s failed", self.path)
+
+    async def rotate(self):
+        """Close the active file as a numbered segment and start a new one."""
+        if self._file is None or self._first_seq is None:
+            return None
+        async with self._sync_lock:  # not while an fsync holds the old file
+            self.sync_now()
+            self._file.close()
+            root, ext = os.path.splitext(self.path)
+            segment = f"{root}.{self._first_seq:012d}{ext}"
+            os.replace(self.path, segment)
+            self._first_seq = None
+            self._file = open(self.path, "a", encoding="utf-8")
+        return segment
+
+    async def stop(self):
+        # Stopped rather than cancelled so an fsync in flight completes
+        if self._task is not None:
+            self._stop.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+
+    def close(self):
+        if self._file is not None:
+            self.sync_now()
+            self._file.close()
+            self._file = None
+
+
+class RemoteJournal:
+    """Journal for cluster workers: entries are appended by the state service."""
+
+    def __init__(self, client):
+        self.client = client
+        self._tasks = set()
+
+    def open(self):
+        pass
+
+    def append(self, op, **fields):
+        task = asyncio.get_running_loop().create_task(self.client.call("append", op, fields))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def commit(self, op, **fields):
+        await self.client.call("commit", op, fields)
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def close(self):
+        pass
+
+
+# ----------------- Replay -----------------
+def empty_state(defaults=None):
+    # `defaults` fill users an event touches for the first time; recovery
+    # passes {} so only fields the journal actually set are written back.
+    return {"seq": 0, "users": {}, "tickets": {}, "ticket_counts": {}, "closed": set(), "sessions": {},
+            "defaults": new_user() if defaults is None else defaults}
+
+
+def _user(state, uid):
+    users = state["users"]
+    uid = str(uid)
+    if uid not in users:
+        users[uid] = dict(state["defaults"])
+    return users[uid]
+
+
+def apply_event(state, e):
+    """Apply one journal entry to an in-memory state (see empty_state)."""
+    op = e["op"]
+    if "wallets" in e:
+        for uid, wallet in e["wallets"].items():
+            _user(state, uid)["wallet"] = wallet
+    if "wallet" in e and "uid" in e:
+        _user(state, e["uid"])["wallet"] = e["wallet"]
+    if "last_daily" in e:
+        _user(state, e["uid"])["last_daily"] = e["last_daily"]
+    if "levels" in e:
+        for uid, (xp, level) in e["levels"].items():
+            u = _user(state, uid)
+            u["xp"], u["level"] = xp, level
+    if "fields" in e:
+        _user(state, e["uid"]).update(e["fields"])
+    if "updates" in e:
+        for uid, fields in e["updates"].items():
+            _user(state, uid).update(fields)
+    if op == "ticket_open":
+        channel = str(e["channel"])
+        state["tickets"][channel] = {"opener_id": str(e["opener"]), "opened_at": e["opened_at"]}
+        state["closed"].discard(channel)
+    elif op == "ticket_close":
+        channel = str(e["channel"])
+        state["tickets"].pop(channel, None)
+        state["closed"].add(channel)
+        if e.get("staff") is not None:
+            state["ticket_counts"][str(e["staff"])] = e["count"]
+    elif op == "session":
+        state["sessions"][str(e["uid"])] = e["row"]  # None once the game ended
+    state["seq"] = max(state["seq"], e.get("seq", 0))
+
+
+async def recover(storage, journal):
+    """Re-apply the journal tail that storage may not contain yet. Returns the
+    number of events replayed."""
+    after = storage.get_config("journal_seq") or 0
+    tail = empty_state(defaults={})
+    replayed = 0
+    for e in read_journal(journal.path, after=after):
+        if "seq" in e:
+            apply_event(tail, e)
+            replayed += 1
+    if not replayed:
+        return 0
+    for uid, fields in tail["users"].items():
+        await storage.update_user(uid, **fields)
+    for channel_id, record in tail["tickets"].items():
+        await storage.put_ticket(channel_id, record)
+    for channel_id in tail["closed"]:
+        await storage.delete_ticket(channel_id)
+    for uid, row in tail["sessions"].items():
+        if row is None:
+            await storage.delete_session(uid)
+        else:
+            await storage.put_session(uid, dict(row, state=bytes.fromhex(row["state"])))
+    counts = await storage.load_ticket_counts()
+    for staff_id, count in tail["ticket_counts"].items():
+        if count > counts.get(staff_id, 0):
+            await storage.add_ticket_count(staff_id, count - counts.get(staff_id, 0))
+    log.info("Replayed %d journal events after seq %d", replayed, after)
+    return replayed
+
+
+def write_ahead(storage, journal):
+    """Make `storage` sync `journal` before its buffered writes reach disk.
+    Needs a backend that buffers: json, or sqlite behind a CachedStorage."""
+    if not storage.deferred:
+        raise ValueError(f"{type(storage).__name__} commits every call, so the journal can't be written ahead of it")
+    storage.before_write = journal.sync
+    return storage
+
+
+async def checkpoint(storage, journal):
+    """Record that storage holds everything up to now and rotate the journal."""
+    seq = journal.seq
+    # Users first: with a write-back cache in front of storage the marker
+    # must not become durable before the changes it vouches for
+    await storage.flush()
+    await storage.set_config("journal_seq", seq)
+    await storage.flush()
+    await journal.rotate()
+    return seq
+
+
+class Checkpointer:
+    """Runs `checkpoint` every `interval` seconds and, when `snapshot_dir` is
+    set, writes a snapshot at most every `snapshot_interval` seconds."""
+
+    def __init__(self, storage, journal, interval=300, snapshot_dir=None, snapshot_interval=3600, keep=24):
+        self.storage = storage
+        self.journal = journal
+        self.interval = interval
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.keep = keep
+        self.last_snapshot = 0.0
+        self._stop = asyncio.Event()
+        self._task = None
+
+    async def run_once(self):
+        seq = await checkpoint(self.storage, self.journal)
+        if self.snapshot_dir and time.time() - self.last_snapshot >= self.snapshot_interval:
+            await write_snapshot(self.storage, self.journal, self.snapshot_dir, self.keep)
+            self.last_snapshot = time.time()
+        return seq
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.run_once()
+            except Exception:
+                log.exception("Journal checkpoint failed")
+
+    async def close(self):
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
+
+
+# ----------------- Snapshots -----------------
+def snapshot_paths(directory):
+    return sorted(glob.glob(os.path.join(glob.escape(directory), "snapshot-*.json")))
+
+
+async def write_snapshot(storage, journal, directory, keep=24):
+    """Dump every user, ticket and ticket count to `directory`. The dump is
+    taken while events keep arriving, so it records the seq range it spans;
+    a rebuild replays from `seq` and only uses it for targets after `seq_end`."""
+    seq = journal.seq
+    users = {}
+    async for uid, u in storage.iter_users():
+        users[str(uid)] = [u[name] for name in USER_FIELDS]
+    snapshot = {
+        "seq": seq, "seq_end": journal.seq, "ts": time.time(), "fields": USER_FIELDS, "users": users,
+        "tickets": dict(await storage.load_tickets()), "ticket_counts": await storage.load_ticket_counts(),
+    }
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"snapshot-{seq:012d}.json")
+    # The dict is no longer touched by the loop, so it can be encoded off it
+    await asyncio.get_running_loop().run_in_executor(
+        None, lambda: write_atomic(path, json.dumps(snapshot, separators=(",", ":")))
+    )
+    for old in snapshot_paths(directory)[:-keep]:
+        os.unlink(old)
+    return path
+
+
+def load_snapshot(path):
+    with open(path, "r", encoding="utf-8") as f:
+        snap = json.load(f)
+    state = empty_state()
+    state["seq"] = snap["seq"]
+    state["users"] = {uid: dict(zip(snap["fields"], row)) for uid, row in snap["users"].items()}
+    state["tickets"] = snap["tickets"]
+    state["ticket_counts"] = snap["ticket_counts"]
+    return state, snap
+
+
+def rebuild(journal_path, snapshot_dir=None, until_seq=None, until_ts=None):
+    """State as of `until_seq` / `until_ts` (or the end of the journal)."""
+    state, base = empty_state(), 0
+    for path in reversed(snapshot_paths(snapshot_dir) if snapshot_dir else []):
+        state_, snap = load_snapshot(path)
+        if (until_seq is None or snap["seq_end"] <= until_seq) and (until_ts is None or snap["ts"] <= until_ts):
+            state, base = state_, snap["seq"]
+            break
+    for e in read_journal(journal_path, after=base):
+        if "seq" not in e:
+            continue
+        if (until_seq is not None and e["seq"] > until_seq) or (until_ts is not None and e["ts"] > until_ts):
+            break
+        apply_event(state, e)
+    return state
+
+
+def to_data_json(state):
+    """Rebuilt state in the data.json layout."""
+    return {
+        "journal_seq": state["seq"],
+        "balances": {uid: {k: u[k] for k in ("wallet", "bank", "last_daily")} for uid, u in state["users"].items()},
+        "xp": {uid: u["xp"] for uid, u in state["users"].items()},
+        "levels": {uid: u["level"] for uid, u in state["users"].items()},
+        "tickets": state["tickets"],
+        "ticket_counts": state["ticket_counts"],
+    }
+
+
+# ----------------- CLI -----------------
+def parse_time(text):
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Rebuild or inspect economy state from the journal.")
+    ap.add_argument("--journal", default=os.environ.get("JOURNAL_FILE", "ledger.jsonl"))
+    ap.add_argument("--snapshots", default=os.environ.get("SNAPSHOT_DIR", "snapshots"))
+    sub = ap.add_subparsers(dest="command", required=True)
+    rb = sub.add_parser("rebuild", help="write the state at a point in time as data.json-style JSON")
+    rb.add_argument("--until", help="ISO time or unix timestamp (default: end of journal)")
+    rb.add_argument("--seq", type=int, help="last event to include")
+    rb.add_argument("--out", default="-")
+    hist = sub.add_parser("history", help="list the events that touched a user")
+    hist.add_argument("uid")
+    args = ap.parse_args()
+
+    if args.command == "rebuild":
+        started = time.perf_counter()
+        state = rebuild(args.journal, args.snapshots, until_seq=args.seq,
+                        until_ts=parse_time(args.until) if args.until else None)
+        payload = json.dumps(to_data_json(state), indent=2)
+        if args.out == "-":
+            print(payload)
+        else:
+            write_atomic(args.out, payload)
+        print(f"Rebuilt {len(state['users'])} users up to seq {state['seq']} in {time.perf_counter() - started:.2f}s",
+              file=sys.stderr)
+    else:
+        uid = str(args.uid)
+        for e in read_journal(args.journal):
+            if uid in (str(e.get("uid")), str(e.get("src")), str(e.get("dst"))) or uid in e.get("levels", {}) \
+                    or uid in e.get("wallets", {}):
+                when = datetime.fromtimestamp(e["ts"]).isoformat(sep=" ", timespec="seconds")
+                detail = {k: v for k, v in e.items() if k not in ("op", "ts", "seq")}
+                print(f"{e.get('seq', '-'):>8}  {when}  {e['op']:<12} {json.dumps(detail)}")
+
+
+if __name__ == "__main__":
+    main()
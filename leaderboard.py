@@ -0,0 +1,185 @@
+from bisect import bisect_left, insort
+
+LOAD = 512  # target sublist length; sublists split at 2 * LOAD
+
+
+# ----------------- Sorted Key List -----------------
+class SortedKeyList:
+    """A sorted list split into sublists of about LOAD keys.
+
+    `_maxes` holds the last key of each sublist so a key's sublist is found by
+    bisection, and a Fenwick tree over the sublist lengths turns positions into
+    (sublist, offset) pairs and back in O(log n). Inserts and removals only
+    shift one sublist; the tree is rebuilt when a sublist splits or empties.
+    """
+
+    def __init__(self, keys=()):
+        self._lists = []
+        self._maxes = []
+        self._tree = []
+        self._len = 0
+        self.bulk_load(keys)
+
+    def bulk_load(self, keys):
+        keys = sorted(keys)
+        self._lists = [keys[i:i + LOAD] for i in range(0, len(keys), LOAD)]
+        self._maxes = [sub[-1] for sub in self._lists]
+        self._len = len(keys)
+        self._rebuild()
+
+    def __len__(self):
+        return self._len
+
+    # Fenwick tree over sublist lengths
+    def _rebuild(self):
+        tree = [0] * (len(self._lists) + 1)
+        for i, sub in enumerate(self._lists, start=1):
+            tree[i] += len(sub)
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _bump(self, i, delta):
+        i += 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, i):
+        # Number of keys in sublists [0, i)
+        total = 0
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, pos):
+        # Sublist index and offset of the key at position `pos`
+        i, step = 0, 1 << (len(self._tree).bit_length() - 1)
+        while step:
+            nxt = i + step
+            if nxt < len(self._tree) and self._tree[nxt] <= pos:
+                i = nxt
+                pos -= self._tree[nxt]
+            step >>= 1
+        return i, pos
+
+    def add(self, key):
+        if not self._lists:
+            self._lists.append([key])
+            self._maxes.append(key)
+            self._len = 1
+            self._rebuild()
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._lists[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._lists[i], key)
+        self._len += 1
+        sub = self._lists[i]
+        if len(sub) > 2 * LOAD:
+            self._lists[i:i + 1] = [sub[:LOAD], sub[LOAD:]]
+            self._maxes[i:i + 1] = [sub[LOAD - 1], sub[-1]]
+            self._rebuild()
+        else:
+            self._bump(i, 1)
+
+    def remove(self, key):
+        i = bisect_left(self._maxes, key)
+        sub = self._lists[i] if i < len(self._lists) else None
+        j = bisect_left(sub, key) if sub else 0
+        if sub is None or j == len(sub) or sub[j] != key:
+            raise KeyError(key)
+        del sub[j]
+        self._len -= 1
+        if not sub:
+            del self._lists[i], self._maxes[i]
+            self._rebuild()
+            return
+        if j == len(sub):
+            self._maxes[i] = sub[-1]
+        self._bump(i, -1)
+
+    def index(self, key):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            raise KeyError(key)
+        sub = self._lists[i]
+        j = bisect_left(sub, key)
+        if sub[j] != key:
+            raise KeyError(key)
+        return self._prefix(i) + j
+
+    def slice(self, start, stop):
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        i, j = self._locate(start)
+        out = []
+        while len(out) < stop - start:
+            sub = self._lists[i]
+            out.extend(sub[j:j + (stop - start - len(out))])
+            i, j = i + 1, 0
+        return out
+
+
+# ----------------- Rank Index -----------------
+class RankIndex:
+    """uid -> score with highest-first top-N and rank queries.
+
+    Keys are stored as (-score, uid) so ties are broken by user ID and the
+    natural ascending order of the sorted list is the leaderboard order.
+    """
+
+    def __init__(self):
+        self._scores = {}
+        self._keys = SortedKeyList()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, uid):
+        return int(uid) in self._scores
+
+    def load(self, items):
+        self._scores = {int(uid): score for uid, score in items}
+        self._keys.bulk_load((-score, uid) for uid, score in self._scores.items())
+
+    def score(self, uid):
+        return self._scores.get(int(uid))
+
+    def uids(self):
+        return list(self._scores)
+
+    def update(self, uid, score):
+        uid = int(uid)
+        old = self._scores.get(uid)
+        if old == score:
+            return
+        if old is not None:
+            self._keys.remove((-old, uid))
+        self._scores[uid] = score
+        self._keys.add((-score, uid))
+
+    def adjust(self, uid, delta, default=0):
+        self.update(uid, self._scores.get(int(uid), default) + delta)
+
+    def remove(self, uid):
+        uid = int(uid)
+        old = self._scores.pop(uid, None)
+        if old is not None:
+            self._keys.remove((-old, uid))
+
+    def top(self, n, offset=0):
+        return [(uid, -neg) for neg, uid in self._keys.slice(offset, offset + n)]
+
+    def rank(self, uid):
+        """1-based position of `uid`, or None if it isn't indexed."""
+        score = self._scores.get(int(uid))
+        if score is None:
+            return None
+        return self._keys.index((-score, int(uid))) + 1
@@ -0,0 +1,155 @@
+import asyncio, contextlib, time
+from storage import START_BALANCE, new_user
+
+
+# ----------------- Ledger -----------------
+class Ledger:
+    """Atomic wallet operations on top of a Storage backend.
+
+    Each user maps to one of `shards` locks, and an operation holds the locks
+    of every user it touches (taken in shard order, so two transfers in
+    opposite directions cannot deadlock). The balance check and the write
+    happen in a single `adjust_wallets` call, so a check-then-debit can never
+    interleave with another operation on the same wallet. Every applied
+    operation is appended to the journal together with the balances it left
+    behind, right after the storage call returns and before anything else
+    runs, so storage can write the journal ahead of itself (see
+    journal.write_ahead). The wealth `index` (a leaderboard.RankIndex keyed
+    on wallet+bank) is moved by the same deltas.
+    """
+
+    def __init__(self, storage, journal=None, index=None, shards=256):
+        self.storage = storage
+        self.journal = journal
+        self.index = index
+        self._locks = [asyncio.Lock() for _ in range(shards)]
+
+    def _shard(self, uid):
+        return int(uid) % len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def locked(self, *uids):
+        async with contextlib.AsyncExitStack() as stack:
+            for shard in sorted({self._shard(uid) for uid in uids}):
+                await stack.enter_async_context(self._locks[shard])
+            yield
+
+    def _log(self, op, **fields):
+        # The journal group-commits in the background; see Journal.start
+        if self.journal is not None:
+            self.journal.append(op, **fields)
+
+    def _track(self, deltas):
+        if self.index is not None:
+            for uid, delta in deltas.items():
+                if delta or uid not in self.index:  # a user created without a wallet change still ranks
+                    self.index.adjust(uid, delta, default=START_BALANCE)
+
+    async def transfer(self, src, dst, amount):
+        """Move `amount` from src to dst. Returns {uid: wallet} or None if src can't cover it."""
+        amount = int(amount)
+        if amount <= 0:
+            raise ValueError("transfer amount must be positive")
+        if str(src) == str(dst):
+            raise ValueError("cannot transfer to the same user")
+        async with self.locked(src, dst):
+            result = await self.storage.adjust_wallets({src: -amount, dst: amount})
+            if result is not None:
+                self._log("transfer", src=str(src), dst=str(dst), amount=amount, wallets=result)
+                self._track({src: -amount, dst: amount})
+        return result
+
+    async def debit_if_sufficient(self, uid, amount, reason="debit"):
+        """Take `amount` from the wallet if it holds enough. Returns the new wallet or None."""
+        amount = int(amount)
+        if amount <= 0:
+            raise ValueError("debit amount must be positive")
+        async with self.locked(uid):
+            result = await self.storage.adjust_wallets({uid: -amount})
+            if result is None:
+                return None
+            self._log("debit", uid=str(uid), amount=amount, reason=reason, wallet=result[str(uid)])
+            self._track({uid: -amount})
+        return result[str(uid)]
+
+    async def credit(self, uid, amount, reason="credit"):
+        """Add `amount` to the wallet, e.g. to pay out a bet that was debited earlier."""
+        amount = int(amount)
+        if amount < 0:
+            raise ValueError("credit amount must not be negative")
+        async with self.locked(uid):
+            return await self._credit(uid, amount, reason)
+
+    async def _credit(self, uid, amount, reason, **extra):
+        wallet = await self.storage.add_wallet(uid, amount)
+        self._log("credit", uid=str(uid), amount=amount, reason=reason, wallet=wallet, **extra)
+        self._track({uid: amount})
+        return wallet
+
+    async def claim(self, uid, amount, reason="daily", field="last_daily", cooldown=86400, now=None):
+        """Credit `amount` at most once per `cooldown` seconds, stamping the user's
+        `field` with the claim time. Returns (wallet, 0), or (None, seconds left)."""
+        amount = int(amount)
+        now = int(now if now is not None else time.time())
+        async with self.locked(uid):
+            u = await self.storage.get_user(uid) or new_user()
+            left = cooldown - (now - u[field])
+            if left > 0:
+                return None, left
+            # Stamp and reward in one write, so a crash can't keep one without the other
+            result = await self.storage.update_users({uid: {field: now, "wallet": u["wallet"] + amount}})
+            wallet = result[str(uid)]["wallet"]
+            self._log("credit", uid=str(uid), amount=amount, reason=reason, wallet=wallet, **{field: now})
+            self._track({uid: amount})
+        return wallet, 0
+
+    async def settle_bet(self, uid, stake, payout, game="bet"):
+        """Debit `stake` and credit `payout` in one step. Returns the new wallet or None
+        if the wallet can't cover the stake."""
+        stake, payout = int(stake), int(payout)
+        if stake <= 0 or payout < 0:
+            raise ValueError("stake must be positive and payout not negative")
+        async with self.locked(uid):
+            result = await self.storage.adjust_wallets({uid: payout - stake}, require={uid: stake})
+            if result is None:
+                return None
+            self._log("bet", uid=str(uid), stake=stake, payout=payout, game=game, wallet=result[str(uid)])
+            self._track({uid: payout - stake})
+        return result[str(uid)]
+
+    async def adjust_many(self, deltas, reason="bulk"):
+        """Add {uid: delta} to many wallets at once (an admin bonus or fine).
+        Negative deltas stop at an empty wallet. Returns {uid: wallet}."""
+        deltas = {str(uid): int(d) for uid, d in deltas.items() if int(d)}
+        async with self.locked(*deltas):
+            for uid, delta in deltas.items():
+                if delta < 0:
+                    deltas[uid] = max(delta, -await self.storage.get_wallet(uid))
+            result = await self.storage.adjust_wallets(deltas)
+            if result:
+                self._log("bulk", reason=reason, deltas=deltas, wallets=result)
+                self._track(deltas)
+        return result
+
+    async def set_many(self, updates, reason="bulk"):
+        """Overwrite fields of many users, e.g. for a season reset or an import.
+        Returns {uid: record} as left behind."""
+        updates = {str(uid): fields for uid, fields in updates.items()}
+        async with self.locked(*updates):
+            result = await self.storage.update_users(updates)
+            if result:
+                self._log("set", reason=reason, updates=updates)
+                if self.index is not None:
+                    for uid, u in result.items():
+                        self.index.update(uid, u["wallet"] + u["bank"])
+        return result
+
+    async def grant_xp(self, grants):
+        """Apply {uid: amount} XP grants in one storage call and journal the
+        resulting levels. Returns {uid: (xp, level)}."""
+        result = await self.storage.add_xp_many(grants)
+        if result:
+            self._log("xp", grants={str(uid): n for uid, n in grants.items()},
+                      levels={uid: list(r) for uid, r in result.items()})
+            self._track(dict.fromkeys(result, 0))
+        return result
@@ -0,0 +1,210 @@
+import asyncio, functools, logging, time
+from bisect import bisect_left
+from contextlib import contextmanager
+from persistence import write_atomic
+
+log = logging.getLogger(__name__)
+
+# Latency bucket upper bounds in seconds: 0.1 ms to ~20 s, 50% apart.
+BUCKETS = tuple(0.0001 * 1.5 ** i for i in range(31))
+
+
+# ----------------- Histogram -----------------
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Linear interpolation inside the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                if i == len(BUCKETS):
+                    return self.max
+                lower = BUCKETS[i - 1] if i else 0.0
+                return min(lower + (BUCKETS[i] - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+
+# ----------------- Metrics -----------------
+class Metrics:
+    """Latency histograms, call and error counts keyed by (kind, name), plus
+    free-form counters, gauges read at render time and an event-loop lag probe.
+
+    Recording is a couple of dict lookups and a bisect, cheap enough to leave
+    on for every command in production.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.errors = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started = time.time()
+        self._tasks = []
+        self._stop = asyncio.Event()
+        self._runner = None
+
+    def observe(self, kind, name, seconds, error=None):
+        key = (kind, name)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(seconds)
+        if error is not None:
+            self.errors[key] = self.errors.get(key, 0) + 1
+            self.incr(f"error_{type(error).__name__}")
+
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name, fn):
+        """Report fn() (e.g. a queue depth) as gauge `name` whenever metrics are rendered."""
+        self.gauges[name] = fn
+
+    @contextmanager
+    def time(self, kind, name):
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.observe(kind, name, time.perf_counter() - started, error)
+
+    def wrap(self, kind, name, fn):
+        """Time every call of coroutine function `fn`."""
+        @functools.wraps(fn)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                self.observe(kind, name, time.perf_counter() - started, e)
+                raise
+            self.observe(kind, name, time.perf_counter() - started)
+            return result
+        return timed
+
+    def wrap_sync(self, kind, name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            with self.time(kind, name):
+                return fn(*args, **kwargs)
+        return timed
+
+    def instrument(self, obj, kind, names):
+        """Replace the named methods of `obj` with timed versions."""
+        for name in names:
+            method = getattr(obj, name)
+            wrapper = self.wrap if asyncio.iscoroutinefunction(method) else self.wrap_sync
+            setattr(obj, name, wrapper(kind, name, method))
+
+    # Reporting
+    def summary(self, kind=None):
+        rows = []
+        for (k, name), hist in self.histograms.items():
+            if kind is None or k == kind:
+                rows.append({
+                    "kind": k, "name": name, "calls": hist.count, "errors": self.errors.get((k, name), 0),
+                    "p50": hist.quantile(0.5), "p95": hist.quantile(0.95), "p99": hist.quantile(0.99), "max": hist.max,
+                })
+        rows.sort(key=lambda r: r["calls"], reverse=True)
+        return rows
+
+    def render_prometheus(self, prefix="bot"):
+        out = [f"# TYPE {prefix}_latency_seconds histogram"]
+        for (kind, name), hist in sorted(self.histograms.items()):
+            labels = f'kind="{kind}",name="{name}"'
+            cumulative = 0
+            for bound, n in zip(BUCKETS, hist.counts):
+                cumulative += n
+                out.append(f'{prefix}_latency_seconds_bucket{{{labels},le="{bound:.6g}"}} {cumulative}')
+            out.append(f'{prefix}_latency_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+            out.append(f"{prefix}_latency_seconds_sum{{{labels}}} {hist.sum:.6f}")
+            out.append(f"{prefix}_latency_seconds_count{{{labels}}} {hist.count}")
+        out.append(f"# TYPE {prefix}_errors_total counter")
+        for (kind, name), n in sorted(self.errors.items()):
+            out.append(f'{prefix}_errors_total{{kind="{kind}",name="{name}"}} {n}')
+        out.append(f"# TYPE {prefix}_events_total counter")
+        for name, n in sorted(self.counters.items()):
+            out.append(f'{prefix}_events_total{{name="{name}"}} {n}')
+        out.append(f"# TYPE {prefix}_gauge gauge")
+        for name, fn in sorted(self.gauges.items()):
+            out.append(f'{prefix}_gauge{{name="{name}"}} {fn()}')
+        out.append(f"# TYPE {prefix}_uptime_seconds gauge")
+        out.append(f"{prefix}_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(out) + "\n"
+
+    # Background work
+    async def _sleep(self, seconds):
+        # True once close() was called
+        try:
+            await asyncio.wait_for(self._stop.wait(), seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _probe_loop(self, interval):
+        # A sleep that wakes late means something blocked the event loop
+        while True:
+            expected = time.perf_counter() + interval
+            if await self._sleep(interval):
+                return
+            self.observe("loop", "lag", max(0.0, time.perf_counter() - expected))
+
+    async def _dump_file(self, path, interval):
+        loop = asyncio.get_running_loop()
+        while not await self._sleep(interval):
+            try:
+                await loop.run_in_executor(None, write_atomic, path, self.render_prometheus())
+            except Exception:
+                log.exception("Writing metrics to %s failed", path)
+
+    async def _serve(self, host, port):
+        from aiohttp import web  # installed with discord.py
+
+        async def handler(request):
+            return web.Response(text=self.render_prometheus(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        log.info("Serving metrics on http://%s:%s/metrics", host, port)
+
+    async def start(self, lag_interval=0.5, dump_path=None, dump_interval=15, http_port=None, http_host="127.0.0.1"):
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.create_task(self._probe_loop(lag_interval)))
+        if dump_path:
+            self._tasks.append(loop.create_task(self._dump_file(dump_path, dump_interval)))
+        if http_port:
+            await self._serve(http_host, http_port)
+
+    async def close(self):
+        self._stop.set()
+        for task in self._tasks:
+            await task
+        self._tasks.clear()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
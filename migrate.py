@@ -0,0 +1,30 @@
+"""Import an existing data.json into the SQLite backend.
+
+    python migrate.py data.json data.db
+"""
+import argparse, asyncio, json
+from storage import SqliteStorage
+
+
+async def migrate(json_path, db_path):
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    storage = SqliteStorage(db_path)
+    await storage.open()
+    try:
+        return await storage.import_json(data)
+    finally:
+        await storage.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("json_path", nargs="?", default="data.json")
+    ap.add_argument("db_path", nargs="?", default="data.db")
+    args = ap.parse_args()
+    users = asyncio.run(migrate(args.json_path, args.db_path))
+    print(f"✅ Imported {users} users from {args.json_path} into {args.db_path}")
+
+
+if __name__ == "__main__":
+    main()
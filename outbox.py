@@ -0,0 +1,154 @@
+import asyncio, logging, time
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+
+# ----------------- Items -----------------
+class Message:
+    __slots__ = ("channel", "kwargs", "created")
+
+    def __init__(self, channel, kwargs):
+        self.channel = channel
+        self.kwargs = kwargs
+        self.created = time.perf_counter()
+
+    def render(self, max_mentions):
+        return self.kwargs
+
+
+class Batch:
+    """Announcements of one `group` (e.g. "welcome") merged while they wait.
+    `render(mentions, more)` builds the text from up to max_mentions mentions."""
+
+    __slots__ = ("channel", "group", "render_text", "mentions", "created", "sealed")
+
+    def __init__(self, channel, group, render, mention):
+        self.channel = channel
+        self.group = group
+        self.render_text = render
+        self.mentions = [mention]
+        self.created = time.perf_counter()
+        self.sealed = False
+
+    def render(self, max_mentions):
+        shown = self.mentions[:max_mentions]
+        return {"content": self.render_text(shown, len(self.mentions) - len(shown))}
+
+
+# ----------------- Outbox -----------------
+class Outbox:
+    """Outbound channel messages, sent by one worker per channel.
+
+    Discord rate-limits message sends per channel (the channel ID is the
+    route's major parameter), so each channel gets its own bounded queue and
+    a worker that sends one message at a time and keeps to `rate` messages
+    per `per` seconds instead of running into 429s. `send()` waits while the
+    channel's queue is full, which slows the caller down rather than letting
+    the backlog grow without bound.
+
+    `announce()` queues a mention that can be merged: joins arriving while a
+    welcome is still queued (or inside its `window`) are added to it, so a
+    raid becomes "Welcome @a, @b, @c ... (+40 more)" rather than one message
+    per member. Workers exit after `idle` seconds without work.
+    """
+
+    def __init__(self, metrics=None, max_queue=100, window=1.0, rate=5, per=5.0, max_mentions=25, idle=60):
+        self.metrics = metrics
+        self.max_queue = max_queue
+        self.window = window
+        self.rate = rate
+        self.per = per
+        self.max_mentions = max_mentions
+        self.idle = idle
+        self._queues = {}   # channel_id -> asyncio.Queue
+        self._workers = {}  # channel_id -> Task
+        self._tails = {}    # channel_id -> Batch that can still take mentions
+        self._closing = False
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues.values())
+
+    def _queue(self, channel):
+        q = self._queues.get(channel.id)
+        if q is None:
+            q = self._queues[channel.id] = asyncio.Queue(self.max_queue)
+            self._workers[channel.id] = asyncio.get_running_loop().create_task(self._run(channel.id, q))
+        return q
+
+    async def send(self, channel, content=None, **kwargs):
+        """Queue channel.send(content, **kwargs). Returns False once closing."""
+        if self._closing:
+            return False
+        if content is not None:
+            kwargs["content"] = content
+        self._tails.pop(channel.id, None)
+        await self._queue(channel).put(Message(channel, kwargs))
+        return True
+
+    async def announce(self, channel, group, mention, render):
+        """Queue a mention for `group`, merged into a waiting batch if there is one."""
+        if self._closing:
+            return False
+        tail = self._tails.get(channel.id)
+        if tail is not None and tail.group == group and not tail.sealed:
+            tail.mentions.append(mention)
+            self.coalesced += 1
+            return True
+        batch = Batch(channel, group, render, mention)
+        self._tails[channel.id] = batch
+        await self._queue(channel).put(batch)
+        return True
+
+    async def _run(self, channel_id, q):
+        sent_at = deque(maxlen=self.rate)
+        while True:
+            try:
+                item = await asyncio.wait_for(q.get(), self.idle)
+            except asyncio.TimeoutError:
+                if q.empty():
+                    # Nothing can be queued between this check and the removal
+                    del self._queues[channel_id], self._workers[channel_id]
+                    return
+                continue
+            if item is None:
+                return
+            if isinstance(item, Batch):
+                await asyncio.sleep(item.created + self.window - time.perf_counter())
+            if len(sent_at) == self.rate:
+                await asyncio.sleep(sent_at[0] + self.per - time.perf_counter())
+            if isinstance(item, Batch):
+                item.sealed = True
+                if self._tails.get(channel_id) is item:
+                    del self._tails[channel_id]
+            error = None
+            try:
+                await item.channel.send(**item.render(self.max_mentions))
+                self.sent += 1
+            except Exception as e:
+                error = e
+                self.failed += 1
+                log.warning("Sending to channel %s failed: %s", channel_id, e)
+            sent_at.append(time.perf_counter())
+            if self.metrics is not None:
+                group = item.group if isinstance(item, Batch) else "message"
+                self.metrics.observe("outbox", group, time.perf_counter() - item.created, error)
+
+    async def close(self, timeout=5.0):
+        """Stop taking messages and give queued ones `timeout` seconds to go out."""
+        self._closing = True
+        for q in self._queues.values():
+            try:
+                q.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+        workers = list(self._workers.values())
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                log.warning("Dropped messages queued for %d channels on shutdown", len(pending))
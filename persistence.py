@@ -0,0 +1,109 @@
+import asyncio, json, logging, os, tempfile
+
+log = logging.getLogger(__name__)
+
+
+# ----------------- Atomic File Write -----------------
+def write_atomic(path, payload):
+    # Write to a temp file in the same directory, fsync, then rename over the
+    # target so a crash mid-write never leaves a truncated file behind.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+# ----------------- Write-Behind Store -----------------
+class WriteBehindStore:
+    """Coalesces mutations of `data` and flushes them to `path` in the background.
+
+    Callers mutate the dict in place and call `mark_dirty()`. A flush happens
+    every `interval` seconds, or sooner once `max_dirty` changes are pending.
+    `data` may also be a function returning the dict to save, and
+    `before_write()` is awaited between taking a snapshot and writing it.
+    """
+
+    def __init__(self, path, data, interval=2.0, max_dirty=1000, indent=None, before_write=None):
+        self.path = path
+        self.before_write = before_write
+        self.data = data
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.indent = indent
+        self.dirty = 0
+        self.flushes = 0
+        self._wake = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task = None
+        self._closing = False
+
+    def mark_dirty(self, n=1):
+        self.dirty += n
+        if self.dirty >= self.max_dirty:
+            self._wake.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush_async()
+            except Exception:
+                log.exception("Background flush of %s failed", self.path)
+
+    def _snapshot(self):
+        # Serialize on the caller's thread so the dict is never read while the
+        # event loop is mutating it; only the disk I/O is pushed off the loop.
+        pending, self.dirty = self.dirty, 0
+        data = self.data() if callable(self.data) else self.data
+        return pending, json.dumps(data, indent=self.indent)
+
+    async def flush_async(self):
+        if not self.dirty:
+            return
+        async with self._write_lock:
+            pending, payload = self._snapshot()
+            try:
+                if self.before_write is not None:
+                    await self.before_write()
+                await asyncio.get_running_loop().run_in_executor(None, write_atomic, self.path, payload)
+            except BaseException:
+                self.dirty += pending
+                raise
+            self.flushes += 1
+
+    def flush(self):
+        if not self.dirty:
+            return
+        pending, payload = self._snapshot()
+        try:
+            write_atomic(self.path, payload)
+        except BaseException:
+            self.dirty += pending
+            raise
+        self.flushes += 1
+
+    async def close(self):
+        # Wake the flusher and let it exit on its own; cancelling it mid-wait
+        # can race with a pending wake-up.
+        if self._task is not None:
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush_async()
@@ -0,0 +1,160 @@
+"""In-memory rate limits for commands and events.
+
+A RateLimiter is a set of token buckets stored as one float per key (the
+"theoretical arrival time" of GCRA): a key may make `burst` calls at once
+and then one every `per / rate` seconds. A key whose bucket has refilled
+carries no state, so those entries are swept once the table grows, and
+memory follows the number of recently active keys.
+
+`Limits` names limiters with a scope (per user, guild, member or global)
+and provides the decorator used on slash commands, which answers a limited
+interaction itself before the command body (and so the ledger and storage)
+is reached.
+"""
+import contextvars, functools, time
+
+# How a limiter keys an interaction; DMs count against the user for "guild"
+SCOPES = {
+    "user": lambda i: i.user.id,
+    "guild": lambda i: i.guild.id if i.guild else ("dm", i.user.id),
+    "member": lambda i: (i.guild.id if i.guild else 0, i.user.id),
+    "global": lambda i: 0,
+}
+
+
+def parse_rate(text):
+    """"5/10" -> (5, 10.0): five calls per ten seconds."""
+    calls, _, seconds = text.partition("/")
+    return int(calls), float(seconds or 1)
+
+
+# ----------------- Rate Limiter -----------------
+class RateLimiter:
+    def __init__(self, rate, per, burst=None, max_entries=50000):
+        self.interval = per / rate
+        self.tolerance = self.interval * ((burst or rate) - 1)
+        self.max_entries = max_entries
+        self._tat = {}
+        self._sweep_at = max_entries
+
+    def __len__(self):
+        return len(self._tat)
+
+    def peek(self, key, now=None):
+        """(retry_after, tat): seconds to wait (0.0 if allowed) and the state a
+        call now would leave behind. Nothing is recorded."""
+        now = now if now is not None else time.monotonic()
+        tat = max(self._tat.get(key, now), now)
+        retry = tat - self.tolerance - now
+        return (retry, tat) if retry > 0 else (0.0, tat + self.interval)
+
+    def commit(self, key, tat, now=None):
+        self._tat[key] = tat
+        if len(self._tat) > self._sweep_at:
+            now = now if now is not None else time.monotonic()
+            self._tat = {k: t for k, t in self._tat.items() if t > now}
+            self._sweep_at = max(self.max_entries, 2 * len(self._tat))
+
+    def hit(self, key, now=None):
+        """Record a call if allowed. Returns 0.0, or the seconds until `key` may call again."""
+        retry, tat = self.peek(key, now)
+        if not retry:
+            self.commit(key, tat, now)
+        return retry
+
+    def block(self, key, seconds, now=None):
+        """Make `key` wait `seconds` from now, e.g. to mirror a cooldown kept elsewhere."""
+        now = now if now is not None else time.monotonic()
+        self.commit(key, now + seconds + self.tolerance, now)
+
+    def refund(self, key, now=None):
+        """Give back one call recorded by hit/commit, e.g. for a call that did nothing."""
+        tat = self._tat.get(key)
+        if tat is not None:
+            now = now if now is not None else time.monotonic()
+            tat -= self.interval
+            if tat > now:
+                self._tat[key] = tat
+            else:
+                del self._tat[key]
+
+    def reset(self, key):
+        self._tat.pop(key, None)
+
+
+# ----------------- Limits -----------------
+class Limits:
+    """Named, scoped rate limiters for slash commands.
+
+    `limits("casino", "casino_guild")` decorates a command callback so a call
+    goes through only if every named limiter allows it (and only then uses
+    them all up). Otherwise `on_limited(interaction, name, retry_after)` is
+    awaited instead of the command. The calls are taken before the body runs,
+    so concurrent spam can't slip past, and given back if the body raises or
+    calls `cancel()` (e.g. after rejecting its arguments).
+    """
+
+    def __init__(self, on_limited):
+        self.on_limited = on_limited
+        self.limiters = {}
+        self.scopes = {}
+        self.limited = {}
+        self._taken = contextvars.ContextVar("taken", default=None)  # (name, key) used by the running command
+
+    def add(self, name, rate, per, scope="user", burst=None, max_entries=50000):
+        self.limiters[name] = RateLimiter(rate, per, burst, max_entries)
+        self.scopes[name] = SCOPES[scope]
+        self.limited[name] = 0
+        return self.limiters[name]
+
+    def key(self, name, interaction):
+        return self.scopes[name](interaction)
+
+    def block(self, name, interaction, seconds):
+        self.limiters[name].block(self.key(name, interaction), seconds)
+
+    def check(self, interaction, names):
+        """None if the call may go ahead (and it is recorded), else (name, retry_after)."""
+        blocked, _ = self._take(interaction, names)
+        return blocked
+
+    def _take(self, interaction, names):
+        # (None, [(name, key)] recorded) or ((name, retry_after), [])
+        now = time.monotonic()
+        pending = []
+        for name in names:
+            key = self.key(name, interaction)
+            retry, tat = self.limiters[name].peek(key, now)
+            if retry:
+                self.limited[name] += 1
+                return (name, retry), []
+            pending.append((name, key, tat))
+        for name, key, tat in pending:
+            self.limiters[name].commit(key, tat, now)
+        return None, [(name, key) for name, key, _ in pending]
+
+    def cancel(self):
+        """Give back the calls the running command used; it turned out to do nothing."""
+        taken = self._taken.get()
+        if taken:
+            for name, key in taken:
+                self.limiters[name].refund(key)
+            taken.clear()
+
+    def __call__(self, *names):
+        def decorator(fn):
+            @functools.wraps(fn)
+            async def limited(interaction, *args, **kwargs):
+                blocked, taken = self._take(interaction, names)
+                if blocked is not None:
+                    return await self.on_limited(interaction, *blocked)
+                token = self._taken.set(taken)
+                try:
+                    return await fn(interaction, *args, **kwargs)
+                except BaseException:
+                    self.cancel()
+                    raise
+                finally:
+                    self._taken.reset(token)
+            return limited
+        return decorator
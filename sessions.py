@@ -0,0 +1,180 @@
+import asyncio, logging, time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+# ----------------- Session -----------------
+class Session:
+    """One open game. `stake` has already been debited; `state` is the game's
+    compact encoding (e.g. BlackjackGame.encode()). `view` is runtime only."""
+
+    __slots__ = ("user_id", "game", "stake", "state", "channel_id", "message_id", "updated_at", "view")
+
+    def __init__(self, user_id, game, stake, state=b"", channel_id=None, message_id=None, updated_at=None):
+        self.user_id = int(user_id)
+        self.game = game
+        self.stake = int(stake)
+        self.state = bytes(state)
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.updated_at = updated_at if updated_at is not None else time.time()
+        self.view = None
+
+    def to_row(self):
+        return {
+            "game": self.game,
+            "stake": self.stake,
+            "state": self.state,
+            "channel_id": self.channel_id,
+            "message_id": self.message_id,
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_row(cls, user_id, row):
+        return cls(user_id, row["game"], row["stake"], row["state"], row.get("channel_id"), row.get("message_id"), row["updated_at"])
+
+
+def log_session(journal, uid, row):
+    # Journal a stored session row (None once deleted); replayed by journal.recover
+    if journal is not None:
+        journal.append("session", uid=str(uid), row=None if row is None else dict(row, state=row["state"].hex()))
+
+
+# ----------------- Registry -----------------
+class SessionRegistry:
+    """Open games keyed by user, at most one per user.
+
+    Sessions are kept in least-recently-used order and mirrored to storage.
+    A session idle for `ttl` seconds, or pushed out once more than
+    `max_sessions` are open, is removed and its stake refunded through the
+    ledger. `on_expire(session)` is then called so the UI can be cleaned up.
+
+    Like the ledger, every stored change is journaled right after the storage
+    call, so a session row never outlives the debit that paid for it (and
+    recovery restores rows the write-back hadn't saved yet).
+
+    `begin`, `claim` and `get` never await, so checking for and taking a
+    session cannot interleave with another handler on the event loop.
+    """
+
+    def __init__(self, storage, ledger, journal=None, ttl=300, max_sessions=10000, sweep_interval=15, on_expire=None):
+        self.storage = storage
+        self.ledger = ledger
+        self.journal = journal
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sweep_interval = sweep_interval
+        self.on_expire = on_expire
+        self._sessions = OrderedDict()
+        self._task = None
+        self._stop = asyncio.Event()
+        self.refunded = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, uid):
+        return self._sessions.get(int(uid))
+
+    def begin(self, uid, game, stake, state=b""):
+        """Reserve a session for `uid`, or return None if one is already open."""
+        uid = int(uid)
+        if uid in self._sessions:
+            return None
+        session = Session(uid, game, stake, state)
+        self._sessions[uid] = session
+        return session
+
+    def discard(self, uid):
+        # Drop a reservation whose stake was never debited
+        self._sessions.pop(int(uid), None)
+
+    def claim(self, uid):
+        """Take the session out of the registry to settle it; None if it's gone."""
+        return self._sessions.pop(int(uid), None)
+
+    async def save(self, session):
+        session.updated_at = time.time()
+        if self._sessions.get(session.user_id) is session:
+            self._sessions.move_to_end(session.user_id)
+        row = session.to_row()
+        await self.storage.put_session(session.user_id, row)
+        log_session(self.journal, session.user_id, row)
+        await self._evict_overflow()
+
+    async def _delete(self, session):
+        await self.storage.delete_session(session.user_id)
+        log_session(self.journal, session.user_id, None)
+
+    async def finish(self, session):
+        await self._delete(session)
+
+    async def refund(self, session, reason="refund"):
+        await self.ledger.credit(session.user_id, session.stake, reason)
+        await self._delete(session)
+        self.refunded += 1
+        if self.on_expire is not None:
+            try:
+                await self.on_expire(session)
+            except Exception:
+                log.exception("on_expire failed for session of %s", session.user_id)
+
+    async def _evict_overflow(self):
+        while len(self._sessions) > self.max_sessions:
+            _, session = self._sessions.popitem(last=False)
+            await self.refund(session, "evicted")
+
+    async def sweep(self, now=None):
+        now = now if now is not None else time.time()
+        expired = []
+        for uid, session in self._sessions.items():
+            if now - session.updated_at < self.ttl:
+                break  # LRU order: everything after this is newer
+            expired.append(uid)
+        for uid in expired:
+            session = self._sessions.pop(uid, None)
+            if session is not None:
+                await self.refund(session, "expired")
+        return len(expired)
+
+    async def load(self, now=None):
+        """Restore persisted sessions at startup. Fresh ones are returned for the
+        caller to re-attach; stale ones are refunded."""
+        now = now if now is not None else time.time()
+        restored = []
+        for uid, row in sorted(await self.storage.load_sessions(), key=lambda item: item[1]["updated_at"]):
+            session = Session.from_row(uid, row)
+            if now - session.updated_at >= self.ttl:
+                await self.refund(session, "expired")
+            else:
+                self._sessions[session.user_id] = session
+                restored.append(session)
+        await self._evict_overflow()
+        return restored
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.sweep_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.sweep()
+            except Exception:
+                log.exception("Session sweep failed")
+
+    async def close(self):
+        # Open sessions stay in storage and are restored on the next start.
+        # The sweeper is stopped rather than cancelled so a refund in flight
+        # is never cut off between the credit and the delete.
+        if self._task is not None:
+            self._stop.set()
+            await self._task
+            self._task = None
@@ -0,0 +1,94 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# Config keys holding a channel or role ID, and what they resolve to
+SETTINGS = {
+    "welcome_channel": "channel",
+    "goodbye_channel": "channel",
+    "update_channel": "channel",
+    "ticket_log_channel": "channel",
+    "ticket_category": "channel",
+    "ticket_staff_role": "role",
+}
+
+
+def config_key(name, guild_id=None):
+    """Config key for setting `name`: "<name>:<guild_id>" for one guild, or
+    the plain name for the global value used by guilds without their own."""
+    return f"{name}:{guild_id}" if guild_id else name
+
+
+def parse_key(key):
+    # (name, guild_id or None), or None for keys that aren't settings
+    name, _, guild_id = key.partition(":")
+    if name not in SETTINGS:
+        return None
+    return name, int(guild_id) if guild_id else None
+
+
+# ----------------- Guild Settings -----------------
+class GuildSettings:
+    """Channels and role configured for one guild, resolved to discord.py
+    objects (None when unset or no longer in the guild)."""
+
+    __slots__ = ("guild_id",) + tuple(SETTINGS)
+
+    def __init__(self, guild_id, **resolved):
+        self.guild_id = guild_id
+        for name in SETTINGS:
+            setattr(self, name, resolved.get(name))
+
+
+class SettingsCache:
+    """Per-guild GuildSettings, resolved on first use and then served from a
+    dict until invalidated.
+
+    Each setting is looked up under the guild's own key first and the global
+    key second, and resolved with guild.get_channel / guild.get_role, so a
+    global ID only applies in the guild that owns it. Entries are dropped by
+    `invalidate(guild_id)` (channel/role deleted or changed) and
+    `config_changed(key)` (any write to a setting).
+    """
+
+    def __init__(self, get_config):
+        self.get_config = get_config
+        self._guilds = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._guilds)
+
+    def get(self, guild):
+        settings = self._guilds.get(guild.id)
+        if settings is not None:
+            self.hits += 1
+            return settings
+        self.misses += 1
+        settings = self._guilds[guild.id] = self._resolve(guild)
+        return settings
+
+    def _resolve(self, guild):
+        resolved = {}
+        for name, kind in SETTINGS.items():
+            value = self.get_config(config_key(name, guild.id)) or self.get_config(name)
+            if not value:
+                continue
+            obj = guild.get_role(int(value)) if kind == "role" else guild.get_channel(int(value))
+            if obj is None and self.get_config(config_key(name, guild.id)):
+                log.warning("%s %s is not in guild %s any more", name, value, guild.id)
+            resolved[name] = obj
+        return GuildSettings(guild.id, **resolved)
+
+    def invalidate(self, guild_id=None):
+        if guild_id is None:
+            self._guilds.clear()
+        else:
+            self._guilds.pop(guild_id, None)
+
+    def config_changed(self, key):
+        parsed = parse_key(key)
+        if parsed is not None:
+            # A global value can apply to any guild
+            self.invalidate(parsed[1])
@@ -0,0 +1,73 @@
+"""Monte Carlo simulator for the casino games and the /daily faucet.
+
+Reports, per game, the return to player (RTP), the variance of the payout
+multiplier and the expected change in total money supply, i.e. how much money
+the casino creates (positive) or destroys (negative) per round and overall.
+
+    python simulate.py --rounds 10000000 --bet 1000 --users 500
+"""
+import argparse, time
+import games
+
+DAILY_CLAIMS_PER_USER = 1  # /daily can be claimed once every 24h
+
+
+def simulate(name, batch, rounds, chunk, gen):
+    total = total_sq = xp = 0.0
+    done = 0
+    started = time.perf_counter()
+    while done < rounds:
+        n = min(chunk, rounds - done)
+        mult, gained = batch(n, gen=gen)
+        total += float(mult.sum())
+        total_sq += float((mult.astype(games.np.float64) ** 2).sum())
+        xp += float(gained.sum())
+        done += n
+    elapsed = time.perf_counter() - started
+    rtp = total / rounds
+    return {
+        "game": name,
+        "rtp": rtp,
+        "variance": total_sq / rounds - rtp ** 2,
+        "xp": xp / rounds,
+        "rate": rounds / elapsed if elapsed else float("inf"),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rounds", type=int, default=2_000_000, help="rounds per game")
+    ap.add_argument("--bet", type=int, default=1000, help="stake per round")
+    ap.add_argument("--users", type=int, default=1000, help="active users claiming /daily each day")
+    ap.add_argument("--bets-per-user", type=int, default=20, help="rounds per user per day, per game")
+    ap.add_argument("--chunk", type=int, default=1_000_000)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+
+    games._require_numpy()
+    gen = games.np.random.default_rng(args.seed)
+    batches = {
+        "roulette (red)": games.roulette_batch,
+        "slots": games.slots_batch,
+        "coinflip": games.coinflip_batch,
+        "dice": games.dice_batch,
+        "highlow": games.highlow_batch,
+        "blackjack (stand 17)": games.blackjack_batch,
+    }
+
+    print(f"{'game':<22}{'RTP':>9}{'edge':>9}{'variance':>11}{'xp/round':>10}{'Δsupply/round':>16}{'Δsupply/day':>16}{'rounds/s':>14}")
+    day_rounds = args.users * args.bets_per_user
+    for name, batch in batches.items():
+        r = simulate(name, batch, args.rounds, args.chunk, gen)
+        per_round = args.bet * (r["rtp"] - 1)
+        print(f"{name:<22}{r['rtp']:>9.4f}{1 - r['rtp']:>9.2%}{r['variance']:>11.3f}{r['xp']:>10.2f}"
+              f"{per_round:>16,.1f}{per_round * day_rounds:>16,.0f}{r['rate']:>14,.0f}")
+
+    low, high = games.DAILY_REWARD
+    faucet = (low + high) / 2 * args.users * DAILY_CLAIMS_PER_USER
+    print(f"\n/daily faucet: {(low + high) / 2:,.0f} per claim on average, {faucet:,.0f} per day for {args.users} users")
+    print(f"Δsupply/day assumes {args.users} users x {args.bets_per_user} rounds of ${args.bet} per game.")
+
+
+if __name__ == "__main__":
+    main()
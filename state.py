@@ -0,0 +1,537 @@
+"""Shared state service for running the bot as several shard processes.
+
+One process owns the storage backend, the journal, the ledger and both
+leaderboards; shard workers reach it over a Unix socket ("unix:/path") or a
+local TCP port ("127.0.0.1:7010") and use RemoteStorage / RemoteLedger in
+place of the local objects. The protocol is one JSON object per line:
+
+    -> {"id": 1, "op": "transfer", "args": [...], "kwargs": {...}}
+    <- {"id": 1, "result": ...}  or  {"id": 1, "error": "ValueError", "message": "..."}
+    <- {"board": "wealth", "uid": 123, "score": 4200}   (push, no id)
+    <- {"config": "welcome_channel", "value": 123}       (push, no id)
+
+Requests are handled concurrently; the ledger's per-user locks serialize
+conflicting wallet operations exactly as they do in a single process.
+Leaderboard and config changes are pushed to every worker, so each keeps a
+local copy that `/leaderboard` and `get_config` can read without a round trip.
+
+    python state.py --address unix:/tmp/jhub-state.sock
+"""
+import argparse, asyncio, itertools, json, logging, os, signal
+from storage import Storage, create_storage
+from usercache import CachedStorage
+from xp import total_xp
+from leaderboard import RankIndex
+from ledger import Ledger
+from journal import Checkpointer, Journal, checkpoint, recover, write_ahead
+from sessions import log_session
+
+log = logging.getLogger(__name__)
+
+LINE_LIMIT = 1 << 24  # largest single message, bytes
+PAGE = 5000           # users/board entries per iteration page
+
+
+def parse_address(address):
+    """("unix", path) or ("tcp", (host, port))."""
+    if address.startswith("unix:"):
+        return "unix", address[5:]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+def _default(obj):
+    if isinstance(obj, (bytes, bytearray)):
+        return {"$b": obj.hex()}
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _hook(obj):
+    return bytes.fromhex(obj["$b"]) if len(obj) == 1 and "$b" in obj else obj
+
+
+def encode(msg):
+    return json.dumps(msg, separators=(",", ":"), default=_default).encode() + b"\n"
+
+
+def decode(line):
+    return json.loads(line, object_hook=_hook)
+
+
+class StateError(RuntimeError):
+    """An error raised inside the state service that has no local equivalent."""
+
+
+ERRORS = {"ValueError": ValueError, "KeyError": KeyError, "TypeError": TypeError}
+
+
+# ----------------- Published Index -----------------
+class PublishedIndex(RankIndex):
+    """RankIndex that reports every score change to `publish(name, uid, score)`."""
+
+    def __init__(self, name, publish):
+        super().__init__()
+        self.name = name
+        self.publish = publish
+
+    def update(self, uid, score):
+        super().update(uid, score)
+        self.publish(self.name, int(uid), score)
+
+
+# ----------------- Server -----------------
+class StateServer:
+    STORAGE_OPS = (
+        "get_user", "get_wallet", "top_users", "adjust_wallets", "add_wallet",
+        "get_ticket", "put_ticket", "delete_ticket", "add_ticket_count", "load_tickets", "load_ticket_counts",
+    )
+    LEDGER_OPS = ("transfer", "debit_if_sufficient", "credit", "settle_bet", "claim", "adjust_many")
+
+    def __init__(self, storage, journal=None, checkpointer=None):
+        self.storage = storage if journal is None else write_ahead(storage, journal)
+        self.journal = journal
+        self.checkpointer = checkpointer
+        self.boards = {"wealth": PublishedIndex("wealth", self._publish_score),
+                       "level": PublishedIndex("level", self._publish_score)}
+        self.ledger = Ledger(storage, journal, index=self.boards["wealth"])
+        self.ops = {name: getattr(storage, name) for name in self.STORAGE_OPS}
+        self.ops.update({name: getattr(self.ledger, name) for name in self.LEDGER_OPS})
+        self.ops.update(
+            ensure_user=self.ensure_user, update_user=self.update_user, set_wallet=self.set_wallet,
+            add_xp=self.add_xp, add_xp_many=self.add_xp_many, grant_xp=self.grant_xp, set_config=self.set_config,
+            set_many=self.set_many,
+            append=self.append, commit=self.commit,
+        )
+        # Ops that act for the calling worker get its connection first
+        self.conn_ops = {"put_session": self.put_session, "delete_session": self.delete_session,
+                         "claim_sessions": self.claim_sessions}
+        self.session_owners = {}  # uid -> connection of the worker holding that game
+        self.boards_ready = asyncio.Event()
+        self._boards_task = None
+        self._subscribers = set()
+        self._server = None
+        self._tasks = set()
+        self._cursor_ids = itertools.count(1)
+
+    async def open(self):
+        await self.storage.open()
+        if self.journal is not None:
+            self.journal.open()
+            await recover(self.storage, self.journal)
+        # Workers may connect while this runs; board pages wait for it
+        self._boards_task = asyncio.get_running_loop().create_task(self._build_boards())
+        if self.journal is not None:
+            self.journal.start()
+        if self.checkpointer is not None:
+            self.checkpointer.start()
+
+    async def _build_boards(self):
+        # As bot.build_leaderboards: users changed during the scan are already
+        # on a board from a partial score, so they are read again afterwards
+        wealth, levels = [], []
+        async for uid, u in self.storage.iter_users():
+            wealth.append((uid, u["wallet"] + u["bank"]))
+            levels.append((uid, total_xp(u["xp"], u["level"])))
+        changed = set(self.boards["wealth"].uids()) | set(self.boards["level"].uids())
+        self.boards["wealth"].load(wealth)
+        self.boards["level"].load(levels)
+        for uid in changed:
+            u = await self.storage.get_user(uid)
+            if u is not None:
+                self._track(uid, u)
+        self.boards_ready.set()
+        log.info("Leaderboards built (%d users)", len(wealth))
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._boards_task is not None and not self._boards_task.done():
+            self._boards_task.cancel()
+            await asyncio.gather(self._boards_task, return_exceptions=True)
+        if self.checkpointer is not None:
+            await self.checkpointer.close()
+        if self.journal is not None:
+            await self.journal.stop()
+            await checkpoint(self.storage, self.journal)
+        await self.storage.close()
+        if self.journal is not None:
+            self.journal.close()
+
+    # Pushes
+    def _broadcast(self, msg):
+        line = encode(msg)
+        for writer in self._subscribers:
+            if not writer.is_closing():
+                writer.write(line)
+
+    def _publish_score(self, name, uid, score):
+        self._broadcast({"board": name, "uid": uid, "score": score})
+
+    # User writes that also move the leaderboards, mirroring bot.py's helpers
+    def _track(self, uid, u):
+        self.boards["wealth"].update(uid, u["wallet"] + u["bank"])
+        self.boards["level"].update(uid, total_xp(u["xp"], u["level"]))
+
+    async def ensure_user(self, uid):
+        u = await self.storage.ensure_user(uid)
+        if uid not in self.boards["wealth"]:
+            self._track(uid, u)
+        return u
+
+    async def update_user(self, uid, **fields):
+        await self.storage.update_user(uid, **fields)
+        self._track(uid, await self.storage.get_user(uid))
+
+    async def set_wallet(self, uid, amount):
+        await self.storage.set_wallet(uid, amount)
+        self._track(uid, await self.storage.get_user(uid))
+
+    async def add_xp(self, uid, amount):
+        xp, level = await self.storage.add_xp(uid, amount)
+        self.boards["level"].update(uid, total_xp(xp, level))
+        return xp, level
+
+    async def add_xp_many(self, grants):
+        result = await self.storage.add_xp_many(grants)
+        for uid, (xp, level) in result.items():
+            self.boards["level"].update(uid, total_xp(xp, level))
+        return result
+
+    async def grant_xp(self, grants):
+        result = await self.ledger.grant_xp(grants)
+        for uid, (xp, level) in result.items():
+            self.boards["level"].update(uid, total_xp(xp, level))
+        return result
+
+    async def set_many(self, updates, reason="bulk"):
+        result = await self.ledger.set_many(updates, reason)
+        for uid, u in result.items():
+            self.boards["level"].update(uid, total_xp(u["xp"], u["level"]))
+        return result
+
+    async def append(self, op, fields):
+        # Journal entries from workers (e.g. ticket events)
+        if self.journal is not None:
+            self.journal.append(op, **fields)
+
+    async def commit(self, op, fields):
+        if self.journal is not None:
+            await self.journal.commit(op, **fields)
+
+    async def set_config(self, key, value):
+        await self.storage.set_config(key, value)
+        self._broadcast({"config": key, "value": value})
+
+    # Sessions belong to the worker that saved (or claimed) them, so a worker
+    # starting up never refunds or re-attaches a game another one is running
+    async def put_session(self, conn, uid, row):
+        self.session_owners[str(uid)] = conn
+        await self.storage.put_session(uid, row)
+        log_session(self.journal, uid, row)
+
+    async def delete_session(self, conn, uid):
+        if self.session_owners.get(str(uid), conn) is conn:
+            self.session_owners.pop(str(uid), None)
+            await self.storage.delete_session(uid)
+            log_session(self.journal, uid, None)
+
+    async def claim_sessions(self, conn):
+        """Stored sessions no connected worker owns, now owned by `conn`."""
+        rows = await self.storage.load_sessions()
+        claimed = []
+        for uid, row in rows:
+            owner = self.session_owners.get(str(uid))
+            if owner is None or owner.is_closing():
+                self.session_owners[str(uid)] = conn
+                claimed.append((uid, row))
+        return claimed
+
+    # Connections
+    async def _iterate(self, source):
+        # Board pages read current scores, so together with the pushes that
+        # follow them on the same connection the client ends up current.
+        if source == "users":
+            async for item in self.storage.iter_users(PAGE):
+                yield item
+        else:
+            await self.boards_ready.wait()
+            board = self.boards[source]
+            for uid in board.uids():
+                score = board.score(uid)
+                if score is not None:
+                    yield uid, score
+
+    async def _serve_one(self, msg, writer, cursors):
+        op, args, kwargs = msg.get("op"), msg.get("args", []), msg.get("kwargs", {})
+        try:
+            if op == "hello":
+                self._subscribers.add(writer)
+                result = self.storage.config
+            elif op == "iter_open":
+                cursor = next(self._cursor_ids)
+                cursors[cursor] = self._iterate(args[0]).__aiter__()
+                result = cursor
+            elif op == "iter_next":
+                it, result = cursors[args[0]], []
+                async for item in it:
+                    result.append(item)
+                    if len(result) >= PAGE:
+                        break
+                else:
+                    cursors.pop(args[0], None)
+            elif op in self.conn_ops:
+                result = await self.conn_ops[op](writer, *args, **kwargs)
+            elif op in self.ops:
+                result = await self.ops[op](*args, **kwargs)
+            else:
+                raise StateError(f"unknown op {op!r}")
+            reply = {"id": msg["id"], "result": result}
+        except Exception as e:
+            if not isinstance(e, (ValueError, KeyError, TypeError, StateError)):
+                log.exception("State op %s failed", op)
+            reply = {"id": msg["id"], "error": type(e).__name__, "message": str(e)}
+        if not writer.is_closing():
+            writer.write(encode(reply))
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        cursors = {}
+        try:
+            while line := await reader.readline():
+                task = asyncio.get_running_loop().create_task(self._serve_one(decode(line), writer, cursors))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            for uid in [uid for uid, owner in self.session_owners.items() if owner is writer]:
+                del self.session_owners[uid]  # orphaned: the next worker to start claims them
+            writer.close()
+
+    async def serve(self, address):
+        kind, where = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(where):
+                os.unlink(where)
+            self._server = await asyncio.start_unix_server(self._handle, where, limit=LINE_LIMIT)
+        else:
+            self._server = await asyncio.start_server(self._handle, *where, limit=LINE_LIMIT)
+        log.info("State service listening on %s", address)
+
+
+# ----------------- Client -----------------
+class StateClient:
+    """One connection to the state service; `call` sends a request and waits
+    for its reply, pushes go to `on_push(msg)`."""
+
+    def __init__(self, address, on_push=None):
+        self.address = address
+        self.on_push = on_push
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._reader_task = None
+        self._writer = None
+
+    async def connect(self):
+        kind, where = parse_address(self.address)
+        if kind == "unix":
+            reader, self._writer = await asyncio.open_unix_connection(where, limit=LINE_LIMIT)
+        else:
+            reader, self._writer = await asyncio.open_connection(*where, limit=LINE_LIMIT)
+        self._reader_task = asyncio.get_running_loop().create_task(self._read(reader))
+
+    async def _read(self, reader):
+        try:
+            while line := await reader.readline():
+                msg = decode(line)
+                fut = self._pending.pop(msg.get("id"), None)
+                if fut is not None:
+                    if not fut.done():
+                        fut.set_result(msg)
+                elif self.on_push is not None:
+                    self.on_push(msg)
+        finally:
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(ConnectionError("state service connection lost"))
+            self._pending.clear()
+
+    async def call(self, op, *args, **kwargs):
+        if self._writer is None or self._writer.is_closing():
+            raise ConnectionError("not connected to the state service")
+        rid = next(self._ids)
+        fut = self._pending[rid] = asyncio.get_running_loop().create_future()
+        self._writer.write(encode({"id": rid, "op": op, "args": args, "kwargs": kwargs}))
+        msg = await fut
+        if "error" in msg:
+            raise ERRORS.get(msg["error"], StateError)(msg["message"])
+        return msg["result"]
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            await self._reader_task
+            self._writer = None
+
+
+class RemoteStorage(Storage):
+    """Storage backed by the state service. `boards` ({"wealth": RankIndex,
+    "level": RankIndex}) are kept current by pushes and filled by
+    `load_boards()`; `on_config(key)` is called after a pushed config change
+    is applied."""
+
+    def __init__(self, address, boards=None, on_config=None):
+        super().__init__()
+        self.client = StateClient(address, on_push=self._on_push)
+        self.boards = boards or {}
+        self.on_config = on_config
+        self._loading = None  # board pushes that arrive while the boards load
+
+    def _on_push(self, msg):
+        if "board" in msg:
+            board = msg["board"]
+            if self._loading is not None and board in self._loading:
+                self._loading[board][msg["uid"]] = msg["score"]
+            if board in self.boards:
+                self.boards[board].update(msg["uid"], msg["score"])
+        elif "config" in msg:
+            self.config[msg["config"]] = msg["value"]
+            if self.on_config is not None:
+                self.on_config(msg["config"])
+
+    async def _iterate(self, source):
+        cursor = await self.client.call("iter_open", source)
+        while True:
+            page = await self.client.call("iter_next", cursor)
+            for item in page:
+                yield item
+            if len(page) < PAGE:
+                return
+
+    async def open(self):
+        await self.client.connect()
+        self.config = await self.client.call("hello")
+
+    async def load_boards(self):
+        """Copy the service's boards; the pages only come once it has built
+        them, so bot.py runs this in the background."""
+        # A push always reflects a change at least as new as any page read
+        # before it, so pushes received during the load win over page values.
+        self._loading = {name: {} for name in self.boards}
+        try:
+            for name, board in self.boards.items():
+                scores = {int(uid): score async for uid, score in self._iterate(name)}
+                scores.update(self._loading[name])
+                board.load(scores.items())
+        finally:
+            self._loading = None
+
+    async def close(self):
+        await self.client.close()
+
+    async def get_user(self, uid): return await self.client.call("get_user", uid)
+    async def ensure_user(self, uid): return await self.client.call("ensure_user", uid)
+    async def update_user(self, uid, **fields): return await self.client.call("update_user", uid, **fields)
+    async def add_wallet(self, uid, amount): return await self.client.call("add_wallet", uid, amount)
+    async def adjust_wallets(self, deltas, require=None): return await self.client.call("adjust_wallets", deltas, require)
+    async def add_xp(self, uid, amount): return tuple(await self.client.call("add_xp", uid, amount))
+
+    async def add_xp_many(self, grants):
+        return {uid: tuple(r) for uid, r in (await self.client.call("add_xp_many", grants)).items()}
+    async def top_users(self, limit): return await self.client.call("top_users", limit)
+    async def get_wallet(self, uid): return await self.client.call("get_wallet", uid)
+    async def set_wallet(self, uid, amount): return await self.client.call("set_wallet", uid, amount)
+
+    async def iter_users(self, batch=1000):
+        async for uid, u in self._iterate("users"):
+            yield uid, u
+
+    async def get_ticket(self, channel_id): return await self.client.call("get_ticket", channel_id)
+    async def put_ticket(self, channel_id, record): return await self.client.call("put_ticket", channel_id, record)
+    async def delete_ticket(self, channel_id): return await self.client.call("delete_ticket", channel_id)
+    async def add_ticket_count(self, staff_id, n=1): return await self.client.call("add_ticket_count", staff_id, n)
+    async def load_tickets(self): return await self.client.call("load_tickets")
+    async def load_ticket_counts(self): return await self.client.call("load_ticket_counts")
+
+    async def put_session(self, uid, row): return await self.client.call("put_session", uid, row)
+    async def delete_session(self, uid): return await self.client.call("delete_session", uid)
+    async def load_sessions(self): return await self.client.call("claim_sessions")  # only games no other worker holds
+
+    async def set_config(self, key, value):
+        await self.client.call("set_config", key, value)
+        self.config[key] = value
+
+
+class RemoteLedger:
+    """The Ledger API, executed by the state service so its per-user locks
+    cover every worker."""
+
+    def __init__(self, storage):
+        self.client = storage.client
+
+    async def transfer(self, src, dst, amount):
+        return await self.client.call("transfer", src, dst, amount)
+
+    async def debit_if_sufficient(self, uid, amount, reason="debit"):
+        return await self.client.call("debit_if_sufficient", uid, amount, reason)
+
+    async def credit(self, uid, amount, reason="credit"):
+        return await self.client.call("credit", uid, amount, reason)
+
+    async def settle_bet(self, uid, stake, payout, game="bet"):
+        return await self.client.call("settle_bet", uid, stake, payout, game)
+
+    async def claim(self, uid, amount, reason="daily", field="last_daily", cooldown=86400, now=None):
+        return tuple(await self.client.call("claim", uid, amount, reason, field, cooldown, now))
+
+    async def grant_xp(self, grants):
+        return {uid: tuple(r) for uid, r in (await self.client.call("grant_xp", grants)).items()}
+
+    async def adjust_many(self, deltas, reason="bulk"):
+        return await self.client.call("adjust_many", deltas, reason)
+
+    async def set_many(self, updates, reason="bulk"):
+        return await self.client.call("set_many", updates, reason)
+
+
+# ----------------- CLI -----------------
+async def run(address, storage, journal, checkpointer):
+    server = StateServer(storage, journal, checkpointer)
+    await server.open()
+    await server.serve(address)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    await server.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run the shared state service for a sharded cluster.")
+    ap.add_argument("--address", default=os.environ.get("STATE_ADDRESS", "unix:/tmp/jhub-state.sock"))
+    ap.add_argument("--backend", default=os.environ.get("STORAGE_BACKEND", "sqlite"), choices=("sqlite", "json"))
+    ap.add_argument("--data", default="data.json")
+    ap.add_argument("--db", default=os.environ.get("DB_FILE", "data.db"))
+    ap.add_argument("--journal", default=os.environ.get("JOURNAL_FILE", "ledger.jsonl"))
+    ap.add_argument("--snapshots", default=os.environ.get("SNAPSHOT_DIR", "snapshots"))
+    ap.add_argument("--checkpoint-interval", type=float, default=float(os.environ.get("CHECKPOINT_INTERVAL", 300)))
+    ap.add_argument("--snapshot-interval", type=float, default=float(os.environ.get("SNAPSHOT_INTERVAL", 3600)))
+    ap.add_argument("--cache-size", type=int, default=int(os.environ.get("USER_CACHE_SIZE", 50000)),
+                    help="users kept in memory with the sqlite backend")
+    ap.add_argument("--cache-ttl", type=float, default=float(os.environ.get("USER_CACHE_TTL", 3600)))
+    args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s state %(levelname)s %(message)s")
+    storage = create_storage(args.backend, json_path=args.data, db_path=args.db)
+    if args.backend == "sqlite":
+        # Buffered, so its writes can wait for the journal (see journal.write_ahead)
+        storage = CachedStorage(storage, max_users=max(1, args.cache_size), ttl=args.cache_ttl)
+    journal = Journal(args.journal)
+    checkpointer = Checkpointer(storage, journal, args.checkpoint_interval, args.snapshots, args.snapshot_interval)
+    asyncio.run(run(args.address, storage, journal, checkpointer))
+
+
+if __name__ == "__main__":
+    main()
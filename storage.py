@@ -0,0 +1,679 @@
+import asyncio, json, os, sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from persistence import WriteBehindStore, write_atomic
+from xp import level_up
+from userstore import FIELDS as USER_FIELDS, UserTable
+
+START_BALANCE = 500
+START_XP = 0
+START_LEVEL = 1
+
+def new_user():
+    return {"wallet": START_BALANCE, "bank": 0, "last_daily": 0, "xp": START_XP, "level": START_LEVEL}
+
+
+def empty_data():
+    return {
+        "balances": {},
+        "xp": {},
+        "levels": {},
+        "config": {},
+        "tickets": {},       # ticket_channel_id -> { opener_id, opened_at }
+        "ticket_counts": {}, # staff_id -> count
+        "sessions": {}       # user_id -> open game (see sessions.py)
+    }
+
+
+# ----------------- Storage Interface -----------------
+class Storage:
+    """Backend-neutral access to users, tickets and config.
+
+    User records are plain dicts with the keys in USER_FIELDS. Every call is a
+    coroutine except `get_config`, which reads the config cached at `open()`.
+    """
+
+    deferred = False     # writes are buffered and reach disk later, not in each call
+    before_write = None  # awaited before buffered writes reach disk; see journal.write_ahead
+
+    def __init__(self):
+        self.config = {}
+
+    async def open(self): raise NotImplementedError
+    async def close(self): raise NotImplementedError
+
+    async def flush(self):
+        """Make every write so far durable (a no-op where writes already are)."""
+
+    async def _before_write(self):
+        if self.before_write is not None:
+            await self.before_write()
+
+    # Users
+    async def get_user(self, uid): raise NotImplementedError      # None if unknown
+    async def ensure_user(self, uid): raise NotImplementedError
+    async def update_user(self, uid, **fields): raise NotImplementedError
+    async def add_wallet(self, uid, amount): raise NotImplementedError  # returns new wallet
+    # Apply {uid: delta} in one step. Returns {uid: new wallet}, or None (and
+    # changes nothing) if a wallet would go negative or is below require[uid].
+    async def adjust_wallets(self, deltas, require=None): raise NotImplementedError
+    async def add_xp(self, uid, amount): raise NotImplementedError      # returns (xp, level)
+    async def top_users(self, limit): raise NotImplementedError         # [(uid, record)] by wallet+bank
+
+    def iter_users(self, batch=1000): raise NotImplementedError         # async iterator of (uid, record)
+
+    async def add_xp_many(self, grants):
+        """Apply {uid: amount} XP grants; returns {uid: (xp, level)}."""
+        return {str(uid): await self.add_xp(uid, amount) for uid, amount in grants.items()}
+
+    async def update_users(self, updates):
+        """Apply {uid: {field: value}} (creating missing users); returns {uid: record}."""
+        result = {}
+        for uid, fields in updates.items():
+            await self.update_user(uid, **fields)
+            result[str(uid)] = await self.get_user(uid)
+        return result
+
+    async def get_wallet(self, uid):
+        u = await self.get_user(uid)
+        return START_BALANCE if u is None else u["wallet"]
+
+    async def set_wallet(self, uid, amount):
+        await self.update_user(uid, wallet=int(amount))
+
+    # Tickets
+    async def get_ticket(self, channel_id): raise NotImplementedError
+    async def put_ticket(self, channel_id, record): raise NotImplementedError
+    async def delete_ticket(self, channel_id): raise NotImplementedError  # returns removed record
+    async def add_ticket_count(self, staff_id, n=1): raise NotImplementedError
+    async def load_tickets(self): raise NotImplementedError        # [(channel_id, record)]
+    async def load_ticket_counts(self): raise NotImplementedError  # {staff_id: count}
+
+    # Game sessions (rows as produced by sessions.Session.to_row)
+    async def put_session(self, uid, row): raise NotImplementedError
+    async def delete_session(self, uid): raise NotImplementedError
+    async def load_sessions(self): raise NotImplementedError  # [(uid, row)]
+
+    async def write_sessions(self, rows):
+        """Apply {uid: row, or None to delete} (backends may do it in one transaction)."""
+        for uid, row in rows.items():
+            if row is None:
+                await self.delete_session(uid)
+            else:
+                await self.put_session(uid, row)
+
+    # Config
+    async def set_config(self, key, value): raise NotImplementedError
+
+    def get_config(self, key):
+        return self.config.get(key)
+
+
+def _check_fields(fields):
+    for name in fields:
+        if name not in USER_FIELDS:
+            raise KeyError(f"unknown user field {name!r}")
+
+
+# ----------------- JSON File Backend -----------------
+class JsonStorage(Storage):
+    """The original data.json layout, saved write-behind.
+
+    Users are held in a compact UserTable while running and written back as
+    the `balances` / `xp` / `levels` maps on every save.
+    """
+
+    deferred = True
+
+    def __init__(self, path, interval=2.0, max_dirty=1000):
+        super().__init__()
+        self.path = path
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self.data = None
+        self.users = None
+        self.store = None
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            write_atomic(self.path, json.dumps(empty_data(), indent=4))
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    async def open(self):
+        data = await asyncio.get_running_loop().run_in_executor(None, self._load)
+        balances = data.pop("balances", {})
+        xp = data.pop("xp", {})
+        levels = data.pop("levels", {})
+        self.users = UserTable(new_user())
+        for uid, bal in balances.items():
+            self.users.insert(
+                uid, wallet=bal.get("wallet", START_BALANCE), bank=bal.get("bank", 0), last_daily=bal.get("last_daily", 0),
+                xp=xp.pop(uid, START_XP), level=levels.pop(uid, START_LEVEL),
+            )
+        # XP or levels of users without a balance are kept as they were and
+        # picked up if the user ever gets a row.
+        self.orphan_xp, self.orphan_levels = xp, levels
+        self.data = data
+        self.config = data.setdefault("config", {})
+        self.tickets = data.setdefault("tickets", {})
+        self.ticket_counts = data.setdefault("ticket_counts", {})
+        self.sessions = data.setdefault("sessions", {})
+        self.store = WriteBehindStore(self.path, self._to_json, interval=self.interval, max_dirty=self.max_dirty,
+                                      before_write=self._before_write)
+        self.store.start()
+
+    def _to_json(self):
+        users = self.users
+        wallet, bank, last_daily, xp, level = (users.columns[name] for name in USER_FIELDS)
+        balances, xps, levels = {}, dict(self.orphan_xp), dict(self.orphan_levels)
+        for uid, row in users.rows.items():
+            key = str(uid)
+            balances[key] = {"wallet": wallet[row], "bank": bank[row], "last_daily": last_daily[row]}
+            xps[key] = xp[row]
+            levels[key] = level[row]
+        return dict(self.data, balances=balances, xp=xps, levels=levels)
+
+    async def close(self):
+        if self.store is not None:
+            await self.store.close()
+
+    async def flush(self):
+        if self.store is not None:
+            await self.store.flush_async()
+
+    def _ensure(self, uid):
+        row = self.users.row(uid)
+        if row is None:
+            key = str(uid)
+            row = self.users.insert(
+                uid, xp=self.orphan_xp.pop(key, START_XP), level=self.orphan_levels.pop(key, START_LEVEL)
+            )
+            self.store.mark_dirty()
+        return row
+
+    async def get_user(self, uid):
+        return self.users.get(uid)
+
+    async def ensure_user(self, uid):
+        return self.users.record(self._ensure(uid))
+
+    async def update_user(self, uid, **fields):
+        _check_fields(fields)
+        row = self._ensure(uid)
+        for name, value in fields.items():
+            self.users.columns[name][row] = int(value)
+        self.store.mark_dirty()
+
+    async def update_users(self, updates):
+        result = {}
+        for uid, fields in updates.items():
+            _check_fields(fields)
+            row = self._ensure(uid)
+            for name, value in fields.items():
+                self.users.columns[name][row] = int(value)
+            result[str(uid)] = self.users.record(row)
+        self.store.mark_dirty(len(result))
+        return result
+
+    async def get_wallet(self, uid):
+        row = self.users.row(uid)
+        return START_BALANCE if row is None else self.users.wallet[row]
+
+    async def add_wallet(self, uid, amount):
+        row = self._ensure(uid)
+        self.users.wallet[row] += int(amount)
+        self.store.mark_dirty()
+        return self.users.wallet[row]
+
+    async def adjust_wallets(self, deltas, require=None):
+        wallet = self.users.wallet
+        rows = {str(uid): (self._ensure(uid), int(delta)) for uid, delta in deltas.items()}
+        require = {str(uid): int(v) for uid, v in (require or {}).items()}
+        for uid, (row, delta) in rows.items():
+            if wallet[row] + delta < 0 or wallet[row] < require.get(uid, 0):
+                return None
+        for row, delta in rows.values():
+            wallet[row] += delta
+        self.store.mark_dirty()
+        return {uid: wallet[row] for uid, (row, _) in rows.items()}
+
+    def _add_xp(self, uid, amount):
+        users = self.users
+        row = self._ensure(uid)
+        users.xp[row], users.level[row] = result = level_up(users.xp[row] + int(amount), users.level[row])
+        return result
+
+    async def add_xp(self, uid, amount):
+        result = self._add_xp(uid, amount)
+        self.store.mark_dirty()
+        return result
+
+    async def add_xp_many(self, grants):
+        result = {str(uid): self._add_xp(uid, amount) for uid, amount in grants.items()}
+        self.store.mark_dirty(len(result))
+        return result
+
+    async def top_users(self, limit):
+        wallet, bank = self.users.wallet, self.users.bank
+        rows = self.users.rows
+        top = sorted(rows, key=lambda uid: wallet[rows[uid]] + bank[rows[uid]], reverse=True)
+        return [(str(uid), self.users.record(rows[uid])) for uid in top[:limit]]
+
+    async def iter_users(self, batch=1000):
+        uids = self.users.uids()
+        for start in range(0, len(uids), batch):
+            for uid in uids[start:start + batch]:
+                row = self.users.row(uid)
+                if row is not None:
+                    yield str(uid), self.users.record(row)
+            await asyncio.sleep(0)
+
+    async def get_ticket(self, channel_id):
+        return self.tickets.get(str(channel_id))
+
+    async def put_ticket(self, channel_id, record):
+        self.tickets[str(channel_id)] = record
+        self.store.mark_dirty()
+
+    async def delete_ticket(self, channel_id):
+        record = self.tickets.pop(str(channel_id), None)
+        if record is not None:
+            self.store.mark_dirty()
+        return record
+
+    async def add_ticket_count(self, staff_id, n=1):
+        staff_id = str(staff_id)
+        self.ticket_counts[staff_id] = self.ticket_counts.get(staff_id, 0) + n
+        self.store.mark_dirty()
+
+    async def load_tickets(self):
+        return list(self.tickets.items())
+
+    async def load_ticket_counts(self):
+        return dict(self.ticket_counts)
+
+    async def put_session(self, uid, row):
+        self.sessions[str(uid)] = dict(row, state=row["state"].hex())
+        self.store.mark_dirty()
+
+    async def delete_session(self, uid):
+        if self.sessions.pop(str(uid), None) is not None:
+            self.store.mark_dirty()
+
+    async def load_sessions(self):
+        return [(uid, dict(row, state=bytes.fromhex(row["state"]))) for uid, row in self.sessions.items()]
+
+    async def set_config(self, key, value):
+        self.config[key] = value
+        self.store.mark_dirty()
+
+
+# ----------------- SQLite Backend -----------------
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    user_id    INTEGER PRIMARY KEY,
+    wallet     INTEGER NOT NULL DEFAULT {START_BALANCE},
+    bank       INTEGER NOT NULL DEFAULT 0,
+    last_daily INTEGER NOT NULL DEFAULT 0,
+    xp         INTEGER NOT NULL DEFAULT {START_XP},
+    level      INTEGER NOT NULL DEFAULT {START_LEVEL}
+);
+CREATE INDEX IF NOT EXISTS users_worth ON users (wallet + bank DESC);
+CREATE INDEX IF NOT EXISTS users_level ON users (level DESC, xp DESC);
+CREATE TABLE IF NOT EXISTS tickets (
+    channel_id INTEGER PRIMARY KEY,
+    opener_id  INTEGER NOT NULL,
+    opened_at  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_opener ON tickets (opener_id);
+CREATE TABLE IF NOT EXISTS ticket_counts (
+    staff_id INTEGER PRIMARY KEY,
+    count    INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    user_id    INTEGER PRIMARY KEY,
+    game       TEXT NOT NULL,
+    stake      INTEGER NOT NULL,
+    state      BLOB NOT NULL,
+    channel_id INTEGER,
+    message_id INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS config (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+USER_COLUMNS = ", ".join(USER_FIELDS)
+
+
+class SqliteStorage(Storage):
+    """SQLite in WAL mode. One connection lives on a dedicated worker thread,
+    so queries never block the event loop and are serialized with each other.
+
+    If the database does not exist yet and `legacy_json` points at an existing
+    data.json, that file is imported once on first open.
+    """
+
+    def __init__(self, path, legacy_json=None):
+        super().__init__()
+        self.path = path
+        self.legacy_json = legacy_json
+        self._executor = None
+        self._db = None
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # Everything below prefixed with `_sync` runs on the worker thread.
+    def _sync_open(self):
+        fresh = not os.path.exists(self.path)
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(SCHEMA)
+        self._db = db
+        if fresh and self.legacy_json and os.path.exists(self.legacy_json):
+            with open(self.legacy_json, "r") as f:
+                self._sync_import(json.load(f))
+        return {k: json.loads(v) for k, v in db.execute("SELECT key, value FROM config")}
+
+    def _sync_import(self, data):
+        db = self._db
+        balances = data.get("balances", {})
+        xp = data.get("xp", {})
+        levels = data.get("levels", {})
+        users = set(balances) | set(xp) | set(levels)
+        rows = []
+        for uid in users:
+            bal = balances.get(uid, {})
+            rows.append((
+                int(uid),
+                int(bal.get("wallet", START_BALANCE)),
+                int(bal.get("bank", 0)),
+                int(bal.get("last_daily", 0)),
+                int(xp.get(uid, START_XP)),
+                int(levels.get(uid, START_LEVEL)),
+            ))
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(f"INSERT OR REPLACE INTO users (user_id, {USER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            db.executemany(
+                "INSERT OR REPLACE INTO tickets (channel_id, opener_id, opened_at) VALUES (?, ?, ?)",
+                [(int(cid), int(t["opener_id"]), int(t.get("opened_at", 0))) for cid, t in data.get("tickets", {}).items()],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO ticket_counts (staff_id, count) VALUES (?, ?)",
+                [(int(sid), int(n)) for sid, n in data.get("ticket_counts", {}).items()],
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)",
+                [(k, json.dumps(v)) for k, v in data.get("config", {}).items()],
+            )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def _sync_row(self, uid):
+        row = self._db.execute(f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?", (uid,)).fetchone()
+        return dict(zip(USER_FIELDS, row)) if row else None
+
+    def _sync_ensure(self, uid):
+        self._db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (uid,))
+        return self._sync_row(uid)
+
+    def _sync_update(self, uid, fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (uid,))
+            db.execute(f"UPDATE users SET {assignments} WHERE user_id = ?", (*map(int, fields.values()), uid))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _sync_update_many(self, updates):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = {}
+            for uid, fields in updates.items():
+                db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (uid,))
+                if fields:
+                    assignments = ", ".join(f"{name} = ?" for name in fields)
+                    db.execute(f"UPDATE users SET {assignments} WHERE user_id = ?", (*map(int, fields.values()), uid))
+                result[str(uid)] = self._sync_row(uid)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _sync_write_sessions(self, rows):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            for uid, row in rows.items():
+                if row is None:
+                    db.execute("DELETE FROM sessions WHERE user_id = ?", (uid,))
+                else:
+                    db.execute(
+                        "INSERT OR REPLACE INTO sessions (user_id, game, stake, state, channel_id, message_id, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (uid, row["game"], row["stake"], row["state"], row["channel_id"], row["message_id"], row["updated_at"]),
+                    )
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _sync_add_wallet(self, uid, amount):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (uid,))
+            wallet, = db.execute("UPDATE users SET wallet = wallet + ? WHERE user_id = ? RETURNING wallet", (amount, uid)).fetchone()
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return wallet
+
+    def _sync_adjust_wallets(self, deltas, require):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = {}
+            for uid, delta in deltas.items():
+                db.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (uid,))
+                wallet, = db.execute("SELECT wallet FROM users WHERE user_id = ?", (uid,)).fetchone()
+                if wallet + delta < 0 or wallet < require.get(uid, 0):
+                    db.execute("ROLLBACK")
+                    return None
+                result[str(uid)] = wallet + delta
+            db.executemany("UPDATE users SET wallet = ? WHERE user_id = ?", [(w, int(uid)) for uid, w in result.items()])
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _sync_add_xp(self, uid, amount):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._sync_ensure(uid)
+            xp, level = level_up(row["xp"] + amount, row["level"])
+            db.execute("UPDATE users SET xp = ?, level = ? WHERE user_id = ?", (xp, level, uid))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return xp, level
+
+    def _sync_add_xp_many(self, grants):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            result = {}
+            for uid, amount in grants.items():
+                row = self._sync_ensure(uid)
+                result[str(uid)] = xp, level = level_up(row["xp"] + amount, row["level"])
+                db.execute("UPDATE users SET xp = ?, level = ? WHERE user_id = ?", (xp, level, uid))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return result
+
+    def _sync_top(self, limit):
+        rows = self._db.execute(
+            f"SELECT user_id, {USER_COLUMNS} FROM users ORDER BY wallet + bank DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [(str(r[0]), dict(zip(USER_FIELDS, r[1:]))) for r in rows]
+
+    def _sync_page(self, after, limit):
+        rows = self._db.execute(
+            f"SELECT user_id, {USER_COLUMNS} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, limit)
+        ).fetchall()
+        return [(str(r[0]), dict(zip(USER_FIELDS, r[1:]))) for r in rows]
+
+    def _sync_exec(self, sql, params=()):
+        return self._db.execute(sql, params).fetchall()
+
+    async def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.config = await self._run(self._sync_open)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        if self._executor is not None:  # never opened, e.g. the login failed first
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def import_json(self, data):
+        return await self._run(self._sync_import, data)
+
+    async def get_user(self, uid):
+        return await self._run(self._sync_row, int(uid))
+
+    async def ensure_user(self, uid):
+        return await self._run(self._sync_ensure, int(uid))
+
+    async def update_user(self, uid, **fields):
+        _check_fields(fields)
+        if fields:
+            await self._run(self._sync_update, int(uid), fields)
+
+    async def update_users(self, updates):
+        for fields in updates.values():
+            _check_fields(fields)
+        return await self._run(self._sync_update_many, {int(uid): fields for uid, fields in updates.items()})
+
+    async def add_wallet(self, uid, amount):
+        return await self._run(self._sync_add_wallet, int(uid), int(amount))
+
+    async def adjust_wallets(self, deltas, require=None):
+        return await self._run(
+            self._sync_adjust_wallets,
+            {int(uid): int(d) for uid, d in deltas.items()},
+            {int(uid): int(v) for uid, v in (require or {}).items()},
+        )
+
+    async def add_xp(self, uid, amount):
+        return await self._run(self._sync_add_xp, int(uid), int(amount))
+
+    async def add_xp_many(self, grants):
+        return await self._run(self._sync_add_xp_many, {int(uid): int(n) for uid, n in grants.items()})
+
+    async def top_users(self, limit):
+        return await self._run(self._sync_top, limit)
+
+    async def iter_users(self, batch=1000):
+        after = -1
+        while True:
+            page = await self._run(self._sync_page, after, batch)
+            for item in page:
+                yield item
+            if len(page) < batch:
+                return
+            after = int(page[-1][0])
+
+    async def get_ticket(self, channel_id):
+        rows = await self._run(self._sync_exec, "SELECT opener_id, opened_at FROM tickets WHERE channel_id = ?", (int(channel_id),))
+        return {"opener_id": str(rows[0][0]), "opened_at": rows[0][1]} if rows else None
+
+    async def put_ticket(self, channel_id, record):
+        await self._run(
+            self._sync_exec,
+            "INSERT OR REPLACE INTO tickets (channel_id, opener_id, opened_at) VALUES (?, ?, ?)",
+            (int(channel_id), int(record["opener_id"]), int(record["opened_at"])),
+        )
+
+    async def delete_ticket(self, channel_id):
+        rows = await self._run(
+            self._sync_exec, "DELETE FROM tickets WHERE channel_id = ? RETURNING opener_id, opened_at", (int(channel_id),)
+        )
+        return {"opener_id": str(rows[0][0]), "opened_at": rows[0][1]} if rows else None
+
+    async def add_ticket_count(self, staff_id, n=1):
+        await self._run(
+            self._sync_exec,
+            "INSERT INTO ticket_counts (staff_id, count) VALUES (?, ?) "
+            "ON CONFLICT (staff_id) DO UPDATE SET count = count + excluded.count",
+            (int(staff_id), n),
+        )
+
+    async def load_tickets(self):
+        rows = await self._run(self._sync_exec, "SELECT channel_id, opener_id, opened_at FROM tickets")
+        return [(str(r[0]), {"opener_id": str(r[1]), "opened_at": r[2]}) for r in rows]
+
+    async def load_ticket_counts(self):
+        rows = await self._run(self._sync_exec, "SELECT staff_id, count FROM ticket_counts")
+        return {str(r[0]): r[1] for r in rows}
+
+    async def put_session(self, uid, row):
+        await self._run(
+            self._sync_exec,
+            "INSERT OR REPLACE INTO sessions (user_id, game, stake, state, channel_id, message_id, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (int(uid), row["game"], row["stake"], row["state"], row["channel_id"], row["message_id"], row["updated_at"]),
+        )
+
+    async def delete_session(self, uid):
+        await self._run(self._sync_exec, "DELETE FROM sessions WHERE user_id = ?", (int(uid),))
+
+    async def write_sessions(self, rows):
+        await self._run(self._sync_write_sessions, {int(uid): row for uid, row in rows.items()})
+
+    async def load_sessions(self):
+        rows = await self._run(
+            self._sync_exec, "SELECT user_id, game, stake, state, channel_id, message_id, updated_at FROM sessions"
+        )
+        return [
+            (str(r[0]), {"game": r[1], "stake": r[2], "state": bytes(r[3]), "channel_id": r[4], "message_id": r[5], "updated_at": r[6]})
+            for r in rows
+        ]
+
+    async def set_config(self, key, value):
+        await self._run(
+            self._sync_exec, "INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, json.dumps(value))
+        )
+        self.config[key] = value
+
+
+# ----------------- Factory -----------------
+def create_storage(backend, json_path="data.json", db_path="data.db", **kwargs):
+    if backend == "json":
+        return JsonStorage(json_path, **kwargs)
+    if backend == "sqlite":
+        return SqliteStorage(db_path, legacy_json=json_path)
+    raise ValueError(f"unknown storage backend {backend!r}")
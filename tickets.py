@@ -0,0 +1,84 @@
+import time
+
+
+# ----------------- Ticket Service -----------------
+class TicketService:
+    """Open tickets and per-staff close counts, indexed in memory.
+
+    `by_channel` maps channel -> ticket record and `by_opener` maps opener ->
+    channel. Both are built once by `load()` and kept in sync on every open and
+    close, so duplicate checks, closes and stats lookups never scan. All IDs
+    are normalized to strings, matching the keys in storage.
+    """
+
+    PENDING = ""  # by_opener placeholder while the ticket channel is being created
+
+    def __init__(self, storage, journal=None):
+        self.storage = storage
+        self.journal = journal
+        self.by_channel = {}
+        self.by_opener = {}
+        self.counts = {}
+
+    async def load(self):
+        self.by_channel = {
+            str(cid): dict(record, opener_id=str(record["opener_id"])) for cid, record in await self.storage.load_tickets()
+        }
+        self.by_opener = {str(record["opener_id"]): cid for cid, record in self.by_channel.items()}
+        self.counts = {str(sid): n for sid, n in (await self.storage.load_ticket_counts()).items()}
+
+    def __len__(self):
+        return len(self.by_channel)
+
+    def get(self, channel_id):
+        return self.by_channel.get(str(channel_id))
+
+    def channel_of(self, opener_id):
+        channel_id = self.by_opener.get(str(opener_id))
+        return channel_id or None
+
+    def reserve(self, opener_id):
+        """Claim the opener's slot before creating a channel. False if they
+        already have a ticket (or one is being created)."""
+        opener_id = str(opener_id)
+        if opener_id in self.by_opener:
+            return False
+        self.by_opener[opener_id] = self.PENDING
+        return True
+
+    def release(self, opener_id):
+        if self.by_opener.get(str(opener_id)) == self.PENDING:
+            del self.by_opener[str(opener_id)]
+
+    async def open(self, channel_id, opener_id):
+        channel_id, opener_id = str(channel_id), str(opener_id)
+        record = {"opener_id": opener_id, "opened_at": int(time.time())}
+        self.by_channel[channel_id] = record
+        self.by_opener[opener_id] = channel_id
+        # Journal first: ticket writes go straight to storage
+        if self.journal is not None:
+            await self.journal.commit("ticket_open", channel=channel_id, opener=opener_id, opened_at=record["opened_at"])
+        await self.storage.put_ticket(channel_id, record)
+        return record
+
+    async def close(self, channel_id, staff_id=None):
+        """Remove the ticket and credit `staff_id` with the close. Returns the
+        record, or None if the channel isn't a ticket."""
+        record = self.by_channel.pop(str(channel_id), None)
+        if record is None:
+            return None
+        if self.by_opener.get(record["opener_id"]) == str(channel_id):
+            del self.by_opener[record["opener_id"]]
+        if staff_id is not None:
+            staff_id = str(staff_id)
+            self.counts[staff_id] = self.counts.get(staff_id, 0) + 1
+        if self.journal is not None:
+            await self.journal.commit("ticket_close", channel=str(channel_id), staff=staff_id,
+                                      count=self.counts.get(staff_id) if staff_id is not None else None)
+        await self.storage.delete_ticket(channel_id)
+        if staff_id is not None:
+            await self.storage.add_ticket_count(staff_id)
+        return record
+
+    def count(self, staff_id):
+        return self.counts.get(str(staff_id), 0)
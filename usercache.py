@@ -0,0 +1,311 @@
+"""A bounded, write-back user cache in front of a Storage backend.
+
+Users are read from the backend the first time they are touched and then
+served from memory. At most `max_users` stay resident (least recently used
+first out), and users idle for `ttl` seconds are dropped as well, so memory
+follows the active users rather than every user ever seen. Changes are
+applied in memory and written back in batches: when a changed user is
+evicted, every `interval` seconds, and on flush()/close(). The journal
+covers anything not yet written back: each batch waits for `before_write`
+(journal.write_ahead) after it is taken and before it is written.
+"""
+import asyncio, logging, time
+from collections import OrderedDict
+from storage import START_BALANCE, Storage, _check_fields, new_user
+from xp import level_up
+
+log = logging.getLogger(__name__)
+
+
+# ----------------- Cached Storage -----------------
+class CachedStorage(Storage):
+    """Storage wrapper holding hot user records in an LRU.
+
+    Every user operation first makes its users resident and pins them, so
+    the records it reads and changes can't be evicted or loaded twice while
+    it waits on the backend. The change itself then happens without an
+    await, which keeps adjust_wallets' check-and-apply atomic like the
+    backends'. Session rows are buffered too and written back with the
+    users; tickets and config go straight to the backend.
+    """
+
+    deferred = True
+
+    def __init__(self, backend, max_users=50000, ttl=3600, interval=5.0, max_evicted=1000):
+        super().__init__()
+        self.backend = backend
+        self.max_users = max_users
+        self.ttl = ttl
+        self.interval = interval
+        self.max_evicted = max_evicted
+        self._lru = OrderedDict()  # uid -> [record or None if unknown, last used]
+        self._dirty = set()        # resident uids changed since the last write-back
+        self._evicted = {}         # changed records pushed out, waiting to be written
+        self._writing = {}         # copies of every record being written right now
+        self._sessions = {}        # session rows (None = deleted) waiting to be written
+        self._pins = {}
+        self._write_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.written = 0
+
+    def __len__(self):
+        return len(self._lru)
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    async def open(self):
+        await self.backend.open()
+        self.config = self.backend.config
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._stop.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self._write_back()
+        await self.backend.close()
+
+    async def flush(self):
+        await self._write_back()
+        await self.backend.flush()
+
+    # Residency
+    def _resident(self, uid):
+        entry = self._lru.get(uid)
+        if entry is not None:
+            self._lru.move_to_end(uid)
+            entry[1] = time.monotonic()
+            return True
+        for pending in (self._evicted, self._writing):
+            if uid in pending:
+                # Changed but not written yet: bring it back as still dirty
+                self._lru[uid] = [pending.pop(uid), time.monotonic()]
+                self._dirty.add(uid)
+                return True
+        return False
+
+    async def _hold(self, uids):
+        """Make `uids` resident and pin them; returns {uid: record or None}."""
+        uids = [str(uid) for uid in uids]
+        for uid in uids:
+            self._pins[uid] = self._pins.get(uid, 0) + 1
+        try:
+            for uid in uids:
+                if self._resident(uid):
+                    self.hits += 1
+                    continue
+                self.misses += 1
+                record = await self.backend.get_user(uid)
+                if not self._resident(uid):  # unless someone else loaded it meanwhile
+                    self._lru[uid] = [record, time.monotonic()]
+        except BaseException:
+            self._release(uids)
+            raise
+        return {uid: self._lru[uid][0] for uid in uids}
+
+    def _release(self, uids):
+        for uid in uids:
+            uid = str(uid)
+            n = self._pins[uid] - 1
+            if n:
+                self._pins[uid] = n
+            else:
+                del self._pins[uid]
+        self._trim()
+
+    def _evict(self, uid):
+        record, _ = self._lru.pop(uid)
+        self.evictions += 1
+        if uid in self._dirty:
+            self._dirty.discard(uid)
+            self._evicted[uid] = record
+            if len(self._evicted) >= self.max_evicted:
+                self._wake.set()
+
+    def _trim(self, cutoff=None):
+        # Over capacity, or (with cutoff) last used before it; oldest first, pinned users skipped
+        for uid in list(self._lru):
+            if len(self._lru) <= self.max_users and (cutoff is None or self._lru[uid][1] >= cutoff):
+                break
+            if uid not in self._pins:
+                self._evict(uid)
+
+    def _create(self, uid, records):
+        # Record for a held uid, creating the user if unknown
+        record = records[uid]
+        if record is None:
+            record = records[uid] = self._lru[uid][0] = new_user()
+            self._dirty.add(uid)
+        return record
+
+    # Write-back
+    async def _write_back(self):
+        async with self._write_lock:
+            batch = {uid: dict(self._lru[uid][0]) for uid in self._dirty}
+            batch.update((uid, dict(record)) for uid, record in self._evicted.items())
+            self._dirty, self._evicted = set(), {}
+            sessions, self._sessions = self._sessions, {}
+            if not batch and not sessions:
+                return
+            # Until the write lands the backend is stale, so a user evicted
+            # meanwhile is found (and reloaded) here rather than read from it.
+            # Separate copies: the batch is read off the event loop.
+            writing = {uid: dict(record) for uid, record in batch.items()}
+            self._writing.update(writing)
+            try:
+                await self._before_write()
+                if batch:
+                    await self.backend.update_users(batch)
+                if sessions:
+                    await self.backend.write_sessions(sessions)
+            except BaseException:
+                # Still owed: resident users are dirty again, the rest wait in
+                # _evicted (which may already hold a newer change) for a retry
+                for uid in batch:
+                    if uid in self._lru:
+                        self._dirty.add(uid)
+                    elif uid in self._writing:
+                        self._evicted.setdefault(uid, self._writing.pop(uid))
+                for uid, row in sessions.items():
+                    self._sessions.setdefault(uid, row)
+                raise
+            finally:
+                for uid, record in writing.items():
+                    if self._writing.get(uid) is record:
+                        del self._writing[uid]
+            self.written += len(batch)
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self.ttl:
+                self._trim(cutoff=time.monotonic() - self.ttl)
+            try:
+                await self._write_back()
+            except Exception:
+                log.exception("Writing back %d users failed", len(self._dirty) + len(self._evicted))
+
+    # Users
+    async def get_user(self, uid):
+        records = await self._hold([uid])
+        try:
+            record = records[str(uid)]
+            return None if record is None else dict(record)
+        finally:
+            self._release([uid])
+
+    async def ensure_user(self, uid):
+        records = await self._hold([uid])
+        try:
+            return dict(self._create(str(uid), records))
+        finally:
+            self._release([uid])
+
+    async def get_wallet(self, uid):
+        records = await self._hold([uid])
+        try:
+            record = records[str(uid)]
+            return START_BALANCE if record is None else record["wallet"]
+        finally:
+            self._release([uid])
+
+    async def update_user(self, uid, **fields):
+        await self.update_users({uid: fields})
+
+    async def update_users(self, updates):
+        for fields in updates.values():
+            _check_fields(fields)
+        records = await self._hold(updates)
+        try:
+            result = {}
+            for uid, fields in updates.items():
+                uid = str(uid)
+                record = self._create(uid, records)
+                record.update((name, int(value)) for name, value in fields.items())
+                self._dirty.add(uid)
+                result[uid] = dict(record)
+            return result
+        finally:
+            self._release(updates)
+
+    async def add_wallet(self, uid, amount):
+        return (await self.adjust_wallets({uid: amount}))[str(uid)]
+
+    async def adjust_wallets(self, deltas, require=None):
+        records = await self._hold(deltas)
+        try:
+            deltas = {str(uid): int(delta) for uid, delta in deltas.items()}
+            require = {str(uid): int(v) for uid, v in (require or {}).items()}
+            current = {uid: START_BALANCE if records[uid] is None else records[uid]["wallet"] for uid in deltas}
+            for uid, delta in deltas.items():
+                if current[uid] + delta < 0 or current[uid] < require.get(uid, 0):
+                    return None
+            result = {}
+            for uid, delta in deltas.items():
+                record = self._create(uid, records)
+                record["wallet"] += delta
+                self._dirty.add(uid)
+                result[uid] = record["wallet"]
+            return result
+        finally:
+            self._release(deltas)
+
+    async def add_xp(self, uid, amount):
+        return (await self.add_xp_many({uid: amount}))[str(uid)]
+
+    async def add_xp_many(self, grants):
+        records = await self._hold(grants)
+        try:
+            result = {}
+            for uid, amount in grants.items():
+                uid = str(uid)
+                record = self._create(uid, records)
+                record["xp"], record["level"] = result[uid] = level_up(record["xp"] + int(amount), record["level"])
+                self._dirty.add(uid)
+            return result
+        finally:
+            self._release(grants)
+
+    async def top_users(self, limit):
+        await self._write_back()
+        return await self.backend.top_users(limit)
+
+    async def iter_users(self, batch=1000):
+        # The backend gets every change first; resident records are newer still
+        await self._write_back()
+        async for uid, u in self.backend.iter_users(batch):
+            entry = self._lru.get(uid)
+            yield uid, (u if entry is None or entry[0] is None else dict(entry[0]))
+
+    # Sessions
+    async def put_session(self, uid, row):
+        self._sessions[str(uid)] = dict(row)
+
+    async def delete_session(self, uid):
+        self._sessions[str(uid)] = None
+
+    async def load_sessions(self):
+        await self._write_back()
+        return await self.backend.load_sessions()
+
+    # Everything else is not cached
+    async def get_ticket(self, channel_id): return await self.backend.get_ticket(channel_id)
+    async def put_ticket(self, channel_id, record): return await self.backend.put_ticket(channel_id, record)
+    async def delete_ticket(self, channel_id): return await self.backend.delete_ticket(channel_id)
+    async def add_ticket_count(self, staff_id, n=1): return await self.backend.add_ticket_count(staff_id, n)
+    async def load_tickets(self): return await self.backend.load_tickets()
+    async def load_ticket_counts(self): return await self.backend.load_ticket_counts()
+    async def set_config(self, key, value): return await self.backend.set_config(key, value)
@@ -0,0 +1,68 @@
+"""Compact in-memory user records.
+
+Each user is one row across typed arrays (one per field) plus one entry in a
+uid -> row dict, instead of a dict per user in `balances` and further
+string-keyed entries in `xp` and `levels`. See benchmarks/bench_userstore.py
+for the memory difference.
+"""
+from array import array
+
+FIELDS = ("wallet", "bank", "last_daily", "xp", "level")
+TYPECODES = {"wallet": "q", "bank": "q", "last_daily": "q", "xp": "q", "level": "l"}
+
+
+# ----------------- User Table -----------------
+class UserTable:
+    """Rows of USER_FIELDS keyed by integer user ID.
+
+    Lookups never create rows; only `insert` and `ensure` do. Columns are
+    exposed as attributes (`table.wallet[row]`) for hot paths that already
+    hold a row number.
+    """
+
+    def __init__(self, defaults):
+        self.defaults = {name: int(defaults[name]) for name in FIELDS}
+        self.rows = {}
+        self.columns = {name: array(TYPECODES[name]) for name in FIELDS}
+        for name, column in self.columns.items():
+            setattr(self, name, column)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, uid):
+        return int(uid) in self.rows
+
+    def row(self, uid):
+        return self.rows.get(int(uid))
+
+    def insert(self, uid, **values):
+        uid = int(uid)
+        if uid in self.rows:
+            raise KeyError(f"user {uid} already has a row")
+        row = self.rows[uid] = len(self.rows)
+        for name, column in self.columns.items():
+            column.append(int(values.get(name, self.defaults[name])))
+        return row
+
+    def ensure(self, uid):
+        row = self.rows.get(int(uid))
+        return row if row is not None else self.insert(uid)
+
+    def record(self, row):
+        return {name: column[row] for name, column in self.columns.items()}
+
+    def get(self, uid):
+        row = self.rows.get(int(uid))
+        return None if row is None else self.record(row)
+
+    def uids(self):
+        return list(self.rows)
+
+    def items(self):
+        for uid, row in self.rows.items():
+            yield uid, self.record(row)
+
+    def nbytes(self):
+        """Bytes held by the column buffers (the uid map is extra)."""
+        return sum(column.buffer_info()[1] * column.itemsize for column in self.columns.values())
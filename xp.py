@@ -0,0 +1,115 @@
+"""XP curve and batched XP grants.
+
+Going from level L to L+1 costs XP_STEP * L, so reaching level L from level 1
+takes XP_STEP * L * (L-1) / 2 in total. Levels are derived from that total in
+closed form instead of walking the curve one level at a time.
+"""
+import asyncio, logging
+from math import isqrt
+
+log = logging.getLogger(__name__)
+
+XP_STEP = 50  # XP needed per level: level L -> L+1 costs XP_STEP * L
+
+
+# ----------------- Curve -----------------
+def level_floor(level):
+    """Total XP at which `level` is reached (level 1 at 0)."""
+    return XP_STEP * level * (level - 1) // 2
+
+
+def total_xp(xp, level):
+    # XP earned since level 1
+    return level_floor(level) + xp
+
+
+def split_total_xp(total):
+    """(level, xp into that level) for `total` XP earned since level 1."""
+    # Largest L with XP_STEP * L(L-1)/2 <= total, from the quadratic formula
+    level = (XP_STEP + isqrt(XP_STEP * XP_STEP + 8 * XP_STEP * total)) // (2 * XP_STEP)
+    level = max(level, 1)
+    # isqrt floors; nudge in case the estimate is one off either way
+    while level_floor(level) > total:
+        level -= 1
+    while level_floor(level + 1) <= total:
+        level += 1
+    return level, total - level_floor(level)
+
+
+def level_up(xp, level):
+    """Normalize `xp` held at `level` into (xp, level) with xp below the next step."""
+    level, xp = split_total_xp(total_xp(xp, level))
+    return xp, level
+
+
+# ----------------- Accrual -----------------
+class XpAccrual:
+    """Buffers XP grants per user and applies them in bulk.
+
+    `grant()` only adds to an in-memory dict. Every `interval` seconds, or
+    once `max_pending` users are waiting, the whole batch is handed to
+    `apply(grants)` (e.g. storage.add_xp_many) in one call. A failed apply
+    puts the batch back so nothing is lost; `close()` flushes what is left.
+    """
+
+    def __init__(self, apply, interval=1.0, max_pending=5000):
+        self.apply = apply
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._wake = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._task = None
+        self.granted = 0
+        self.batches = 0
+
+    def grant(self, uid, amount):
+        if amount <= 0:
+            return
+        uid = str(uid)
+        self._pending[uid] = self._pending.get(uid, 0) + amount
+        self.granted += 1
+        if len(self._pending) >= self.max_pending:
+            self._wake.set()
+
+    def pending(self, uid):
+        """XP granted to `uid` that has not reached storage yet."""
+        return self._pending.get(str(uid), 0)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await self.apply(batch)
+        except BaseException:
+            for uid, amount in batch.items():
+                self._pending[uid] = self._pending.get(uid, 0) + amount
+            raise
+        self.batches += 1
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Applying %d XP grants failed", len(self._pending))
+
+    async def close(self):
+        # Stopped rather than cancelled so an apply in flight completes
+        if self._task is not None:
+            self._stop.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+        await self.flush()
+